@@ -0,0 +1,96 @@
+import argparse
+import time
+import torch
+
+from utils import utils_option as option
+from models.network_unet import UNetRes as net, UNetResInference, INFERENCE_MODES
+
+'''
+# --------------------------------------------
+# Latency of UNetRes per resolution and inference mode
+# --------------------------------------------
+# python benchmark_inference.py --opt options/test_drunet.json --modes fp32 bf16 bf16+channels_last
+'''
+
+RESOLUTIONS = [(480, 640), (600, 800), (720, 1280), (900, 1600), (1080, 1920)]
+
+
+def benchmark(model, mode, resolution, in_nc, device, repeats=5, warmup=2):
+    runner = UNetResInference(model, mode=mode)
+    x = torch.rand(1, in_nc, *resolution, device=device)
+
+    # First calls include compilation/tracing
+    for _ in range(warmup):
+        runner(x)
+
+    times = []
+    for _ in range(repeats):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        runner(x)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t0)
+
+    return sorted(times)[len(times)//2]
+
+
+def main(json_path='options/test_drunet.json'):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--modes', type=str, nargs='+', default=INFERENCE_MODES, help='Inference modes to compare')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=None, help='Resolutions as WxH, e.g. 1600x900')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--cpu', action='store_true', help='Benchmark on CPU even if CUDA is available')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=False)
+    opt = option.dict_to_nonedict(opt)
+    opt_netG = opt['netG']
+
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+
+    if args.resolutions:
+        resolutions = [tuple(int(n) for n in r.split('x'))[::-1] for r in args.resolutions]
+    else:
+        resolutions = RESOLUTIONS
+
+    # Latency does not depend on weights, use trained ones when available
+    model_path = opt['path']['pretrained_netG']
+    state_dict = None
+    try:
+        state_dict = torch.load(model_path, map_location='cpu')
+    except (OSError, TypeError, AttributeError):
+        print('No pretrained model found, using random weights')
+
+    results = {}
+    for mode in args.modes:
+        for resolution in resolutions:
+            # Fresh network per mode since modes change weights layout/dtype
+            model = net(in_nc=opt_netG['in_nc'], out_nc=opt_netG['out_nc'], nc=opt_netG['nc'], nb=opt_netG['nb'],
+                        act_mode=opt_netG['act_mode'], bias=opt_netG['bias'])
+            if state_dict is not None:
+                model.load_state_dict(state_dict, strict=True)
+            model = model.to(device)
+            try:
+                results[mode, resolution] = benchmark(model, mode, resolution, opt_netG['in_nc'], device, args.repeats)
+            except (RuntimeError, NotImplementedError) as e:
+                print('Mode {} failed at {}x{}: {}'.format(mode, resolution[1], resolution[0], e))
+                results[mode, resolution] = None
+
+    # Latency table [ms]
+    header = '{:>24s}'.format('mode \\ resolution') + ''.join(['{:>12s}'.format('{}x{}'.format(w, h)) for h, w in resolutions])
+    print('Median latency [ms] on {}'.format(device))
+    print(header)
+    for mode in args.modes:
+        row = '{:>24s}'.format(mode)
+        for resolution in resolutions:
+            t = results[mode, resolution]
+            row += '{:>12s}'.format('-' if t is None else '{:.1f}'.format(1000*t))
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import text_like_image
+from utils import utils_image as util
+from utils import utils_option as option
+from data.select_dataset import define_Dataset
+
+'''
+# --------------------------------------------
+# Dataset __getitem__ (read, crop, tensor conversion)
+# --------------------------------------------
+# drunet: H and L folders with same file names
+# drunet_finetune: H images, each with a subfolder of L captures
+# --------------------------------------------
+'''
+
+
+@pytest.fixture(scope='module')
+def dataroots(tmp_path_factory):
+    root = tmp_path_factory.mktemp('dataset')
+    for folder in ['H', 'L', 'finetune']:
+        (root / folder).mkdir()
+    for idx in range(4):
+        name = '{:03d}'.format(idx)
+        img_H = text_like_image(900, 1600, seed=idx)
+        img_L = text_like_image(900, 1600, seed=idx+100)
+        util.imsave(img_H, str(root / 'H' / (name + '.png')))
+        util.imsave(img_L, str(root / 'L' / (name + '.png')))
+        util.imsave(img_H, str(root / 'finetune' / (name + '.png')))
+        (root / 'finetune' / name).mkdir()
+        util.imsave(img_L, str(root / 'finetune' / name / (name + '_capture.png')))
+    return {'drunet': (str(root / 'H'), str(root / 'L')),
+            'drunet_finetune': (str(root / 'finetune'), None)}
+
+
+@pytest.mark.parametrize('phase', ['train', 'test'])
+@pytest.mark.parametrize('dataset_type', ['drunet', 'drunet_finetune'])
+def bench_getitem(benchmark, dataroots, phase, dataset_type):
+    dataroot_H, dataroot_L = dataroots[dataset_type]
+    dataset_opt = option.dict_to_nonedict({'phase': phase, 'dataset_type': dataset_type, 'n_channels': 3,
+                                           'dataroot_H': dataroot_H, 'dataroot_L': dataroot_L,
+                                           'H_size': 256, 'sigma': [0, 20], 'sigma_test': 15,
+                                           'num_patches_per_image': 2})
+    dataset = define_Dataset(dataset_opt)
+    benchmark(dataset.__getitem__, 0)
@@ -0,0 +1,28 @@
+import sys
+import subprocess
+import importlib.util
+import pytest
+
+'''
+# --------------------------------------------
+# Start-up time of the installed gr-tempest package
+# --------------------------------------------
+# Each round imports tempest in a fresh interpreter. A plain image source
+# flowgraph must not load torch/cv2/matplotlib, the enhancement sink does.
+# --------------------------------------------
+'''
+
+SCRIPTS = {
+    'image_source': "import sys, tempest; tempest.image_source; "
+                    "heavy = [m for m in ('torch', 'cv2', 'matplotlib') if m in sys.modules]; "
+                    "assert not heavy, 'loaded on import tempest: {}'.format(heavy)",
+    'buttonToFileSink': "import tempest; tempest.buttonToFileSink",
+}
+
+
+@pytest.mark.parametrize('block', list(SCRIPTS))
+def bench_import_tempest(benchmark, block):
+    if importlib.util.find_spec('gnuradio') is None or importlib.util.find_spec('tempest') is None:
+        pytest.skip('gnuradio and gr-tempest must be installed')
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', SCRIPTS[block]],), kwargs={'check': True},
+                       rounds=5, iterations=1)
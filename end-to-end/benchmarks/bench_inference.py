@@ -0,0 +1,33 @@
+import pytest
+import torch
+
+from conftest import RESOLUTIONS, RESOLUTION_IDS
+from models.network_unet import UNetRes
+
+'''
+# --------------------------------------------
+# UNetRes forward (DRUNet of options/test_drunet.json, random weights)
+# --------------------------------------------
+'''
+
+DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+@pytest.fixture(scope='module')
+def model():
+    model = UNetRes(in_nc=2, out_nc=1, nc=[64, 128, 256, 512], nb=4, act_mode='R', bias=False)
+    return model.eval().to(DEVICE)
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS, ids=RESOLUTION_IDS)
+def bench_unetres_forward(benchmark, model, resolution):
+    x = torch.rand(1, 2, *resolution, device=DEVICE)
+
+    def forward():
+        with torch.no_grad():
+            model(x)
+        if DEVICE.type == 'cuda':
+            torch.cuda.synchronize()
+
+    forward()  # warm-up (cudnn autotuning, allocator)
+    benchmark.pedantic(forward, rounds=3, iterations=1)
@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import text_like_image
+from utils import utils_image as util
+
+'''
+# --------------------------------------------
+# Validation metrics on a 1600x900 gray image pair
+# --------------------------------------------
+'''
+
+
+@pytest.fixture(scope='module')
+def image_pair():
+    return text_like_image(900, 1600, channels=1, seed=0)[..., 0], text_like_image(900, 1600, channels=1, seed=1)[..., 0]
+
+
+@pytest.mark.parametrize('metric', [util.calculate_psnr, util.calculate_ssim, util.calculate_edge_jaccard],
+                         ids=['psnr', 'ssim', 'edgeJaccard'])
+def bench_metric(benchmark, image_pair, metric):
+    benchmark(metric, *image_pair)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from conftest import RESOLUTIONS
+from folder_simulation import image_transmition_simulation, image_capture_simulation
+
+'''
+# --------------------------------------------
+# Capture simulation and blanking shift correction
+# --------------------------------------------
+'''
+
+SMALL = RESOLUTIONS[0]
+
+
+@pytest.fixture(scope='module')
+def transmitted(images):
+    I_Tx, resolution = image_transmition_simulation(images[SMALL], blanking=True)
+    v_total, h_total, _ = resolution
+    return I_Tx, h_total, v_total
+
+
+@pytest.mark.parametrize('N_harmonic', [3, 7])
+def bench_image_capture_simulation(benchmark, transmitted, N_harmonic):
+    I_Tx, h_total, v_total = transmitted
+    interpolator = int(np.ceil(N_harmonic/5))
+    benchmark.pedantic(image_capture_simulation, args=(I_Tx, h_total, v_total, N_harmonic),
+                       kwargs={'noise_std': 10, 'interpolator': interpolator}, rounds=3, iterations=1)
+
+
+@pytest.fixture(scope='module')
+def shifted_capture(images):
+    """Capture-like RGB image with the blanking moved to the middle of the frame"""
+    v_active, h_active = SMALL
+    I = np.zeros((525, 800, 3), dtype='uint8')
+    I[-v_active:, -h_active:] = images[SMALL]
+    return np.roll(I, (200, 300), axis=(0, 1))
+
+
+def bench_apply_blanking_shift(benchmark, gr_dtutils, shifted_capture):
+    benchmark(gr_dtutils.apply_blanking_shift, shifted_capture, h_active=640, v_active=480,
+              h_blanking=160, v_blanking=45)
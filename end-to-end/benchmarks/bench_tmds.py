@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import RESOLUTIONS, RESOLUTION_IDS
+from utils.DTutils import TMDS_encoding_original, TMDS_encoding, TMDS_serial, TMDS_decoding
+
+'''
+# --------------------------------------------
+# TMDS encoding, serialization and decoding
+# --------------------------------------------
+# The pure python paths take seconds per frame, they are measured on the
+# smallest resolution with a single round.
+# --------------------------------------------
+'''
+
+SMALL = RESOLUTIONS[0]
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS, ids=RESOLUTION_IDS)
+def bench_TMDS_encoding_original(benchmark, images, resolution):
+    I = images[resolution]
+    # First call compiles the numba function
+    TMDS_encoding_original(I[:8, :8], blanking=False)
+    benchmark(TMDS_encoding_original, I, blanking=True)
+
+
+def bench_TMDS_encoding(benchmark, images):
+    benchmark.pedantic(TMDS_encoding, args=(images[SMALL],), kwargs={'blanking': True}, rounds=1, iterations=1)
+
+
+@pytest.fixture(scope='module')
+def encoded(images):
+    return TMDS_encoding_original(images[SMALL], blanking=True)
+
+
+def bench_TMDS_serial(benchmark, encoded):
+    benchmark.pedantic(TMDS_serial, args=(encoded,), rounds=1, iterations=1)
+
+
+def bench_TMDS_decoding(benchmark, encoded):
+    benchmark.pedantic(TMDS_decoding, args=(encoded,), rounds=1, iterations=1)
@@ -0,0 +1,76 @@
+import os
+import sys
+import importlib.util
+import numpy as np
+import pytest
+
+'''
+# --------------------------------------------
+# Shared fixtures of the benchmarks
+# --------------------------------------------
+# end-to-end/ is added to the path so benchmarks import the modules the
+# same way the scripts do. The gr-tempest DTutils (apply_blanking_shift) is
+# loaded by file path since it has the same name as utils/DTutils.
+# Results are stored in benchmarks/.benchmarks whatever the working
+# directory, and encoded frames in a temporary TEMPEST_CACHE_DIR (the
+# user's cache is neither read nor filled).
+# --------------------------------------------
+'''
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+END_TO_END_DIR = os.path.dirname(BENCHMARKS_DIR)
+GR_TEMPEST_PYTHON_DIR = os.path.join(os.path.dirname(END_TO_END_DIR), 'gr-tempest', 'python')
+sys.path.insert(0, END_TO_END_DIR)
+
+# (v_active, h_active) of the VESA resolutions used by the project
+RESOLUTIONS = [(480, 640), (600, 800), (720, 1280), (900, 1600), (1080, 1920)]
+RESOLUTION_IDS = ['{}x{}'.format(w, h) for h, w in RESOLUTIONS]
+
+
+def text_like_image(v_active, h_active, channels=3, seed=0):
+    """Black text-like strokes on white background, as the training ground-truth"""
+    rng = np.random.default_rng(seed)
+    I = 255*np.ones((v_active, h_active, channels), dtype='uint8')
+    for row in range(8, v_active - 16, 24):
+        for col in range(8, h_active - 8, 10):
+            if rng.random() < 0.7:
+                I[row:row+12, col:col+rng.integers(2, 8)] = rng.integers(0, 80)
+    return I
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    """Relative file:// benchmark storage is relative to this folder, not the working directory"""
+    storage = config.getoption('benchmark_storage', None)
+    if storage and storage.startswith('file://') and not os.path.isabs(storage[len('file://'):]):
+        config.option.benchmark_storage = 'file://' + os.path.join(BENCHMARKS_DIR, storage[len('file://'):])
+
+
+@pytest.fixture(scope='session', autouse=True)
+def tmds_cache_dir(tmp_path_factory):
+    """Empty frame cache for the session, so encodings are measured instead of cache reads"""
+    cache_dir = str(tmp_path_factory.mktemp('tmds_cache'))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('TEMPEST_CACHE_DIR', cache_dir)
+        # CACHE_DIR is read at import, the benchmarks import it at collection
+        import utils.tmds_cache
+        mp.setattr(utils.tmds_cache, 'CACHE_DIR', cache_dir)
+        yield cache_dir
+
+
+@pytest.fixture(scope='session')
+def images():
+    return {resolution: text_like_image(*resolution) for resolution in RESOLUTIONS}
+
+
+@pytest.fixture(scope='session')
+def gr_dtutils():
+    pytest.importorskip('cv2')
+    pytest.importorskip('matplotlib')
+    # For its own imports (timings), outside of the tempest package
+    if GR_TEMPEST_PYTHON_DIR not in sys.path:
+        sys.path.append(GR_TEMPEST_PYTHON_DIR)
+    spec = importlib.util.spec_from_file_location('gr_DTutils', os.path.join(GR_TEMPEST_PYTHON_DIR, 'DTutils.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,148 @@
+import time
+import queue
+import threading
+import torch
+
+
+'''
+# --------------------------------------------
+# Prefetching device feeder
+# --------------------------------------------
+# for train_data in DataPrefetcher(train_loader, model.device):
+#     model.feed_data(train_data)  # already on the device
+#
+# A background thread takes the batches from the DataLoader, pins them and
+# copies them to the device (non-blocking, on a side CUDA stream), so the
+# next batch is ready while the current step computes. Time waiting for
+# data and time spent between batches (compute) are accumulated per pass,
+# see timing().
+# --------------------------------------------
+'''
+
+_END = object()
+
+
+def loader_options(dataset_opt, num_workers):
+    """pin_memory / persistent_workers / prefetch_factor DataLoader arguments of a dataset option"""
+    options = {'pin_memory': torch.cuda.is_available() if dataset_opt['dataloader_pin_memory'] is None
+                             else dataset_opt['dataloader_pin_memory']}
+    if num_workers > 0:
+        # Keep the workers (and their dataset copies) alive between epochs
+        options['persistent_workers'] = True if dataset_opt['dataloader_persistent_workers'] is None \
+                                        else dataset_opt['dataloader_persistent_workers']
+        if dataset_opt['dataloader_prefetch_factor']:
+            options['prefetch_factor'] = dataset_opt['dataloader_prefetch_factor']
+    return options
+
+
+def to_device(data, device, non_blocking=True):
+    if torch.is_tensor(data):
+        if device.type == 'cuda' and not data.is_pinned():
+            data = data.pin_memory()
+        return data.to(device, non_blocking=non_blocking)
+    if isinstance(data, dict):
+        return type(data)((k, to_device(v, device, non_blocking)) for k, v in data.items())
+    if isinstance(data, (list, tuple)):
+        return type(data)(to_device(v, device, non_blocking) for v in data)
+    return data
+
+
+def record_stream(data, stream):
+    """Tell the caching allocator the batch is used on stream"""
+    if torch.is_tensor(data):
+        data.record_stream(stream)
+    elif isinstance(data, dict):
+        for v in data.values():
+            record_stream(v, stream)
+    elif isinstance(data, (list, tuple)):
+        for v in data:
+            record_stream(v, stream)
+
+
+class DataPrefetcher():
+    def __init__(self, loader, device, num_prefetch=2):
+        """
+        Args:
+            loader: DataLoader (or any iterable of batches)
+            device: torch.device of the model
+            num_prefetch: batches kept ready on the device
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+        self.reset_timing()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def reset_timing(self):
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+        self.steps = 0
+
+    def timing(self):
+        """Average data wait and compute time per step [s] of the last pass"""
+        steps = max(self.steps, 1)
+        return self.wait_time / steps, self.compute_time / steps
+
+    def _load(self, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            if self.stream is not None:
+                torch.cuda.set_device(self.device)
+            for data in self.loader:
+                if self.stream is not None:
+                    with torch.cuda.stream(self.stream):
+                        data = to_device(data, self.device)
+                        ready = torch.cuda.Event()
+                        ready.record(self.stream)
+                else:
+                    data, ready = to_device(data, self.device), None
+                if not put((data, ready)):
+                    return
+        except Exception as e:
+            put((e, None))
+            return
+        put((_END, None))
+
+    def __iter__(self):
+        self.reset_timing()
+        batches = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._load, args=(batches, stop), daemon=True)
+        thread.start()
+
+        try:
+            last_time = None
+            while True:
+                t0 = time.perf_counter()
+                if last_time is not None:
+                    self.compute_time += t0 - last_time
+
+                data, ready = batches.get()
+                if data is _END:
+                    break
+                if isinstance(data, Exception):
+                    raise data
+                if ready is not None:
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(ready)
+                    record_stream(data, current_stream)
+
+                last_time = time.perf_counter()
+                self.wait_time += last_time - t0
+                self.steps += 1
+                yield data
+        finally:
+            # Also reached when the loop over the prefetcher is left early
+            stop.set()
+            thread.join()
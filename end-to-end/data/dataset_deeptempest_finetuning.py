@@ -4,6 +4,7 @@ import numpy as np
 import torch
 import torch.utils.data as data
 import utils.utils_image as util
+import utils.utils_capture as capture
 from utils.DTutils import is_natural_patch
 import itertools
 
@@ -30,6 +31,9 @@ class DatasetDrunetFineTune(data.Dataset):
         self.use_all_patches = opt['use_all_patches'] if opt['use_all_patches'] else False
         self.num_patches_per_image = opt['num_patches_per_image'] if opt['num_patches_per_image'] else 100
         self.skip_natural_patches = opt['skip_natural_patches'] if opt['skip_natural_patches'] else False
+        # 'stretch' (as the uint8 png captures) or 'raw' amplitudes of npy/npz captures
+        self.L_normalization = opt['L_normalization'] if opt['L_normalization'] else 'stretch'
+        self.L2tensor3 = util.uint2tensor3 if self.L_normalization == 'stretch' else util.single2tensor3
         self.use_abs_value = opt['use_abs_value'] if opt['use_abs_value'] else False
 
         # -------------------------------------
@@ -83,7 +87,8 @@ class DatasetDrunetFineTune(data.Dataset):
         img_H = util.imread_uint(H_path, self.n_channels_datasetload)       
 
         
-        img_L = util.imread_uint(L_path, self.n_channels_datasetload)[:,:,:2]       
+        # png captures or lossless npy/npz captures (memory-mapped, no decoding)
+        img_L = capture.imread_capture(L_path, self.L_normalization)
 
         # Temp solution for blanking images
         L_v, L_h = img_L.shape[:2]
@@ -94,8 +99,9 @@ class DatasetDrunetFineTune(data.Dataset):
         # Get module of complex image, stretch and to uint8
         if self.use_abs_value:
             img_L = img_L.astype('float')
-            img_L = np.abs(img_L[:,:,0]+1j*img_L[:,:,1])
-            img_L = 255*(img_L - img_L.min())/(img_L.max() - img_L.min())
+            img_L = np.abs(img_L[:,:,0]+1j*img_L[:,:,1])[:,:,np.newaxis]
+            if self.L_normalization == 'stretch':
+                img_L = 255*(img_L - img_L.min())/(img_L.max() - img_L.min())
 
         if self.opt['phase'] == 'train':
             """
@@ -156,7 +162,7 @@ class DatasetDrunetFineTune(data.Dataset):
             # HWC to CHW, numpy(uint) to tensor
             # ---------------------------------
             img_H = util.uint2tensor3(patch_H)
-            img_L = util.uint2tensor3(patch_L)
+            img_L = self.L2tensor3(patch_L)
 
             # ---------------------------------
             # get noise level
@@ -185,7 +191,7 @@ class DatasetDrunetFineTune(data.Dataset):
             # HWC to CHW, numpy(uint) to tensor
             # ---------------------------------
             img_H = util.uint2tensor3(img_H)
-            img_L = util.uint2tensor3(img_L)
+            img_L = self.L2tensor3(img_L)
 
             
             # ---------------------------------
@@ -3,6 +3,7 @@ import numpy as np
 import torch
 import torch.utils.data as data
 import utils.utils_image as util
+import utils.utils_capture as capture
 from utils.DTutils import is_natural_patch
 import itertools
 
@@ -30,12 +31,15 @@ class DatasetFFDNet(data.Dataset):
         self.num_patches_per_image = opt['num_patches_per_image'] if opt['num_patches_per_image'] else 100
         # self.num_patches_per_image = opt['num_patches_per_image'] if not(self.use_all_patches) else ((1280**2)//(self.patch_size)**2)    ### HARDCODED
         self.skip_natural_patches = opt['skip_natural_patches'] if opt['skip_natural_patches'] else False
+        # 'stretch' (as the uint8 png captures) or 'raw' amplitudes of npy/npz captures
+        self.L_normalization = opt['L_normalization'] if opt['L_normalization'] else 'stretch'
+        self.L2tensor3 = util.uint2tensor3 if self.L_normalization == 'stretch' else util.single2tensor3
 
         # -------------------------------------
         # get the path of H, return None if input is None
         # -------------------------------------
         self.paths_H = util.get_image_paths(opt['dataroot_H'])
-        self.paths_L = util.get_image_paths(opt['dataroot_L'])
+        self.paths_L = capture.get_capture_paths(opt['dataroot_L'])
 
         # Repeat every image in path list to get more than one patch per image
         if self.opt['phase'] == 'train':
@@ -61,7 +65,8 @@ class DatasetFFDNet(data.Dataset):
         img_H = util.imread_uint(H_path, self.n_channels_datasetload)       
 
         
-        img_L = util.imread_uint(L_path, self.n_channels_datasetload)[:,:,:2]       
+        # png captures or lossless npy/npz captures (memory-mapped, no decoding)
+        img_L = capture.imread_capture(L_path, self.L_normalization)
 
         # Temp solution for blanking images
         L_v, L_h = img_L.shape[:2]
@@ -131,7 +136,7 @@ class DatasetFFDNet(data.Dataset):
             # HWC to CHW, numpy(uint) to tensor
             # ---------------------------------
             img_H = util.uint2tensor3(patch_H)
-            img_L = util.uint2tensor3(patch_L)
+            img_L = self.L2tensor3(patch_L)
 
             # ---------------------------------
             # get noise level
@@ -160,7 +165,7 @@ class DatasetFFDNet(data.Dataset):
             # HWC to CHW, numpy(uint) to tensor
             # ---------------------------------
             img_H = util.uint2tensor3(img_H)
-            img_L = util.uint2tensor3(img_L)
+            img_L = self.L2tensor3(img_L)
 
             # img_H = util.uint2single(img_H)
 
@@ -0,0 +1,159 @@
+import os
+import sys
+import random
+import numpy as np
+import torch
+import torch.utils.data as data
+import utils.utils_image as util
+import utils.utils_capture as capture
+from utils.utils_dist import get_dist_info
+from utils.DTutils import TMDS_encoding_original, TMDS_serial
+from folder_simulation import image_capture_simulation, image_capture_simulation_harmonics
+
+# text_generation/text_utils.py, next to end-to-end
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'text_generation'))
+from text_utils import render_random_txt_img, random_text
+
+
+class DatasetTextStream(data.IterableDataset):
+    """
+    # -----------------------------------------
+    # Get L/H/text of random text screens, rendered
+    # and simulated in memory (no dataroot, no files).
+    # -----------------------------------------
+    # Every worker renders random text images as
+    # text_generation, simulates their TMDS captures
+    # as folder_simulation and yields patches (train)
+    # or whole images (test). len() is the number of
+    # samples of an epoch, split among workers/ranks.
+    # Training calls set_epoch() every epoch, so a
+    # fixed seed gives new images each epoch.
+    # -----------------------------------------
+    """
+
+    def __init__(self, opt):
+        super(DatasetTextStream, self).__init__()
+        self.opt = opt
+        self.patch_size = self.opt['H_size'] if opt['H_size'] else 64
+        self.epoch_size = opt['epoch_size'] if opt['epoch_size'] else 1000
+        self.img_shape = tuple(opt['img_shape']) if opt['img_shape'] else (1600, 900)  # (width, height)
+        self.text_size = opt['text_size'] if opt['text_size'] else 22
+        self.num_characters = opt['num_characters'] if opt['num_characters'] else 29000
+        self.num_patches_per_image = opt['num_patches_per_image'] if opt['num_patches_per_image'] else 100
+        self.captures_per_image = opt['captures_per_image'] if opt['captures_per_image'] else 1
+        self.L_normalization = opt['L_normalization'] if opt['L_normalization'] else 'stretch'
+        self.L2tensor3 = util.uint2tensor3 if self.L_normalization == 'stretch' else util.single2tensor3
+
+        # Capture simulation, as options/tempest_simulation.json
+        self.blanking = opt['blanking'] if opt['blanking'] else False
+        self.fps = opt['frames_per_second'] if opt['frames_per_second'] else 60
+        self.sdr_rate = opt['sdr_rate'] if opt['sdr_rate'] else 50e6
+        self.interpolator = opt['interpolator'] if opt['interpolator'] else None
+        self.differential_signaling = opt['differential_signaling'] if opt['differential_signaling'] else False
+        self.harmonics = opt['harmonics'] if opt['harmonics'] else [3]
+        self.sigma = opt['sigma'] if opt['sigma'] else [0, 0]
+        self.freq_error = opt['freq_error'] if opt['freq_error'] else [0, 15]
+        self.phase_error = opt['phase_error'] if opt['phase_error'] else [-1, 1]
+
+        # Fixed seed: same stream every epoch (validation). None: seeded by the DataLoader
+        self.seed = opt['seed']
+        if self.seed is None and self.opt['phase'] != 'train':
+            self.seed = 0
+        self.epoch = 0
+        # Passes over this copy, counts epochs in persistent workers (not reached by set_epoch)
+        self.iterations = 0
+
+    def __len__(self):
+        return self.epoch_size
+
+    def set_epoch(self, epoch):
+        """Epoch of the next pass, given to the workers started for it"""
+        self.epoch = epoch
+
+    def _shard(self):
+        """Index and number of the shards (worker of rank) of the stream"""
+        worker_info = data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        rank, world_size = get_dist_info()
+        return rank*num_workers + worker_id, world_size*num_workers
+
+    def _rng(self, shard):
+        if self.seed is not None and self.opt['phase'] != 'train':
+            entropy = [self.seed, shard]
+        elif self.seed is not None:
+            entropy = [self.seed, shard, self.epoch, self.iterations]
+        else:
+            # Different for every worker, and every epoch of persistent workers
+            entropy = [torch.initial_seed(), shard, self.epoch, self.iterations]
+        return np.random.default_rng(entropy)
+
+    def render(self, rng):
+        """Random text image H (H, W, 3) uint8 and its text"""
+        text_rng = random.Random(int(rng.integers(2**63)))
+        text = random_text(self.num_characters, text_rng)
+        text_color = text_rng.choices(["black","white"], weights=(70, 30), k=1)[0]
+        background_color = "black"*(text_color=="white") + "white"*(text_color=="black")
+        image, text = render_random_txt_img(text, self.img_shape, self.text_size, text_color, background_color, text_rng)
+        return np.array(image), text
+
+    def simulate(self, img_H, rng):
+        """captures_per_image complex captures of img_H, active area only, and their noise sigma"""
+        I_TMDS = TMDS_encoding_original(img_H, blanking=self.blanking)
+        I_Tx = TMDS_serial(I_TMDS)
+        v_total, h_total = I_TMDS.shape[:2]
+
+        sigma = int(rng.integers(self.sigma[0], self.sigma[1])) if self.sigma[1] > self.sigma[0] else self.sigma[0]
+        N_harmonics = rng.choice(self.harmonics, self.captures_per_image)
+        freq_errors = rng.integers(self.freq_error[0], self.freq_error[1], self.captures_per_image)
+        phase_errors = rng.uniform(self.phase_error[0], self.phase_error[1], self.captures_per_image)*np.pi
+
+        if self.captures_per_image == 1:
+            captures = [image_capture_simulation(I_Tx, h_total, v_total, N_harmonics[0], self.sdr_rate,
+                                                 sigma, self.fps, freq_errors[0], phase_errors[0],
+                                                 self.interpolator, self.differential_signaling, rng)]
+        else:
+            captures = image_capture_simulation_harmonics(I_Tx, h_total, v_total, N_harmonics, self.sdr_rate,
+                                                          sigma, self.fps, freq_errors, phase_errors,
+                                                          self.interpolator, self.differential_signaling, rng)
+
+        # Blanking removed, as the ground-truth
+        H, W = img_H.shape[:2]
+        v_offset, h_offset = (v_total - H)//2, (h_total - W)//2
+        return [I_capture[v_offset:v_offset + H, h_offset:h_offset + W] for I_capture in captures], sigma
+
+    def __iter__(self):
+        shard, num_shards = self._shard()
+        self.iterations += 1
+        rng = self._rng(shard)
+
+        num_samples = len(range(shard, self.epoch_size, num_shards))
+        index = 0
+        while index < num_samples:
+            img_H, text = self.render(rng)
+            captures, sigma = self.simulate(img_H, rng)
+
+            # Ground-truth as channels mean
+            img_H = np.mean(img_H, axis=2)[:,:,np.newaxis]
+            noise_level = torch.FloatTensor([sigma]).unsqueeze(1).unsqueeze(1)/255.0
+
+            for I_capture in captures:
+                img_L = capture.capture_channels(I_capture, self.L_normalization)
+
+                if self.opt['phase'] == 'train':
+                    H, W = img_H.shape[:2]
+                    patches = []
+                    for _ in range(min(self.num_patches_per_image, num_samples - index)):
+                        h_index = int(rng.integers(0, max(0, H - self.patch_size) + 1))
+                        w_index = int(rng.integers(0, max(0, W - self.patch_size) + 1))
+                        patches.append((img_H[h_index:h_index + self.patch_size, w_index:w_index + self.patch_size],
+                                        img_L[h_index:h_index + self.patch_size, w_index:w_index + self.patch_size]))
+                else:
+                    patches = [(img_H, img_L)]
+
+                for patch_H, patch_L in patches:
+                    name = 'text_stream_{:d}_{:06d}.png'.format(shard, index)
+                    index += 1
+                    yield {'L': self.L2tensor3(patch_L), 'H': util.uint2tensor3(patch_H), 'C': noise_level,
+                           'text': text, 'L_path': name, 'H_path': name}
+                    if index >= num_samples:
+                        return
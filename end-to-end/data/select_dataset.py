@@ -29,6 +29,9 @@ def define_Dataset(dataset_opt):
     elif dataset_type in ['drunet_finetune']:
         from data.dataset_deeptempest_finetuning import DatasetDrunetFineTune as D
 
+    elif dataset_type in ['text_stream']:
+        from data.dataset_text_stream import DatasetTextStream as D
+
     elif dataset_type in ['fdncnn', 'denoising-noiselevelmap']:
         from data.dataset_fdncnn import DatasetFDnCNN as D
 
@@ -18,8 +18,11 @@ import time as time
 import numpy as np
 from skimage.io import imread
 from scipy import signal
+from scipy import fft as sp_fft
 from PIL import Image
 from utils.DTutils import TMDS_encoding_original, TMDS_serial
+from utils.tmds_cache import cached_encoding
+from utils.utils_capture import save_capture, is_capture_file
 import logging
 from utils import utils_logger
 from datetime import datetime
@@ -37,8 +40,8 @@ def get_subfolders_names_from_folder(folder):
 
 def image_transmition_simulation(I, blanking=False):
     
-    # Encode image for TMDS
-    I_TMDS = TMDS_encoding_original (I, blanking = blanking)
+    # Encode image for TMDS (or reuse the cached encoding)
+    I_TMDS = cached_encoding(I, TMDS_encoding_original, blanking = blanking, blanking_layout='fill-centred')
     
     # Serialize pixel bits and sum channel signals
     I_TMDS_Tx = TMDS_serial(I_TMDS)
@@ -47,17 +50,16 @@ def image_transmition_simulation(I, blanking=False):
 
 def image_capture_simulation(I_Tx, h_total, v_total, N_harmonic, sdr_rate = 50e6,
                              noise_std=0, fps=60, freq_error=0, phase_error=0, 
-                             interpolator=None, diff_signaling=False):
+                             interpolator=None, diff_signaling=False, rng=None):
     
     # Compute pixelrate and bitrate
     px_rate = h_total*v_total*fps
     bit_rate = 10*px_rate
 
     # Continuous samples (interpolate)
-    if interpolator:
-        sample_rate = interpolator*bit_rate
-    else:
+    if not interpolator:
         interpolator = int(np.ceil(N_harmonic/5)) # Condition for sampling rate
+    sample_rate = interpolator*bit_rate
 
     if interpolator > 1:
         I_Tx_continuous = np.repeat(I_Tx,interpolator)
@@ -70,10 +72,11 @@ def image_capture_simulation(I_Tx, h_total, v_total, N_harmonic, sdr_rate = 50e6
     
     Nsamples = len(I_Tx_continuous)
 
-    # Add Gaussian noise
+    # Add Gaussian noise, from rng when given (np.random otherwise)
     if noise_std > 0:
+        normal = np.random.normal if rng is None else rng.normal
         noise_sigma = noise_std/15.968719423 # sqrt(255)~15.968719423
-        I_Tx_noisy = I_Tx_continuous + np.random.normal(0, noise_sigma, Nsamples) + 1j*np.random.normal(0, noise_sigma,Nsamples)
+        I_Tx_noisy = I_Tx_continuous + normal(0, noise_sigma, Nsamples) + 1j*normal(0, noise_sigma,Nsamples)
     else:
         I_Tx_noisy = I_Tx_continuous
         
@@ -94,8 +97,93 @@ def image_capture_simulation(I_Tx, h_total, v_total, N_harmonic, sdr_rate = 50e6
     
     return I_capture
 
+def image_capture_simulation_harmonics(I_Tx, h_total, v_total, harmonics, sdr_rate = 50e6,
+                                       noise_std=0, fps=60, freq_errors=0, phase_errors=0,
+                                       interpolator=None, diff_signaling=False, rng=None):
+    """
+    Captures of one transmitted frame for a list of pixel harmonics (and
+    frequency/phase errors), for little more than the cost of one.
+
+    The analog signal is upsampled and transformed once. Every capture is the
+    SDR band around its harmonic, taken from that spectrum (shift by whole
+    bins, the rest of the frequency error is applied in time) and brought to
+    the SDR rate with a short inverse FFT, instead of modulating and
+    resampling the whole signal as image_capture_simulation does.
+
+    Noise is drawn from rng (a np.random.Generator) when given, from the
+    global np.random otherwise.
+
+    Returns:
+        list of (v_total, h_total) complex captures, one per harmonic
+    """
+    harmonics = np.atleast_1d(harmonics)
+    freq_errors = np.broadcast_to(freq_errors, harmonics.shape)
+    phase_errors = np.broadcast_to(phase_errors, harmonics.shape)
+
+    # Compute pixelrate and bitrate
+    px_rate = h_total*v_total*fps
+    bit_rate = 10*px_rate
+
+    # Continuous samples (interpolate), enough for the highest harmonic
+    if not interpolator:
+        interpolator = int(np.ceil(np.max(harmonics)/5)) # Condition for sampling rate
+    sample_rate = interpolator*bit_rate
+
+    if interpolator > 1:
+        I_Tx_continuous = np.repeat(I_Tx,interpolator)
+    else:
+        I_Tx_continuous = I_Tx
+
+    # Differential signaling
+    if (diff_signaling) and (interpolator != 1):
+        I_Tx_continuous = np.diff(I_Tx_continuous)
+
+    # Spectrum of the (periodic) frame, shared by all the harmonics
+    Nsamples = len(I_Tx_continuous)
+    spectrum = sp_fft.rfft(I_Tx_continuous.astype('float32'), workers=-1)
+    bin_rate = sample_rate/Nsamples
+
+    # Bins of the SDR band around baseband (FFT order) and SDR time array
+    N_sdr = int(round(Nsamples*sdr_rate/sample_rate))
+    band = np.fft.fftfreq(N_sdr, 1/N_sdr).astype(int)
+    t_sdr = np.arange(N_sdr)/(N_sdr*bin_rate)
+
+    normal = np.random.normal if rng is None else rng.normal
+    captures = []
+    for N_harmonic, freq_error, phase_error in zip(harmonics, freq_errors, phase_errors):
+
+        # AM modulation frequency according to pixel harmonic, in whole bins plus residual
+        harm = N_harmonic*px_rate + freq_error
+        shift = int(round(harm/bin_rate))
+        residual = harm - shift*bin_rate
+
+        # Modulated spectrum X[m-shift] on the SDR band (real signal: X[-m] = conj(X[m]))
+        index = np.mod(band - shift, Nsamples)
+        mirrored = index > Nsamples//2
+        I_band = spectrum[np.where(mirrored, Nsamples - index, index)]
+        I_band[mirrored] = np.conj(I_band[mirrored])
+
+        # Band-limited decimation to the SDR rate, residual frequency and phase error
+        I_Rx = sp_fft.ifft(I_band, workers=-1)*(N_sdr/Nsamples)
+        I_Rx = I_Rx*np.exp(2j*np.pi*residual*t_sdr + 1j*phase_error)
+
+        # Add Gaussian noise, with the in-band power of image_capture_simulation
+        if noise_std > 0:
+            noise_sigma = noise_std/15.968719423*np.sqrt(N_sdr/Nsamples) # sqrt(255)~15.968719423
+            I_Rx = I_Rx + normal(0, noise_sigma, N_sdr) + 1j*normal(0, noise_sigma, N_sdr)
+
+        # Reshape signal to the image size
+        captures.append(signal.resample(I_Rx, h_total*v_total).reshape(v_total,h_total))
+
+    return captures
+
 def save_simulation_image(I,path_and_name):
-    
+
+    # Lossless complex capture (.npy/.npz), PNG otherwise
+    if is_capture_file(path_and_name):
+        save_capture(I,path_and_name)
+        return
+
     v_total,h_total = I.shape
     
     I_save = np.zeros((v_total,h_total,3))
@@ -111,6 +199,34 @@ def save_simulation_image(I,path_and_name):
     im = Image.fromarray(I_save.astype('uint8'))
     im.save(path_and_name)
     
+def simulate_image_captures(I, image_name, image_ext, subfolder_path, captures_per_image, blanking,
+                            fps, sdr_rate, interpolator, differential_signaling, harmonics,
+                            freq_error_range, phase_error_range, sigma, logger):
+    """Save captures_per_image captures of image I in subfolder_path, with random harmonics and errors"""
+
+    # Random channel effects, one per capture
+    freq_errors = np.random.randint(freq_error_range[0], freq_error_range[1], captures_per_image)
+    phase_errors = np.random.uniform(phase_error_range[0], phase_error_range[1], captures_per_image)*np.pi
+
+    # Different harmonics while there are enough
+    N_harmonics = np.random.choice(harmonics, captures_per_image, replace=captures_per_image > len(harmonics))
+
+    message = f'Initiate simulation for image "{image_name}{image_ext}" with {list(N_harmonics)} pixel harmonic frequencies, {list(freq_errors)} Hz errors.'
+    logger.info(message)
+
+    # TMDS coding and bit serialization, once for all the captures
+    I_Tx, resolution = image_transmition_simulation(I, blanking=blanking)
+    v_res, h_res, _ = resolution
+
+    I_captures = image_capture_simulation_harmonics(I_Tx, h_res, v_res, N_harmonics, sdr_rate,
+                                                    sigma, fps, freq_errors, phase_errors,
+                                                    interpolator, differential_signaling)
+
+    os.makedirs(subfolder_path, exist_ok=True)
+    for i, (I_capture, N_harmonic, freq_error) in enumerate(zip(I_captures, N_harmonics, freq_errors)):
+        path = os.path.join(subfolder_path, '{}_{}harm_{}Hz_{}{}'.format(image_name, N_harmonic, freq_error, i, image_ext))
+        save_simulation_image(I_capture,path)
+
 def main(simulation_options_path = 'options/tempest_simulation.json'):
 
     # Load JSON options file
@@ -157,6 +273,10 @@ def main(simulation_options_path = 'options/tempest_simulation.json'):
     freq_error_range = options['options']['random']['freq_error']
     phase_error_range = options['options']['random']['phase_error']
     sigma = options['options']['random']['sigma']
+    # Several captures per image (subfolder per image) from a single spectrum
+    captures_per_image = options['options'].get('captures_per_image', 1)
+    # Lossless complex captures (npy/npz) instead of stretched uint8 images
+    capture_format = options['options'].get('capture_format')
 
     # Process possible sigma types
     if type(sigma) == list:
@@ -175,10 +295,19 @@ def main(simulation_options_path = 'options/tempest_simulation.json'):
 
     for image in images:
 
+        image_name, image_ext = os.path.splitext(image)
+        capture_ext = '.'+capture_format if capture_format else image_ext
+
         # Check if image already simulated
         if image in output_existing_images:
             output_existing_images.remove(image)
             continue
+        if capture_format and os.path.exists(os.path.join(output_folder, image_name+capture_ext)):
+            continue
+        subfolder_path = os.path.join(output_folder, image_name)
+        if captures_per_image > 1 and os.path.isdir(subfolder_path) and \
+                len(os.listdir(subfolder_path)) >= captures_per_image:
+            continue
         
         # timestamp for simulation starting
         t1_image = time.time()
@@ -187,6 +316,15 @@ def main(simulation_options_path = 'options/tempest_simulation.json'):
         image_path = os.path.join(input_folder,image)
         I = imread(image_path)
 
+        if captures_per_image > 1:
+            simulate_image_captures(I, image_name, capture_ext, subfolder_path, captures_per_image, blanking,
+                                    fps, sdr_rate, interpolator, differential_signaling, harmonics,
+                                    freq_error_range, phase_error_range, sigma, logger)
+            t_image = time.time()-t1_image
+            t_all_images += t_image
+            logger.info('Processing time: {:.2f}s\n'.format(t_image))
+            continue
+
         # Random channel effects
         freq_error = np.random.randint(freq_error_range[0], freq_error_range[1])
         phase_error = np.random.uniform(phase_error_range[0], phase_error_range[1])*np.pi
@@ -206,7 +344,7 @@ def main(simulation_options_path = 'options/tempest_simulation.json'):
                                              sigma, fps, freq_error, phase_error,
                                              interpolator, differential_signaling)
         
-        path = os.path.join(output_folder,image)
+        path = os.path.join(output_folder,image_name+capture_ext)
         
         save_simulation_image(I_capture,path)
 
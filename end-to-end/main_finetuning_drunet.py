@@ -17,6 +17,7 @@ from utils import utils_option as option
 from utils.utils_dist import get_dist_info, init_dist
 
 from data.select_dataset import define_Dataset
+from data.data_prefetcher import DataPrefetcher, loader_options
 from models.select_model import define_Model
 
 
@@ -44,7 +45,8 @@ def main(json_path='options/train_drunet_finetuning.json'):
     parser.add_argument('--dist', default=False)
 
     opt = option.parse(parser.parse_args().opt, is_train=True)
-    opt['dist'] = parser.parse_args().dist
+    # torchrun sets WORLD_SIZE (and RANK, LOCAL_RANK, MASTER_ADDR, MASTER_PORT)
+    opt['dist'] = parser.parse_args().dist or int(os.environ.get('WORLD_SIZE', 1)) > 1
 
     # ----------------------------------------
     # distributed settings
@@ -97,7 +99,8 @@ def main(json_path='options/train_drunet_finetuning.json'):
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
 
     '''
     # ----------------------------------------
@@ -124,13 +127,15 @@ def main(json_path='options/train_drunet_finetuning.json'):
             if opt['rank'] == 0:
                 logger.info('Number of train images: {:,d}, iters: {:,d}'.format(len(train_set), train_size))
             if opt['dist']:
+                # Batch is split among all processes, workers among the processes of this node
+                procs_per_node = int(os.environ.get('LOCAL_WORLD_SIZE', opt['world_size']))
                 train_sampler = DistributedSampler(train_set, shuffle=dataset_opt['dataloader_shuffle'], drop_last=True, seed=seed)
                 train_loader = DataLoader(train_set,
-                                          batch_size=dataset_opt['dataloader_batch_size']//opt['num_gpu'],
-                                          shuffle=True,
-                                          num_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],
+                                          batch_size=max(1, dataset_opt['dataloader_batch_size']//opt['world_size']),
+                                          shuffle=False,
+                                          num_workers=dataset_opt['dataloader_num_workers']//procs_per_node,
                                           drop_last=True,
-                                          pin_memory=True,
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']//procs_per_node),
                                           sampler=train_sampler)
             else:
                 train_loader = DataLoader(train_set,
@@ -138,13 +143,13 @@ def main(json_path='options/train_drunet_finetuning.json'):
                                           shuffle=dataset_opt['dataloader_shuffle'],
                                           num_workers=dataset_opt['dataloader_num_workers'],
                                           drop_last=True,
-                                          pin_memory=True)
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']))
 
         elif phase == 'test':
             test_set = define_Dataset(dataset_opt)
             test_loader = DataLoader(test_set, batch_size=1,
                                      shuffle=False, num_workers=1,
-                                     drop_last=False, pin_memory=True)
+                                     drop_last=False, pin_memory=torch.cuda.is_available())
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -180,6 +185,9 @@ def main(json_path='options/train_drunet_finetuning.json'):
     '''
     current_step = current_epoch*train_size
 
+    # Next batch copied to the device while the current step computes
+    train_prefetcher = DataPrefetcher(train_loader, model.device)
+
     for epoch in range(opt['train']['epochs']):  # keep running
         
         # Update epoch
@@ -191,23 +199,18 @@ def main(json_path='options/train_drunet_finetuning.json'):
             train_sampler.set_epoch(current_epoch)
 
         idx = 0
-        for i, train_data in enumerate(train_loader):
+        for i, train_data in enumerate(train_prefetcher):
 
             idx += 1
             current_step += 1
 
             # -------------------------------
-            # 1) update learning rate
-            # -------------------------------
-            model.update_learning_rate(current_step)
-
-            # -------------------------------
-            # 2) feed patch pairs
+            # 1) feed patch pairs
             # -------------------------------
             model.feed_data(train_data)
 
             # -------------------------------
-            # 3) optimize parameters
+            # 2) optimize parameters (and learning rate, once per optimizer step)
             # -------------------------------
             model.optimize_parameters(current_step)
 
@@ -232,7 +235,9 @@ def main(json_path='options/train_drunet_finetuning.json'):
                                                                                 model.current_learning_rate(),
                                                                                 epoch_loss
                                                                                 )
-        logger.info(message)
+        message += 'data: {:.3f}s, compute: {:.3f}s per iter'.format(*train_prefetcher.timing())
+        if opt['rank'] == 0:
+            logger.info(message)
 
         # -------------------------------
         # Save model
@@ -309,6 +314,11 @@ def main(json_path='options/train_drunet_finetuning.json'):
 
             # testing log
             logger.info('<epoch:{:3d}, iter:{:8,d}, Average PSNR : {:<.2f}dB, Average SSIM : {:.3f}, Average edgeJaccard : {:.3f}, Average loss : {:.3e}\n'.format(current_epoch, current_step, avg_psnr, avg_ssim, avg_edgeJaccard, avg_loss))
+            model.save_metrics(current_epoch, {'psnr': avg_psnr, 'ssim': avg_ssim, 'edgeJaccard': avg_edgeJaccard, 'loss': avg_loss})
+
+    # Wait for the checkpoints still being written, stop the writer
+    model.close_checkpoints()
+
 
 if __name__ == '__main__':
     main()
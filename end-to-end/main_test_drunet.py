@@ -99,13 +99,21 @@ def main(json_path='options/test_drunet.json'):
     act_mode = opt_netG['act_mode']
     bias = opt_netG['bias']
 
-    from models.network_unet import UNetRes as net
-    model = net(in_nc=in_nc, out_nc=out_nc, nc=nc, nb=nb, act_mode=act_mode, bias=bias)
-    model.load_state_dict(torch.load(model_path), strict=True)
-    model.eval()
-    for k, v in model.named_parameters():
-        v.requires_grad = False
-    model = model.to(device)
+    from models.network_unet import UNetRes as net, UNetResInference, load_quantized_model
+    if model_path.endswith('.pt'):
+        # Static int8 model from quantize_drunet.py, runs on CPU only
+        device = torch.device('cpu')
+        model = load_quantized_model(model_path)
+        logger.info('Inference mode: int8')
+    else:
+        model = net(in_nc=in_nc, out_nc=out_nc, nc=nc, nb=nb, act_mode=act_mode, bias=bias)
+        model.load_state_dict(torch.load(model_path), strict=True)
+        model.eval()
+        for k, v in model.named_parameters():
+            v.requires_grad = False
+        model = model.to(device)
+        model = UNetResInference(model, mode=opt_netG['inference_mode'])
+        logger.info('Inference mode: {}'.format(opt_netG['inference_mode'] or 'fp32'))
     logger.info('Model path: {:s}'.format(model_path))
     number_parameters = sum(map(lambda x: x.numel(), model.parameters()))
     logger.info('Params number: {}'.format(number_parameters))
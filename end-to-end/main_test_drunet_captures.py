@@ -101,13 +101,15 @@ def main(json_path='options/train_drunet_finetuning.json'):
     act_mode = opt_netG['act_mode']
     bias = opt_netG['bias']
 
-    from models.network_unet import UNetRes as net
+    from models.network_unet import UNetRes as net, UNetResInference
     model = net(in_nc=in_nc, out_nc=out_nc, nc=nc, nb=nb, act_mode=act_mode, bias=bias)
     model.load_state_dict(torch.load(model_path), strict=True)
     model.eval()
     for k, v in model.named_parameters():
         v.requires_grad = False
     model = model.to(device)
+    model = UNetResInference(model, mode=opt_netG['inference_mode'])
+    logger.info('Inference mode: {}'.format(opt_netG['inference_mode'] or 'fp32'))
     logger.info('Model path: {:s}'.format(model_path))
     number_parameters = sum(map(lambda x: x.numel(), model.parameters()))
     logger.info('Params number: {}'.format(number_parameters))
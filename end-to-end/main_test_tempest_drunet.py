@@ -145,6 +145,7 @@ def main(json_path='options/train_drunet.json'):
 
     model = define_Model(opt)
     model.load()
+    model.set_inference_mode(opt['netG']['inference_mode'])
 
     # model.eval()
     # for k, v in model.named_parameters():
@@ -104,7 +104,8 @@ def main(json_path='options/test_drunet.json'):
         # model.load_state_dict(torch.load(model_path), strict=True)
         # model = model.to(device)
         model = define_Model(opt)
-        model.init_train()
+        model.load()                          # inference only, no optimizer or checkpoint writer
+        model.set_inference_mode(opt['netG']['inference_mode'])
         # model.eval()
         # for k, v in model.named_parameters():
         #     v.requires_grad = False
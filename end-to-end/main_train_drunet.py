@@ -6,7 +6,7 @@ import random
 import numpy as np
 from collections import OrderedDict
 import logging
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torch.utils.data.distributed import DistributedSampler
 import torch
 
@@ -16,6 +16,7 @@ from utils import utils_option as option
 from utils.utils_dist import get_dist_info, init_dist
 
 from data.select_dataset import define_Dataset
+from data.data_prefetcher import DataPrefetcher, loader_options
 from models.select_model import define_Model
 
 
@@ -43,7 +44,8 @@ def main(json_path='options/train_drunet.json'):
     parser.add_argument('--dist', default=False)
 
     opt = option.parse(parser.parse_args().opt, is_train=True)
-    opt['dist'] = parser.parse_args().dist
+    # torchrun sets WORLD_SIZE (and RANK, LOCAL_RANK, MASTER_ADDR, MASTER_PORT)
+    opt['dist'] = parser.parse_args().dist or int(os.environ.get('WORLD_SIZE', 1)) > 1
 
     # ----------------------------------------
     # distributed settings
@@ -100,7 +102,8 @@ def main(json_path='options/train_drunet.json'):
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
 
     '''
     # ----------------------------------------
@@ -118,28 +121,33 @@ def main(json_path='options/train_drunet.json'):
             train_size = int(math.floor(len(train_set) / dataset_opt['dataloader_batch_size']))
             if opt['rank'] == 0:
                 logger.info('Number of train images: {:,d}, iters: {:,d}'.format(len(train_set), train_size))
+            # Streams (e.g. text_stream) are sharded among ranks and workers by the dataset itself
+            streaming = isinstance(train_set, IterableDataset)
             if opt['dist']:
-                train_sampler = DistributedSampler(train_set, shuffle=dataset_opt['dataloader_shuffle'], drop_last=True, seed=seed)
+                # Batch is split among all processes, workers among the processes of this node
+                procs_per_node = int(os.environ.get('LOCAL_WORLD_SIZE', opt['world_size']))
+                train_sampler = None if streaming else \
+                    DistributedSampler(train_set, shuffle=dataset_opt['dataloader_shuffle'], drop_last=True, seed=seed)
                 train_loader = DataLoader(train_set,
-                                          batch_size=dataset_opt['dataloader_batch_size']//opt['num_gpu'],
-                                          shuffle=True,
-                                          num_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],
+                                          batch_size=max(1, dataset_opt['dataloader_batch_size']//opt['world_size']),
+                                          shuffle=False,
+                                          num_workers=dataset_opt['dataloader_num_workers']//procs_per_node,
                                           drop_last=True,
-                                          pin_memory=True,
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']//procs_per_node),
                                           sampler=train_sampler)
             else:
                 train_loader = DataLoader(train_set,
                                           batch_size=dataset_opt['dataloader_batch_size'],
-                                          shuffle=dataset_opt['dataloader_shuffle'],
+                                          shuffle=dataset_opt['dataloader_shuffle'] and not streaming,
                                           num_workers=dataset_opt['dataloader_num_workers'],
                                           drop_last=True,
-                                          pin_memory=True)
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']))
 
         elif phase == 'test':
             test_set = define_Dataset(dataset_opt)
             test_loader = DataLoader(test_set, batch_size=1,
                                      shuffle=False, num_workers=1,
-                                     drop_last=False, pin_memory=True)
+                                     drop_last=False, pin_memory=torch.cuda.is_available())
         else:
             raise NotImplementedError("Phase [%s] is not recognized." % phase)
 
@@ -162,6 +170,16 @@ def main(json_path='options/train_drunet.json'):
     '''
     current_step = current_epoch*train_size
 
+    # Next batch copied to the device while the current step computes
+    train_prefetcher = DataPrefetcher(train_loader, model.device)
+
+    # CER on a subset of the test images, OCR runs in a worker pool while testing continues
+    ocr_scorer = None
+    if opt['train']['checkpoint_test_cer'] and opt['rank'] == 0:
+        from utils.utils_ocr import OCRScorer
+        ocr_scorer = OCRScorer(num_workers=opt['train']['cer_num_workers'],
+                               cache_path=os.path.join(opt['path']['log'], 'ocr_ground_truth.json'))
+
     for epoch in range(opt['train']['epochs']):  # keep running
         
         # Update epoch
@@ -169,27 +187,25 @@ def main(json_path='options/train_drunet.json'):
 
         epoch_loss = 0.0
 
-        if opt['dist']:
+        if opt['dist'] and train_sampler is not None:
             train_sampler.set_epoch(current_epoch)
+        if hasattr(train_set, 'set_epoch'):
+            # Streams draw their images from the epoch
+            train_set.set_epoch(current_epoch)
 
         idx = 0
-        for i, train_data in enumerate(train_loader):
+        for i, train_data in enumerate(train_prefetcher):
 
             idx += 1
             current_step += 1
 
             # -------------------------------
-            # 1) update learning rate
-            # -------------------------------
-            model.update_learning_rate(current_step)
-
-            # -------------------------------
-            # 2) feed patch pairs
+            # 1) feed patch pairs
             # -------------------------------
             model.feed_data(train_data)
 
             # -------------------------------
-            # 3) optimize parameters
+            # 2) optimize parameters (and learning rate, once per optimizer step)
             # -------------------------------
             model.optimize_parameters(current_step)
 
@@ -214,7 +230,9 @@ def main(json_path='options/train_drunet.json'):
                                                                                 model.current_learning_rate(),
                                                                                 epoch_loss
                                                                                 )
-        logger.info(message)
+        message += 'data: {:.3f}s, compute: {:.3f}s per iter'.format(*train_prefetcher.timing())
+        if opt['rank'] == 0:
+            logger.info(message)
 
         # -------------------------------
         # Save model
@@ -233,6 +251,8 @@ def main(json_path='options/train_drunet.json'):
             avg_loss = 0.0
             avg_edgeJaccard = 0.0
             idx = 0
+            cer_futures = []
+            test_cer = ocr_scorer is not None and current_epoch % opt['train']['checkpoint_test_cer'] == 0
 
             for test_data in test_loader:
                 idx += 1
@@ -267,6 +287,10 @@ def main(json_path='options/train_drunet.json'):
                 current_psnr = util.calculate_psnr(E_img, H_img, border=border)
                 current_ssim = util.calculate_ssim(E_img, H_img, border=border)
                 current_edgeJaccard = util.calculate_edge_jaccard(E_img, H_img)
+                if test_cer and len(cer_futures) < opt['train']['cer_num_images']:
+                    # Rendered text as ground-truth when the dataset yields it (text_stream)
+                    text_H = test_data['text'][0] if 'text' in test_data else None
+                    cer_futures.append(ocr_scorer.submit(E_img, H_img, text_H))
                 
                 # -----------------------
                 # calculate loss
@@ -291,6 +315,19 @@ def main(json_path='options/train_drunet.json'):
 
             # testing log
             logger.info('<epoch:{:3d}, iter:{:8,d}, Average PSNR : {:<.2f}dB, Average SSIM : {:.3f}, Average edgeJaccard : {:.3f}, Average loss : {:.3e}\n'.format(current_epoch, current_step, avg_psnr, avg_ssim, avg_edgeJaccard, avg_loss))
+            test_metrics = {'psnr': avg_psnr, 'ssim': avg_ssim, 'edgeJaccard': avg_edgeJaccard, 'loss': avg_loss}
+
+            if cer_futures:
+                avg_cer = np.mean([future.result()[0] for future in cer_futures])
+                ocr_scorer.save_cache()
+                logger.info('<epoch:{:3d}, iter:{:8,d}, Average CER : {:.3f}% ({:d} images)\n'.format(current_epoch, current_step, avg_cer, len(cer_futures)))
+                test_metrics['cer'] = avg_cer
+
+            model.save_metrics(current_epoch, test_metrics)
+
+    # Wait for the checkpoints still being written, stop the writer
+    model.close_checkpoints()
+
 
 if __name__ == '__main__':
     main()
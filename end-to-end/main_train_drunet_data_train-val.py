@@ -16,6 +16,7 @@ from utils import utils_option as option
 from utils.utils_dist import get_dist_info, init_dist
 
 from data.select_dataset import define_Dataset
+from data.data_prefetcher import DataPrefetcher, loader_options
 from models.select_model import define_Model
 
 
@@ -125,7 +126,7 @@ def main(json_path='options/train_drunet.json'):
                                           shuffle=True,
                                           num_workers=dataset_opt['dataloader_num_workers']//opt['num_gpu'],
                                           drop_last=True,
-                                          pin_memory=True,
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']//opt['num_gpu']),
                                           sampler=train_sampler)
             else:
                 train_loader = DataLoader(train_set,
@@ -133,7 +134,7 @@ def main(json_path='options/train_drunet.json'):
                                           shuffle=dataset_opt['dataloader_shuffle'],
                                           num_workers=dataset_opt['dataloader_num_workers'],
                                           drop_last=True,
-                                          pin_memory=True)
+                                          **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']))
 
     '''
     # ----------------------------------------
@@ -154,6 +155,9 @@ def main(json_path='options/train_drunet.json'):
     '''
     current_step = current_epoch*train_size
 
+    # Next batch copied to the device while the current step computes
+    train_prefetcher = DataPrefetcher(train_loader, model.device)
+
     for epoch in range(opt['train']['epochs']):  # keep running
         
         # Update epoch
@@ -165,23 +169,18 @@ def main(json_path='options/train_drunet.json'):
             train_sampler.set_epoch(current_epoch)
 
         idx = 0
-        for i, train_data in enumerate(train_loader):
+        for i, train_data in enumerate(train_prefetcher):
 
             idx += 1
             current_step += 1
 
             # -------------------------------
-            # 1) update learning rate
-            # -------------------------------
-            model.update_learning_rate(current_step)
-
-            # -------------------------------
-            # 2) feed patch pairs
+            # 1) feed patch pairs
             # -------------------------------
             model.feed_data(train_data)
 
             # -------------------------------
-            # 3) optimize parameters
+            # 2) optimize parameters (and learning rate, once per optimizer step)
             # -------------------------------
             model.optimize_parameters(current_step)
 
@@ -206,6 +205,7 @@ def main(json_path='options/train_drunet.json'):
                                                                                 model.current_learning_rate(),
                                                                                 epoch_loss
                                                                                 )
+        message += 'data: {:.3f}s, compute: {:.3f}s per iter'.format(*train_prefetcher.timing())
         logger.info(message)
 
         # -------------------------------
@@ -215,6 +215,9 @@ def main(json_path='options/train_drunet.json'):
             logger.info('Saving the model.')
             model.save(current_epoch)
 
-        
+    # Wait for the checkpoints still being written, stop the writer
+    model.close_checkpoints()
+
+
 if __name__ == '__main__':
     main()
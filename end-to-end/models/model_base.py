@@ -2,6 +2,7 @@ import os
 import torch
 import torch.nn as nn
 from utils.utils_bnorm import merge_bn, tidy_sequential
+from utils.utils_checkpoint import CheckpointWriter
 from torch.nn.parallel import DataParallel, DistributedDataParallel
 
 
@@ -10,9 +11,10 @@ class ModelBase():
         self.opt = opt                         # opt
         self.save_dir = opt['path']['models']  # save models
         # self.device = torch.device('cuda' if opt['gpu_ids'] is not None else 'cpu')
-        self.device = torch.device('cuda' if len(opt['gpu_ids']) != 0 else 'cpu')
+        self.device = torch.device('cuda' if len(opt['gpu_ids']) != 0 and torch.cuda.is_available() else 'cpu')
         self.is_train = opt['is_train']        # training or not
         self.schedulers = []                   # schedulers
+        self.checkpoint_writer = None          # background checkpoint writer, see define_checkpoint_writer
 
     """
     # ----------------------------------------
@@ -106,7 +108,11 @@ class ModelBase():
         if self.opt['dist']:
             find_unused_parameters = self.opt.get('find_unused_parameters', True)
             use_static_graph = self.opt.get('use_static_graph', False)
-            network = DistributedDataParallel(network, device_ids=[torch.cuda.current_device()], find_unused_parameters=find_unused_parameters)
+            if self.device.type == 'cuda':
+                network = DistributedDataParallel(network, device_ids=[torch.cuda.current_device()], find_unused_parameters=find_unused_parameters)
+            else:
+                # CPU processes (gloo backend)
+                network = DistributedDataParallel(network, find_unused_parameters=find_unused_parameters)
             if use_static_graph:
                 print('Using static graph. Make sure that "unused parameters" will not change during training loop.')
                 network._set_static_graph()
@@ -147,14 +153,51 @@ class ModelBase():
     # ----------------------------------------
     """
 
+    # ----------------------------------------
+    # background writer: snapshot on this thread,
+    # serialize on a worker, manifest + retention
+    # ----------------------------------------
+    def define_checkpoint_writer(self):
+        opt_train = self.opt['train']
+        self.checkpoint_writer = CheckpointWriter(self.save_dir,
+                                                  keep_last=opt_train['checkpoint_keep_last'],
+                                                  keep_best=opt_train['checkpoint_keep_best'],
+                                                  best_metric=opt_train['checkpoint_best_metric'],
+                                                  best_mode=opt_train['checkpoint_best_mode'])
+
+    # ----------------------------------------
+    # metrics of a saved checkpoint (retention keep-best)
+    # ----------------------------------------
+    def save_metrics(self, iter_label, metrics):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.update_metrics(iter_label, metrics)
+
+    # ----------------------------------------
+    # wait for pending checkpoints
+    # ----------------------------------------
+    def flush_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+
+    # ----------------------------------------
+    # write pending checkpoints, stop the writer
+    # ----------------------------------------
+    def close_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+            self.checkpoint_writer = None
+
     # ----------------------------------------
     # save the state_dict of the network
     # ----------------------------------------
     def save_network(self, save_dir, network, network_label, iter_label):
-        save_filename = '{}_{}.pth'.format(iter_label, network_label)
-        save_path = os.path.join(save_dir, save_filename)
         network = self.get_bare_model(network)
         state_dict = network.state_dict()
+        if self.checkpoint_writer is not None and save_dir == self.save_dir:
+            self.checkpoint_writer.save(iter_label, {network_label: state_dict})
+            return
+        save_filename = '{}_{}.pth'.format(iter_label, network_label)
+        save_path = os.path.join(save_dir, save_filename)
         for key, param in state_dict.items():
             state_dict[key] = param.cpu()
         torch.save(state_dict, save_path)
@@ -165,12 +208,12 @@ class ModelBase():
     def load_network(self, load_path, network, strict=True, param_key='params'):
         network = self.get_bare_model(network)
         if strict:
-            state_dict = torch.load(load_path)
+            state_dict = torch.load(load_path, map_location=self.device)
             if param_key in state_dict.keys():
                 state_dict = state_dict[param_key]
             network.load_state_dict(state_dict, strict=strict)
         else:
-            state_dict_old = torch.load(load_path)
+            state_dict_old = torch.load(load_path, map_location=self.device)
             if param_key in state_dict_old.keys():
                 state_dict_old = state_dict_old[param_key]
             state_dict = network.state_dict()
@@ -183,6 +226,9 @@ class ModelBase():
     # save the state_dict of the optimizer
     # ----------------------------------------
     def save_optimizer(self, save_dir, optimizer, optimizer_label, iter_label):
+        if self.checkpoint_writer is not None and save_dir == self.save_dir:
+            self.checkpoint_writer.save(iter_label, {optimizer_label: optimizer.state_dict()})
+            return
         save_filename = '{}_{}.pth'.format(iter_label, optimizer_label)
         save_path = os.path.join(save_dir, save_filename)
         torch.save(optimizer.state_dict(), save_path)
@@ -191,14 +237,24 @@ class ModelBase():
     # load the state_dict of the optimizer
     # ----------------------------------------
     def load_optimizer(self, load_path, optimizer):
-        optimizer.load_state_dict(torch.load(load_path, map_location=lambda storage, loc: storage.cuda(torch.cuda.current_device())))
+        optimizer.load_state_dict(torch.load(load_path, map_location=self.device))
 
-    def update_E(self, decay=0.999):
+    # ----------------------------------------
+    # matching netG/netE parameter lists, gathered once for update_E
+    # ----------------------------------------
+    def define_E_params(self):
         netG = self.get_bare_model(self.netG)
         netG_params = dict(netG.named_parameters())
         netE_params = dict(self.netE.named_parameters())
-        for k in netG_params.keys():
-            netE_params[k].data.mul_(decay).add_(netG_params[k].data, alpha=1-decay)
+        self.E_params_G = [netG_params[k].data for k in netG_params.keys()]
+        self.E_params_E = [netE_params[k].data for k in netG_params.keys()]
+
+    def update_E(self, decay=0.999):
+        if getattr(self, 'E_params_E', None) is None:
+            self.define_E_params()
+        # One multi-tensor kernel per op instead of two per parameter
+        torch._foreach_mul_(self.E_params_E, decay)
+        torch._foreach_add_(self.E_params_E, self.E_params_G, alpha=1-decay)
 
     """
     # ----------------------------------------
@@ -0,0 +1,53 @@
+import torch
+import torch.nn as nn
+
+from models.model_plain import ModelPlain
+from models.network_unet import UNetRes
+
+
+class ModelDistill(ModelPlain):
+    """Train a (smaller) netG student with pixel loss and a trained netT teacher"""
+    def __init__(self, opt):
+        super(ModelDistill, self).__init__(opt)
+        # ------------------------------------
+        # define teacher network, never trained
+        # ------------------------------------
+        opt_netT = self.opt['netT']
+        self.netT = UNetRes(in_nc=opt_netT['in_nc'],
+                            out_nc=opt_netT['out_nc'],
+                            nc=opt_netT['nc'],
+                            nb=opt_netT['nb'],
+                            act_mode=opt_netT['act_mode'],
+                            downsample_mode=opt_netT['downsample_mode'] or 'strideconv',
+                            upsample_mode=opt_netT['upsample_mode'] or 'convtranspose',
+                            bias=opt_netT['bias'])
+        load_path_T = self.opt['path']['pretrained_netT']
+        print('Loading model for T [{:s}] ...'.format(load_path_T))
+        self.netT.load_state_dict(torch.load(load_path_T, map_location='cpu'), strict=True)
+        self.netT = self.netT.to(self.device).eval()
+        self.requires_grad(self.netT, False)
+
+    # ----------------------------------------
+    # define loss, pixel loss plus distillation loss
+    # ----------------------------------------
+    def define_loss(self):
+        super(ModelDistill, self).define_loss()
+        T_lossfn_type = self.opt_train['T_lossfn_type'] or 'l1'
+        if T_lossfn_type == 'l1':
+            self.T_lossfn = nn.L1Loss().to(self.device)
+        elif T_lossfn_type == 'l2':
+            self.T_lossfn = nn.MSELoss().to(self.device)
+        else:
+            raise NotImplementedError('Loss type [{:s}] is not found.'.format(T_lossfn_type))
+        self.T_distill_weight = self.opt_train['T_distill_weight'] if self.opt_train['T_distill_weight'] is not None else 0.5
+
+    # ----------------------------------------
+    # (1-w)*loss(E, H) + w*loss(E, teacher(L))
+    # ----------------------------------------
+    def compute_G_loss(self):
+        G_loss = super(ModelDistill, self).compute_G_loss()
+        with torch.no_grad():
+            T = self.netT(self.L)
+        T_loss = self.T_lossfn(self.E, T)
+        self.log_dict['T_loss'] = T_loss.item()
+        return (1 - self.T_distill_weight) * G_loss + self.T_distill_weight * T_loss
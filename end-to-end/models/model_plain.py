@@ -1,6 +1,7 @@
 from collections import OrderedDict
 import torch
 import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import lr_scheduler
 from torch.optim import Adam
 
@@ -23,6 +24,7 @@ class ModelPlain(ModelBase):
         self.opt_train = self.opt['train']    # training option
         self.netG = define_G(opt)
         self.netG = self.model_to_device(self.netG)
+        self.netG_inference = None
         if self.opt_train['E_decay'] > 0:
             self.netE = define_G(opt).to(self.device).eval()
 
@@ -43,6 +45,9 @@ class ModelPlain(ModelBase):
         self.define_optimizer()               # define optimizer
         self.load_optimizers()                # load optimizer
         self.define_scheduler()               # define scheduler
+        self.define_checkpoint_writer()       # define checkpoint writer
+        if self.opt_train['E_decay'] > 0:
+            self.define_E_params()            # parameter lists for EMA
         self.log_dict = OrderedDict()         # log
 
     # ----------------------------------------
@@ -165,17 +170,42 @@ class ModelPlain(ModelBase):
     def netG_forward(self):
         self.E = self.netG(self.L)
 
+    # ----------------------------------------
+    # loss of E against H
+    # ----------------------------------------
+    def compute_G_loss(self):
+        if self.opt_train['G_lossfn_type'] == 'tv':
+            return self.G_lossfn(self.E, self.H)
+        return self.G_lossfn_weight * self.G_lossfn(self.E, self.H)
+
     # ----------------------------------------
     # update parameters and get loss
     # ----------------------------------------
     def optimize_parameters(self, current_step):
-        self.G_optimizer.zero_grad()
+        # Gradients are accumulated over G_accumulation_steps micro-batches,
+        # the optimizer (and clip, scheduler, regularizers, EMA) steps once per window
+        accumulation_steps = self.opt_train['G_accumulation_steps']
+        first_micro_step = (current_step - 1) % accumulation_steps == 0
+        last_micro_step = current_step % accumulation_steps == 0
+
+        if first_micro_step:
+            self.G_optimizer.zero_grad()
         self.netG_forward()
-        if self.opt_train['G_lossfn_type'] == 'tv':
-            G_loss = self.G_lossfn(self.E, self.H)
+        G_loss = self.compute_G_loss()
+
+        # Average of the window, gradients only synchronized between DDP processes at its end
+        if last_micro_step or not isinstance(self.netG, DistributedDataParallel):
+            (G_loss / accumulation_steps).backward()
         else:
-            G_loss = self.G_lossfn_weight * self.G_lossfn(self.E, self.H)
-        G_loss.backward()
+            with self.netG.no_sync():
+                (G_loss / accumulation_steps).backward()
+
+        # self.log_dict['G_loss'] = G_loss.item()/self.E.size()[0]  # if `reduction='sum'`
+        self.log_dict['G_loss'] = G_loss.item()
+
+        if not last_micro_step:
+            return
+        update_step = current_step // accumulation_steps
 
         # ------------------------------------
         # clip_grad
@@ -183,35 +213,50 @@ class ModelPlain(ModelBase):
         # `clip_grad_norm` helps prevent the exploding gradient problem.
         G_optimizer_clipgrad = self.opt_train['G_optimizer_clipgrad'] if self.opt_train['G_optimizer_clipgrad'] else 0
         if G_optimizer_clipgrad > 0:
-            torch.nn.utils.clip_grad_norm_(self.parameters(), max_norm=self.opt_train['G_optimizer_clipgrad'], norm_type=2)
+            torch.nn.utils.clip_grad_norm_(self.netG.parameters(), max_norm=self.opt_train['G_optimizer_clipgrad'], norm_type=2)
 
         self.G_optimizer.step()
 
+        # Schedulers count optimizer steps, milestones/periods are in updates
+        self.update_learning_rate(update_step)
+
         # ------------------------------------
         # regularizer
         # ------------------------------------
         G_regularizer_orthstep = self.opt_train['G_regularizer_orthstep'] if self.opt_train['G_regularizer_orthstep'] else 0
-        if G_regularizer_orthstep > 0 and current_step % G_regularizer_orthstep == 0 and current_step % self.opt['train']['checkpoint_save'] != 0:
+        if G_regularizer_orthstep > 0 and update_step % G_regularizer_orthstep == 0 and update_step % self.opt['train']['checkpoint_save'] != 0:
             self.netG.apply(regularizer_orth)
         G_regularizer_clipstep = self.opt_train['G_regularizer_clipstep'] if self.opt_train['G_regularizer_clipstep'] else 0
-        if G_regularizer_clipstep > 0 and current_step % G_regularizer_clipstep == 0 and current_step % self.opt['train']['checkpoint_save'] != 0:
+        if G_regularizer_clipstep > 0 and update_step % G_regularizer_clipstep == 0 and update_step % self.opt['train']['checkpoint_save'] != 0:
             self.netG.apply(regularizer_clip)
 
-        # self.log_dict['G_loss'] = G_loss.item()/self.E.size()[0]  # if `reduction='sum'`
-        self.log_dict['G_loss'] = G_loss.item()
-
-        if self.opt_train['E_decay'] > 0:
-            self.update_E(self.opt_train['E_decay'])
+        # ------------------------------------
+        # EMA, every E_update_every optimizer steps with the equivalent decay
+        # ------------------------------------
+        E_update_every = self.opt_train['E_update_every']
+        if self.opt_train['E_decay'] > 0 and update_step % E_update_every == 0:
+            self.update_E(self.opt_train['E_decay'] ** E_update_every)
 
     # ----------------------------------------
     # test / inference
     # ----------------------------------------
     def test(self):
+        if self.netG_inference is not None:
+            self.E = self.netG_inference(self.L)
+            return
         self.netG.eval()
         with torch.no_grad():
             self.netG_forward()
         self.netG.train()
 
+    # ----------------------------------------
+    # inference mode for test only runs
+    # (bf16, channels_last, compile, script)
+    # ----------------------------------------
+    def set_inference_mode(self, mode):
+        from models.network_unet import UNetResInference
+        self.netG_inference = UNetResInference(self.get_bare_model(self.netG), mode=mode)
+
     # ----------------------------------------
     # test / inference x8
     # ----------------------------------------
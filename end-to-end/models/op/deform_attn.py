@@ -5,7 +5,6 @@
 
 
 import math
-import os
 import torch
 from torch import nn as nn
 from torch.autograd import Function
@@ -13,18 +12,17 @@ from torch.autograd.function import once_differentiable
 from torch.nn import functional as F
 from einops.layers.torch import Rearrange
 from distutils.version import LooseVersion
-from torch.utils.cpp_extension import load
+from .ext_loader import load_ext
 
-module_path = os.path.dirname(__file__)
-deform_attn_ext = load(
-    'deform_attn',
-    sources=[
-        os.path.join(module_path, 'deform_attn_ext.cpp'),
-        os.path.join(module_path, 'deform_attn_cuda_pt110.cpp' if LooseVersion(torch.__version__) >= LooseVersion(
-            '1.10.0') else 'deform_attn_cuda_pt109.cpp'),
-        os.path.join(module_path, 'deform_attn_cuda_kernel.cu'),
-],
-)
+def _deform_attn_ext():
+    """deform_attn extension, loaded on first use (CUDA only, no PyTorch implementation)"""
+    ext = load_ext('deform_attn', (
+        'deform_attn_ext.cpp',
+        'deform_attn_cuda_pt110.cpp' if LooseVersion(torch.__version__) >= LooseVersion('1.10.0') else 'deform_attn_cuda_pt109.cpp',
+        'deform_attn_cuda_kernel.cu'))
+    if ext is None:
+        raise RuntimeError('deform_attn needs its CUDA extension (see models/op/ext_loader.py)')
+    return ext
 
 
 class Mlp(nn.Module):
@@ -77,7 +75,7 @@ class DeformAttnFunction(Function):
             ctx.save_for_backward(q, kv, offset)
         output = q.new_empty(q.shape)
         ctx._bufs = [q.new_empty(0), q.new_empty(0), q.new_empty(0), q.new_empty(0), q.new_empty(0)]
-        deform_attn_ext.deform_attn_forward(q, kv, offset, output,
+        _deform_attn_ext().deform_attn_forward(q, kv, offset, output,
                                                       ctx._bufs[0], ctx._bufs[1], ctx._bufs[2], ctx.kernel_h, ctx.kernel_w, ctx.stride,
                                                       ctx.stride, ctx.padding, ctx.padding, ctx.dilation, ctx.dilation,
                                                       ctx.attention_heads, ctx.deformable_groups, ctx.clip_size)
@@ -92,7 +90,7 @@ class DeformAttnFunction(Function):
         grad_q = torch.zeros_like(q)
         grad_kv = torch.zeros_like(kv)
         grad_offset = torch.zeros_like(offset)
-        deform_attn_ext.deform_attn_backward(q, kv, offset, ctx._bufs[0], ctx._bufs[1], ctx._bufs[2], ctx._bufs[3], ctx._bufs[4],
+        _deform_attn_ext().deform_attn_backward(q, kv, offset, ctx._bufs[0], ctx._bufs[1], ctx._bufs[2], ctx._bufs[3], ctx._bufs[4],
                                                        grad_q, grad_kv, grad_offset,
                                                        grad_output, ctx.kernel_h, ctx.kernel_w, ctx.stride,
                                                        ctx.stride, ctx.padding, ctx.padding, ctx.dilation, ctx.dilation,
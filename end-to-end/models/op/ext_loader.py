@@ -0,0 +1,48 @@
+import os
+import functools
+import warnings
+import torch
+
+
+'''
+# --------------------------------------------
+# Lazy loading of the C++/CUDA extensions
+# --------------------------------------------
+# Ops call load_ext() on first use instead of building at import time,
+# so importing models/op is fast and works without a CUDA toolchain:
+#
+# 1. without CUDA (or TEMPEST_OP_NATIVE=1) None is returned and the ops
+#    use their PyTorch implementation,
+# 2. a prebuilt extension is imported from TEMPEST_OP_PREBUILT_DIR/<name>
+#    (e.g. a copy of ~/.cache/torch_extensions/<name>),
+# 3. otherwise it is JIT-compiled by torch (reused from TORCH_EXTENSIONS_DIR
+#    while the sources do not change). A failed build warns and returns None.
+# --------------------------------------------
+'''
+
+module_path = os.path.dirname(__file__)
+
+
+@functools.lru_cache(maxsize=None)
+def load_ext(name, sources):
+    """
+    Args:
+        name: extension name
+        sources: tuple of source files, relative to models/op
+    Returns:
+        extension module, None when it can not be used
+    """
+    if os.environ.get('TEMPEST_OP_NATIVE', '0') == '1' or not torch.cuda.is_available():
+        return None
+
+    from torch.utils.cpp_extension import load, _import_module_from_library
+
+    prebuilt_dir = os.environ.get('TEMPEST_OP_PREBUILT_DIR')
+    if prebuilt_dir and os.path.isdir(os.path.join(prebuilt_dir, name)):
+        return _import_module_from_library(name, os.path.join(prebuilt_dir, name), True)
+
+    try:
+        return load(name, sources=[os.path.join(module_path, source) for source in sources])
+    except (OSError, RuntimeError, ImportError) as e:
+        warnings.warn('{:s} extension could not be built, using the PyTorch implementation: {}'.format(name, e))
+        return None
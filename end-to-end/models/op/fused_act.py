@@ -1,21 +1,14 @@
-import os
-
 import torch
 from torch import nn
+from torch.nn import functional as F
 from torch.autograd import Function
-from torch.utils.cpp_extension import load, _import_module_from_library
 
+from .ext_loader import load_ext
 
-module_path = os.path.dirname(__file__)
-fused = load(
-    'fused',
-    sources=[
-        os.path.join(module_path, 'fused_bias_act.cpp'),
-        os.path.join(module_path, 'fused_bias_act_kernel.cu'),
-    ],
-)
 
-#fused = _import_module_from_library('fused', '/tmp/torch_extensions/fused', True)
+def _fused():
+    """fused extension, loaded on first use (None without CUDA, see ext_loader)"""
+    return load_ext('fused', ('fused_bias_act.cpp', 'fused_bias_act_kernel.cu'))
 
 
 class FusedLeakyReLUFunctionBackward(Function):
@@ -27,7 +20,7 @@ class FusedLeakyReLUFunctionBackward(Function):
 
         empty = grad_output.new_empty(0)
 
-        grad_input = fused.fused_bias_act(
+        grad_input = _fused().fused_bias_act(
             grad_output, empty, out, 3, 1, negative_slope, scale
         )
 
@@ -43,7 +36,7 @@ class FusedLeakyReLUFunctionBackward(Function):
     @staticmethod
     def backward(ctx, gradgrad_input, gradgrad_bias):
         out, = ctx.saved_tensors
-        gradgrad_out = fused.fused_bias_act(
+        gradgrad_out = _fused().fused_bias_act(
             gradgrad_input, gradgrad_bias, out, 3, 1, ctx.negative_slope, ctx.scale
         )
 
@@ -54,7 +47,7 @@ class FusedLeakyReLUFunction(Function):
     @staticmethod
     def forward(ctx, input, bias, negative_slope, scale):
         empty = input.new_empty(0)
-        out = fused.fused_bias_act(input, bias, empty, 3, 0, negative_slope, scale)
+        out = _fused().fused_bias_act(input, bias, empty, 3, 0, negative_slope, scale)
         ctx.save_for_backward(out)
         ctx.negative_slope = negative_slope
         ctx.scale = scale
@@ -85,4 +78,11 @@ class FusedLeakyReLU(nn.Module):
 
 
 def fused_leaky_relu(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    if input.device.type == 'cpu' or _fused() is None:
+        return fused_leaky_relu_native(input, bias, negative_slope, scale)
     return FusedLeakyReLUFunction.apply(input, bias, negative_slope, scale)
+
+
+def fused_leaky_relu_native(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    rest_dim = [1] * (input.ndim - bias.ndim - 1)
+    return F.leaky_relu(input + bias.view(1, bias.shape[0], *rest_dim), negative_slope=negative_slope) * scale
@@ -1,20 +1,13 @@
-import os
-
 import torch
+from torch.nn import functional as F
 from torch.autograd import Function
-from torch.utils.cpp_extension import load, _import_module_from_library
 
+from .ext_loader import load_ext
 
-module_path = os.path.dirname(__file__)
-upfirdn2d_op = load(
-    'upfirdn2d',
-    sources=[
-        os.path.join(module_path, 'upfirdn2d.cpp'),
-        os.path.join(module_path, 'upfirdn2d_kernel.cu'),
-    ],
-)
 
-#upfirdn2d_op = _import_module_from_library('upfirdn2d', '/tmp/torch_extensions/upfirdn2d', True)
+def _upfirdn2d_op():
+    """upfirdn2d extension, loaded on first use (None without CUDA, see ext_loader)"""
+    return load_ext('upfirdn2d', ('upfirdn2d.cpp', 'upfirdn2d_kernel.cu'))
 
 class UpFirDn2dBackward(Function):
     @staticmethod
@@ -28,7 +21,7 @@ class UpFirDn2dBackward(Function):
 
         grad_output = grad_output.reshape(-1, out_size[0], out_size[1], 1)
 
-        grad_input = upfirdn2d_op.upfirdn2d(
+        grad_input = _upfirdn2d_op().upfirdn2d(
             grad_output,
             grad_kernel,
             down_x,
@@ -65,7 +58,7 @@ class UpFirDn2dBackward(Function):
 
         gradgrad_input = gradgrad_input.reshape(-1, ctx.in_size[2], ctx.in_size[3], 1)
 
-        gradgrad_out = upfirdn2d_op.upfirdn2d(
+        gradgrad_out = _upfirdn2d_op().upfirdn2d(
             gradgrad_input,
             kernel,
             ctx.up_x,
@@ -115,7 +108,7 @@ class UpFirDn2d(Function):
 
         ctx.g_pad = (g_pad_x0, g_pad_x1, g_pad_y0, g_pad_y1)
 
-        out = upfirdn2d_op.upfirdn2d(
+        out = _upfirdn2d_op().upfirdn2d(
             input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1
         )
         # out = out.view(major, out_h, out_w, minor)
@@ -143,6 +136,13 @@ class UpFirDn2d(Function):
 
 
 def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
+    if input.device.type == 'cpu' or _upfirdn2d_op() is None:
+        batch, channel, in_h, in_w = input.shape
+        out = upfirdn2d_native(
+            input.reshape(-1, in_h, in_w, 1), kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1]
+        )
+        return out.reshape(batch, channel, out.shape[1], out.shape[2])
+
     out = UpFirDn2d.apply(
         input, kernel, (up, up), (down, down), (pad[0], pad[1], pad[0], pad[1])
     )
@@ -12,6 +12,9 @@ def define_Model(opt):
     if model == 'plain':
         from models.model_plain import ModelPlain as M
 
+    elif model == 'distill':  # one input: L, student netG trained from teacher netT
+        from models.model_distill import ModelDistill as M
+
     elif model == 'plain2':  # two inputs: L, C
         from models.model_plain2 import ModelPlain2 as M
 
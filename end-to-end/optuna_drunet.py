@@ -11,8 +11,10 @@ from torch.utils.data.distributed import DistributedSampler
 import torch
 import torch.nn as nn
 from torch.utils.data import Subset
+import multiprocessing
 import optuna
-import joblib
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 
 from utils import utils_logger
 from utils import utils_image as util
@@ -20,6 +22,7 @@ from utils import utils_option as option
 from utils.utils_dist import get_dist_info, init_dist
 
 from data.select_dataset import define_Dataset
+from data.data_prefetcher import DataPrefetcher, loader_options
 from models.select_model import define_Model
 
 '''
@@ -92,7 +95,7 @@ for phase, dataset_opt in opt['datasets'].items():
                                     shuffle=dataset_opt['dataloader_shuffle'],
                                     num_workers=dataset_opt['dataloader_num_workers'],
                                     drop_last=True,
-                                    pin_memory=True)
+                                    **loader_options(dataset_opt, dataset_opt['dataloader_num_workers']))
 
     elif phase == 'test':
         test_set = define_Dataset(dataset_opt)
@@ -110,7 +113,35 @@ for phase, dataset_opt in opt['datasets'].items():
 message = f'Datasets loaded.'
 logger.info(message)
 
-dataset = {'train':train_loader, 'val':val_loader}
+def define_proxy_set(test_set, n_images, crop_size, batch_size):
+    """
+    Fixed random crops of a fixed random subset of the validation images,
+    stacked in batches. Same crops for every trial, so proxy metrics are
+    comparable between trials at each epoch. Crops are crop_size, or the
+    smallest side of the sampled images if smaller, so they all stack.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    indexes = torch.randperm(len(test_set), generator=generator)[:n_images].tolist()
+    images = [test_set[index] for index in indexes]
+    size = min([crop_size] + [min(data['H'].shape[-2:]) for data in images])
+    crops_L, crops_H = [], []
+    for data in images:
+        h, w = data['H'].shape[-2:]
+        top = torch.randint(0, h - size + 1, (1,), generator=generator).item()
+        left = torch.randint(0, w - size + 1, (1,), generator=generator).item()
+        crops_L.append(data['L'][..., top:top+size, left:left+size])
+        crops_H.append(data['H'][..., top:top+size, left:left+size])
+    return [(torch.stack(crops_L[i:i+batch_size]), torch.stack(crops_H[i:i+batch_size]))
+            for i in range(0, len(crops_L), batch_size)]
+
+# Proxy validation for the intermediate pruning reports, 0 images disables it
+proxy_set = []
+if opt['optuna']['proxy_images']:
+    proxy_set = define_proxy_set(test_set, opt['optuna']['proxy_images'],
+                                 opt['optuna']['proxy_crop_size'] or 256, opt['optuna']['proxy_batch_size'] or 8)
+    logger.info(f'Proxy validation on {sum(len(L) for L, _ in proxy_set)} crops.')
+
+dataset = {'train':train_loader, 'val':val_loader, 'proxy':proxy_set}
 
 # Define model function with optuna hyperparameters
 def define_model(opt):
@@ -135,11 +166,15 @@ def define_metric(metric_str):
         metric_dict['direction'] = 'maximize'
         metric_dict['name'] = 'SSIM'
     
-    # TODO IMPLEMENTAR
-    # elif metric_str == 'CER':
-    #     metric_dict['func'] = utilOCR.calculate_cer
-    #     metric_dict['direction'] = 'minimize'
-    #     metric_dict['name'] = 'CER'
+    elif metric_str == 'CER':
+        # OCR of the images in parallel, ground-truth transcriptions cached
+        from utils.utils_ocr import OCRScorer
+        ocr_scorer = OCRScorer(num_workers=opt['optuna']['cer_num_workers'],
+                               cache_path=os.path.join(opt['path']['log'], 'ocr_ground_truth.json'))
+        metric_dict['func'] = ocr_scorer.cer
+        metric_dict['batch_func'] = ocr_scorer.mean_cer
+        metric_dict['direction'] = 'minimize'
+        metric_dict['name'] = 'CER'
 
     elif metric_str == 'edgeJaccard':
         metric_dict['func'] = util.calculate_edge_jaccard
@@ -154,13 +189,88 @@ def define_metric(metric_str):
     
     return metric_dict
 
+def validation(model, val_loader, metric_dict):
+    """Loss and metric averaged on the full resolution validation images"""
+    metric = metric_dict['func']
+    metric_pairs = []
+    val_metric = 0.0
+    avg_val_loss = 0.0
+    idx = 0
+
+    for val_data in val_loader:
+        idx += 1
+
+        model.feed_data(val_data)
+        model.test()
+
+        visuals = model.current_visuals()
+        E_visual = visuals['E']
+        E_img = util.tensor2uint(E_visual)
+        H_visual = visuals['H']
+        H_img = util.tensor2uint(H_visual)
+
+        sizes = E_visual.size()
+
+        current_loss = model.G_lossfn(torch.reshape(E_visual,(1,1,sizes[1],sizes[2])),
+                                      torch.reshape(H_visual,(1,1,sizes[1],sizes[2])))
+
+        avg_val_loss += current_loss
+        if 'batch_func' in metric_dict:
+            metric_pairs.append((H_img, E_img))
+        else:
+            val_metric += metric(H_img, E_img)
+
+    # Metrics with a worker pool (CER) are computed in parallel on all images
+    if metric_pairs:
+        val_metric = metric_dict['batch_func'](metric_pairs) * idx
+
+    # Val loss and metric
+    return avg_val_loss/idx, val_metric/idx
+
+def proxy_validation(model, proxy_batches, metric_dict):
+    """
+    Loss and metric averaged on the proxy crops (batched, already on the device).
+    PSNR and MSE are computed on the tensors, other metrics on the uint8 crops.
+    """
+    val_metric = 0.0
+    val_loss = 0.0
+    n_crops = 0
+
+    model.netG.eval()
+    with torch.no_grad():
+        for L, H in proxy_batches:
+            E = model.netG(L)
+            val_loss += model.G_lossfn(E, H).item() * L.size(0)
+
+            # Same quantization as util.tensor2uint
+            E = E.clamp(0, 1).mul(255).round()
+            H = H.clamp(0, 1).mul(255).round()
+            mse = (E - H).pow(2).mean(dim=(1, 2, 3))
+            if metric_dict['name'] == 'PSNR':
+                # At least one pixel off by one, so identical crops give a finite PSNR
+                mse = mse.clamp(min=1.0/H[0].numel())
+                val_metric += (20 * torch.log10(255.0 / mse.sqrt())).sum().item()
+            elif metric_dict['name'] == 'MSE':
+                val_metric += mse.sum().item()
+            elif 'batch_func' in metric_dict:
+                E, H = E.byte().cpu().numpy(), H.byte().cpu().numpy()
+                val_metric += metric_dict['batch_func']([(H_img.squeeze(0), E_img.squeeze(0)) for E_img, H_img in zip(E, H)]) * L.size(0)
+            else:
+                E, H = E.byte().cpu().numpy(), H.byte().cpu().numpy()
+                for E_img, H_img in zip(E, H):
+                    val_metric += metric_dict['func'](H_img.squeeze(0), E_img.squeeze(0))
+            n_crops += L.size(0)
+    model.netG.train()
+
+    return val_loss/n_crops, val_metric/n_crops
+
 def train_model(trial, model, dataset, metric_dict, num_epochs=25):
 
-    # Load dataset and metrics
-    train_loader = dataset['train']
+    # Load dataset and metrics, next train batch copied to the device while the current step computes
+    train_loader = DataPrefetcher(dataset['train'], model.device)
     val_loader = dataset['val']
+    proxy_batches = [(L.to(model.device), H.to(model.device)) for L, H in dataset['proxy']]
 
-    metric = metric_dict['func']
     metric_direction = metric_dict['direction']
 
     best_metric = -1e6*(metric_direction=='maximize') + 1e6*(metric_direction=='minimize')
@@ -190,17 +300,12 @@ def train_model(trial, model, dataset, metric_dict, num_epochs=25):
             current_step += 1
 
             # -------------------------------
-            # 1) update learning rate
-            # -------------------------------
-            model.update_learning_rate(current_step)
-
-            # -------------------------------
-            # 2) feed patch pairs
+            # 1) feed patch pairs
             # -------------------------------
             model.feed_data(train_data)
 
             # -------------------------------
-            # 3) optimize parameters
+            # 2) optimize parameters (and learning rate, once per optimizer step)
             # -------------------------------
             model.optimize_parameters(current_step)
 
@@ -223,40 +328,22 @@ def train_model(trial, model, dataset, metric_dict, num_epochs=25):
         # avg_train_metric = epoch_metric/train_size
 
         message_train = f'\nepoch:{epoch+1}/{num_epochs}\n'+'-'*14+'\ntrain loss: {:.3e}\n'.format(avg_train_loss)
+        message_train += 'data: {:.3f}s, compute: {:.3f}s per iter\n'.format(*train_loader.timing())
 
 
         # -------------------------------
-        # Validation phase
+        # Validation phase: proxy on fixed crops for the intermediate
+        # reports, full validation at the last epoch
         # -------------------------------
-        val_metric = 0.0
-        avg_val_loss = 0.0
-        idx = 0
-
-        for val_data in val_loader:
-            idx += 1
-
-            model.feed_data(val_data)
-            model.test()
-
-            visuals = model.current_visuals()
-            E_visual = visuals['E']
-            E_img = util.tensor2uint(E_visual)
-            H_visual = visuals['H']
-            H_img = util.tensor2uint(H_visual)
-
-            sizes = E_visual.size()
-
-            current_loss = model.G_lossfn(torch.reshape(E_visual,(1,1,sizes[1],sizes[2])),
-                                          torch.reshape(H_visual,(1,1,sizes[1],sizes[2])))
-
-            avg_val_loss += current_loss
-            val_metric += metric(H_img, E_img)
-
-        # Val loss and metric
-        avg_val_loss = avg_val_loss/idx
-        avg_val_metric = val_metric/idx
-
-        message_val = 'val loss: {:.3e}, val {}: {:.3f}\n'.format(avg_val_loss,
+        full_validation = not proxy_batches or epoch == num_epochs - 1
+        if full_validation:
+            avg_val_loss, avg_val_metric = validation(model, val_loader, metric_dict)
+        else:
+            avg_val_loss, avg_val_metric = proxy_validation(model, proxy_batches, metric_dict)
+
+        message_val = '{} loss: {:.3e}, {} {}: {:.3f}\n'.format('val' if full_validation else 'proxy val',
+                                                                    avg_val_loss,
+                                                                    'val' if full_validation else 'proxy val',
                                                                     metric_dict['name'],
                                                                     avg_val_metric
                                                                     )
@@ -267,7 +354,8 @@ def train_model(trial, model, dataset, metric_dict, num_epochs=25):
         maximizing = ( (avg_val_metric > best_metric) and metric_dict['direction'] == 'maximize')
         minimizing = ( (avg_val_metric < best_metric) and metric_dict['direction'] == 'minimize') 
 
-        val_metric_is_better = maximizing or minimizing                       
+        # Proxy metrics are not comparable with the full validation ones
+        val_metric_is_better = (maximizing or minimizing) and full_validation
 
         if val_metric_is_better:
                         best_metric = avg_val_metric
@@ -282,9 +370,6 @@ def train_model(trial, model, dataset, metric_dict, num_epochs=25):
                 trial.number ,time_elapsed // (60*60), (time_elapsed // 60)%60, time_elapsed % 60)
                 )
             raise optuna.TrialPruned()
-        
-        # Save study 
-        joblib.dump(study, study_path)
 
 
     # Whole optuna parameters searching time
@@ -299,7 +384,7 @@ def objective(trial):
 
     # Set learning rate suggestions for trial
     trial_lr = trial.suggest_float("lr", 1e-6, 1e-3, log=True)
-    opt['train']['G_optimizaer_lr'] = trial_lr
+    opt['train']['G_optimizer_lr'] = trial_lr
 
     trial_tvweight = trial.suggest_float("tv_weight", 1e-13, 1e2, log=True)
     opt['train']["G_tvloss_weight"] = trial_tvweight
@@ -313,10 +398,12 @@ def objective(trial):
     # Generate the model and optimizers
     model = define_model(opt)
 
-    # Select metric specified at options
-    metric_dict = define_metric(opt['optuna']['metric'])
-
-    best_metric = train_model(trial, model, dataset, metric_dict, num_epochs=opt['optuna']['trial_epochs'])    
+    # Metric specified at options (defined once, CER keeps its OCR pool and cache between trials)
+    try:
+        best_metric = train_model(trial, model, dataset, metric_dict, num_epochs=opt['optuna']['trial_epochs'])
+    finally:
+        # One checkpoint writer per trial, stopped also when pruned
+        model.close_checkpoints()
     
     # Save best model for each trial
     # torch.save(best_model.state_dict(), f"model_trial_{trial.number}.pth")
@@ -357,32 +444,78 @@ def save_optuna_info(study):
 # ----------------------------------------
 '''
 metric_dict = define_metric(opt['optuna']['metric'])
-sampler = optuna.samplers.TPESampler()
 study_name = opt['optuna']['study_name']  # Unique identifier of the study.
-study_path = os.path.join(opt['path']['log'], f"{study_name}.pkl")
-
-# Resume study if already exists
-if os.path.exists(study_path):
-    logger.info(f"Loading study at: {study_path}")
-    study = joblib.load(study_path)
-    df_study = study.trials_dataframe(attrs=("number", "value", "params", "state"))
-    n_trials_completed = len(df_study[df_study["state"]=="COMPLETE"])
-    n_trials = opt['optuna']['n_trials'] - n_trials_completed
-    logger.info(f"Completed {n_trials_completed}, continue study with other {n_trials}")
-
-# Start study
-else:
-    study = optuna.create_study(
-            sampler=sampler,
-            pruner=optuna.pruners.MedianPruner( 
+n_workers = opt['optuna']['n_workers'] or 1
+
+def define_storage():
+    """
+    Study storage shared by all workers, trials are resumed from it.
+    "*.log" paths use a journal file, anything else is an RDB url
+    (default sqlite database in the log folder).
+    """
+    storage = opt['optuna']['storage'] or 'sqlite:///' + os.path.abspath(os.path.join(opt['path']['log'], f"{study_name}.db"))
+    if storage.endswith('.log'):
+        try:
+            from optuna.storages.journal import JournalFileBackend
+        except ImportError:  # optuna < 4.0
+            from optuna.storages import JournalFileStorage as JournalFileBackend
+        return optuna.storages.JournalStorage(JournalFileBackend(storage))
+    # Heartbeat marks trials of killed workers as failed instead of running forever
+    return optuna.storages.RDBStorage(storage, heartbeat_interval=60, grace_period=180,
+                                      engine_kwargs={'connect_args': {'timeout': 60}} if storage.startswith('sqlite') else None)
+
+def define_pruner():
+    return optuna.pruners.MedianPruner(
                 n_startup_trials=opt['optuna']['n_startup_trials'],
-                n_warmup_steps=opt['optuna']['n_warmup_steps'], 
+                n_warmup_steps=opt['optuna']['n_warmup_steps'],
                 interval_steps=opt['optuna']['interval_steps']
-            ),
-            direction=metric_dict['direction'])
-    n_trials = opt['optuna']['n_trials']
-
-study.optimize(func=objective, n_trials=n_trials)
+            )
+
+def pin_worker(worker_id):
+    """Split CPUs (and GPUs) among the workers"""
+    cpus = sorted(os.sched_getaffinity(0))
+    cpus_per_worker = max(1, len(cpus) // n_workers)
+    worker_cpus = cpus[worker_id*cpus_per_worker:(worker_id+1)*cpus_per_worker] or cpus
+    os.sched_setaffinity(0, worker_cpus)
+    torch.set_num_threads(len(worker_cpus))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(worker_id % torch.cuda.device_count())
+    torch.manual_seed(seed + worker_id)
+
+def run_worker(worker_id):
+    if n_workers > 1:
+        pin_worker(worker_id)
+    # Pruner is not persisted in the storage, give it on load
+    study = optuna.load_study(study_name=study_name, storage=define_storage(),
+                              sampler=optuna.samplers.TPESampler(), pruner=define_pruner())
+    # Stop when the study (all workers) reaches n_trials finished trials
+    study.optimize(func=objective,
+                   callbacks=[MaxTrialsCallback(opt['optuna']['n_trials'], states=(TrialState.COMPLETE, TrialState.PRUNED))])
+
+# Create the study, or resume it if already in the storage
+study = optuna.create_study(
+        study_name=study_name,
+        storage=define_storage(),
+        load_if_exists=True,
+        sampler=optuna.samplers.TPESampler(),
+        pruner=define_pruner(),
+        direction=metric_dict['direction'])
+n_trials_finished = len(study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED)))
+logger.info(f"Study {study_name}: {n_trials_finished} finished trials, {max(0, opt['optuna']['n_trials'] - n_trials_finished)} to go with {n_workers} workers")
+
+if n_trials_finished < opt['optuna']['n_trials'] and n_workers > 1:
+    # Workers are forked, they share the datasets loaded above. CUDA is only
+    # initialized inside each worker (models are created by the objective).
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=run_worker, args=(worker_id,)) for worker_id in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+elif n_trials_finished < opt['optuna']['n_trials']:
+    run_worker(0)
+
+study = optuna.load_study(study_name=study_name, storage=define_storage())
 
 message = 'Best trial:\n'+str(study.best_trial)
 logger.info(message)
@@ -0,0 +1,200 @@
+import os.path
+import argparse
+import time
+import logging
+import numpy as np
+import torch
+import torch.nn as nn
+
+from utils import utils_logger
+from utils import utils_image as util
+from utils import utils_option as option
+from utils.utils_modelsummary import get_model_flops
+
+from models import basicblock as B
+from models.network_unet import UNetRes as net
+from tempest_evaluation import calculate_cer_wer
+
+'''
+# --------------------------------------------
+# Structured channel pruning of DRUNet
+# --------------------------------------------
+# python prune_drunet.py --opt options/test_drunet.json --ratios 0.75 0.5 0.25 --dataroot_L path/to/captures --dataroot_H path/to/ground-truth
+#
+# For every keep ratio, the channels of each UNet level with the largest L1
+# norm are kept (one set per level, shared through the skip connections) and
+# the inner channels of every ResBlock are chosen independently. The pruned
+# students are saved as *_G_pruned{ratio}.pth and their FLOPs, params, CPU
+# latency and CER are compared with the teacher. Pruned students are meant
+# to be fine-tuned with main_distill_drunet.py (as pretrained_netG).
+# --------------------------------------------
+'''
+
+
+def split_level(sequential):
+    """ResBlocks, down/up sampling convs of a UNet level"""
+    if not isinstance(sequential, nn.Sequential):
+        sequential = [sequential]  # m_body with nb=1
+    resblocks = [m for m in sequential if isinstance(m, B.ResBlock)]
+    convs = [m for m in sequential if isinstance(m, (nn.Conv2d, nn.ConvTranspose2d))]
+    return resblocks, convs
+
+
+def output_norm(module):
+    """L1 norm of every output channel filter"""
+    weight = module.weight.data.abs()
+    if isinstance(module, nn.ConvTranspose2d):
+        return weight.sum(dim=(0, 2, 3))
+    return weight.sum(dim=(1, 2, 3))
+
+
+def top_channels(norm, n):
+    return torch.sort(torch.topk(norm, n).indices).values
+
+
+def copy_conv(src, dst, out_idx, in_idx):
+    if isinstance(src, nn.ConvTranspose2d):
+        dst.weight.data.copy_(src.weight.data[in_idx][:, out_idx])
+    else:
+        dst.weight.data.copy_(src.weight.data[out_idx][:, in_idx])
+    if src.bias is not None:
+        dst.bias.data.copy_(src.bias.data[out_idx])
+
+
+def copy_resblocks(src_blocks, dst_blocks, level_idx):
+    for src, dst in zip(src_blocks, dst_blocks):
+        # Inner channels of each ResBlock are independent of the level ones
+        conv1, conv2 = src.res[0], src.res[2]
+        inner_idx = top_channels(output_norm(conv1), dst.res[0].out_channels)
+        copy_conv(conv1, dst.res[0], inner_idx, level_idx)
+        copy_conv(conv2, dst.res[2], level_idx, inner_idx)
+
+
+def prune_unet(model, nc_student, opt_netG):
+    """UNetRes with nc_student channels per level, weights taken from model"""
+    if opt_netG['act_mode'] != 'R':
+        raise NotImplementedError('pruning of act_mode [{:s}] is not supported'.format(opt_netG['act_mode']))
+
+    levels_down = [model.m_down1, model.m_down2, model.m_down3]
+    levels_up = [model.m_up1, model.m_up2, model.m_up3]
+
+    # Importance of the channels of each level: every module writing on it
+    norms = [output_norm(model.m_head)]
+    for level in range(4):
+        if level > 0:
+            # m_down{level} writes on this level
+            norms.append(output_norm(split_level(levels_down[level-1])[1][0]))
+        if level < 3:
+            # m_up{level+1} writes on this level
+            norms[level] += output_norm(split_level(levels_up[level])[1][0])
+        sequences = [model.m_body] if level == 3 else [levels_down[level], levels_up[level]]
+        for sequence in sequences:
+            for resblock in split_level(sequence)[0]:
+                norms[level] += output_norm(resblock.res[2])
+    level_idx = [top_channels(norms[level], nc_student[level]) for level in range(4)]
+
+    student = net(in_nc=opt_netG['in_nc'], out_nc=opt_netG['out_nc'], nc=nc_student, nb=opt_netG['nb'],
+                  act_mode=opt_netG['act_mode'], bias=opt_netG['bias'])
+    in_idx = torch.arange(opt_netG['in_nc'])
+    out_idx = torch.arange(opt_netG['out_nc'])
+
+    copy_conv(model.m_head, student.m_head, level_idx[0], in_idx)
+    copy_conv(model.m_tail, student.m_tail, out_idx, level_idx[0])
+    copy_resblocks(split_level(model.m_body)[0], split_level(student.m_body)[0], level_idx[3])
+
+    student_down = [student.m_down1, student.m_down2, student.m_down3]
+    student_up = [student.m_up1, student.m_up2, student.m_up3]
+    for level in range(3):
+        src_blocks, src_convs = split_level(levels_down[level])
+        dst_blocks, dst_convs = split_level(student_down[level])
+        copy_resblocks(src_blocks, dst_blocks, level_idx[level])
+        copy_conv(src_convs[0], dst_convs[0], level_idx[level+1], level_idx[level])
+
+        src_blocks, src_convs = split_level(levels_up[level])
+        dst_blocks, dst_convs = split_level(student_up[level])
+        copy_conv(src_convs[0], dst_convs[0], level_idx[level], level_idx[level+1])
+        copy_resblocks(src_blocks, dst_blocks, level_idx[level])
+
+    return student.eval()
+
+
+def cpu_latency(model, input_res, repeats=3):
+    x = torch.rand(1, *input_res)
+    times = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times)//2]
+
+
+def average_cer(model, L_paths, H_paths):
+    cers = []
+    with torch.no_grad():
+        for L_path, H_path in zip(L_paths, H_paths):
+            img_L = util.imread_uint(L_path, n_channels=3)[:,:,:2]
+            img_L = util.single2tensor4(util.uint2single(img_L))
+            img_E = util.tensor2uint(model(img_L))
+            img_H = util.imread_uint(H_path, n_channels=3)
+            img_H = np.mean(img_H, axis=2).astype('uint8')
+            cers.append(calculate_cer_wer(img_E, img_H)[0])
+    return np.mean(cers)
+
+
+def main(json_path='options/test_drunet.json'):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.75, 0.5, 0.25], help='Fraction of channels kept per level')
+    parser.add_argument('--resolution', type=int, nargs=2, default=[900, 1600], help='V H input size for FLOPs and latency')
+    parser.add_argument('--dataroot_L', type=str, default=None, help='Captures for CER')
+    parser.add_argument('--dataroot_H', type=str, default=None, help='Ground-truth for CER')
+    parser.add_argument('--num_images', type=int, default=10, help='Max number of images for CER')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=False)
+    opt = option.dict_to_nonedict(opt)
+    opt_netG = opt['netG']
+    model_path = opt['path']['pretrained_netG']
+
+    logger_name = 'pruning'
+    utils_logger.logger_info(logger_name, os.path.join(opt['path']['log'], logger_name + '.log'))
+    logger = logging.getLogger(logger_name)
+
+    torch.set_grad_enabled(False)
+    teacher = net(in_nc=opt_netG['in_nc'], out_nc=opt_netG['out_nc'], nc=opt_netG['nc'], nb=opt_netG['nb'],
+                  act_mode=opt_netG['act_mode'], bias=opt_netG['bias'])
+    teacher.load_state_dict(torch.load(model_path, map_location='cpu'), strict=True)
+    teacher.eval()
+
+    input_res = (opt_netG['in_nc'], *args.resolution)
+    if args.dataroot_L and args.dataroot_H:
+        L_paths = util.get_image_paths(args.dataroot_L)[:args.num_images]
+        H_paths = util.get_image_paths(args.dataroot_H)[:args.num_images]
+    else:
+        L_paths = H_paths = None
+
+    students = [(1.0, teacher)]
+    for ratio in args.ratios:
+        nc_student = [max(1, int(round(c*ratio))) for c in opt_netG['nc']]
+        student = prune_unet(teacher, nc_student, opt_netG)
+        student_path = os.path.splitext(model_path)[0] + '_pruned{}.pth'.format(ratio)
+        torch.save(student.state_dict(), student_path)
+        logger.info('Keep ratio {}: nc = {}, saved at {}'.format(ratio, nc_student, student_path))
+        students.append((ratio, student))
+
+    for ratio, model in students:
+        number_parameters = sum(map(lambda x: x.numel(), model.parameters()))
+        latency = cpu_latency(model, input_res)
+        # get_model_flops adds counting hooks to the model, measure it last
+        flops = get_model_flops(model, input_res, print_per_layer_stat=False)
+        message = 'ratio {:.2f} | GFLOPs = {:.2f} ; Params = {:,d} ; CPU latency = {:.2f}s'.format(ratio, flops/1e9, number_parameters, latency)
+        if L_paths:
+            message += ' ; CER = {:.3f}%'.format(average_cer(model, L_paths, H_paths))
+        logger.info(message)
+
+
+if __name__ == '__main__':
+    main()
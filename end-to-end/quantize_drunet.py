@@ -0,0 +1,166 @@
+import os.path
+import argparse
+import time
+import logging
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from utils import utils_logger
+from utils import utils_image as util
+from utils import utils_option as option
+
+from models.network_unet import UNetRes as net, QuantizedUNetRes
+from tempest_evaluation import calculate_cer_wer
+
+'''
+# --------------------------------------------
+# Post-training static int8 quantization of DRUNet
+# --------------------------------------------
+# python quantize_drunet.py --opt options/test_drunet.json --calibration_dir path/to/captures
+#
+# Loads the trained *_G.pth of the options file, calibrates on real captures
+# and saves a TorchScript *_G_int8.pt next to it. Setting this file as
+# pretrained_netG in main_test_drunet.py or in the gr-tempest sink options
+# runs the int8 model.
+# --------------------------------------------
+'''
+
+
+class UNetResBody(nn.Module):
+    """UNetRes without padding/cropping, input size multiple of 8"""
+    def __init__(self, model):
+        super(UNetResBody, self).__init__()
+        self.net = model
+
+    def forward(self, x):
+        return self.net.forward_padded(x)
+
+
+def load_capture(path):
+    img_L = util.imread_uint(path, n_channels=3)[:,:,:2]
+    img_L = util.uint2single(img_L)
+    return util.single2tensor4(img_L)
+
+
+def pad8(x):
+    h, w = x.size()[-2:]
+    return F.pad(x, (0, -w % 8, 0, -h % 8), mode='replicate')
+
+
+def timed(model, x):
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        y = model(x)
+    return y, time.perf_counter() - t0
+
+
+def main(json_path='options/test_drunet.json'):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default=json_path, help='Path to option JSON file.')
+    parser.add_argument('--calibration_dir', type=str, required=True, help='Folder of real captures for calibration')
+    parser.add_argument('--num_calibration', type=int, default=32, help='Max number of calibration captures')
+    parser.add_argument('--test_dir', type=str, default=None, help='Captures to compare float and int8 (default calibration_dir)')
+    parser.add_argument('--dataroot_H', type=str, default=None, help='Ground-truth of test_dir, for PSNR and CER')
+    parser.add_argument('--backend', type=str, default='fbgemm', help='fbgemm (x86) | qnnpack (ARM)')
+    parser.add_argument('--output', type=str, default=None, help='Output path (default *_G_int8.pt next to the model)')
+    args = parser.parse_args()
+
+    opt = option.parse(args.opt, is_train=False)
+    opt = option.dict_to_nonedict(opt)
+    opt_netG = opt['netG']
+
+    model_path = opt['path']['pretrained_netG']
+    output_path = args.output or os.path.splitext(model_path)[0] + '_int8.pt'
+
+    logger_name = 'quantization'
+    utils_logger.logger_info(logger_name, os.path.join(opt['path']['log'], logger_name + '.log'))
+    logger = logging.getLogger(logger_name)
+
+    # ----------------------------------------
+    # float model (CPU)
+    # ----------------------------------------
+    model = net(in_nc=opt_netG['in_nc'], out_nc=opt_netG['out_nc'], nc=opt_netG['nc'], nb=opt_netG['nb'],
+                act_mode=opt_netG['act_mode'], bias=opt_netG['bias'])
+    model.load_state_dict(torch.load(model_path, map_location='cpu'), strict=True)
+    model.eval()
+
+    # ----------------------------------------
+    # prepare: conv+ReLU of every ResBlock are fused by prepare_fx,
+    # residual additions become quantized adds
+    # ----------------------------------------
+    torch.backends.quantized.engine = args.backend
+    qconfig_mapping = get_default_qconfig_mapping(args.backend)
+    example = torch.rand(1, opt_netG['in_nc'], 64, 64)
+    prepared = prepare_fx(UNetResBody(model), qconfig_mapping, example_inputs=(example,))
+
+    # ----------------------------------------
+    # calibrate on real captures
+    # ----------------------------------------
+    calibration_paths = util.get_image_paths(args.calibration_dir)[:args.num_calibration]
+    logger.info('Calibrating on {} captures from {}'.format(len(calibration_paths), args.calibration_dir))
+    with torch.no_grad():
+        for path in calibration_paths:
+            prepared(pad8(load_capture(path)))
+
+    quantized = convert_fx(prepared)
+
+    # ----------------------------------------
+    # save as TorchScript
+    # ----------------------------------------
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+    torch.jit.save(scripted, output_path)
+    logger.info('Saved int8 model at {}'.format(output_path))
+
+    # ----------------------------------------
+    # float vs int8
+    # ----------------------------------------
+    model_int8 = QuantizedUNetRes(scripted)
+    L_paths = util.get_image_paths(args.test_dir or args.calibration_dir)
+    H_paths = util.get_image_paths(args.dataroot_H) if args.dataroot_H else None
+
+    metrics = {'time_fp32': [], 'time_int8': [], 'psnr_fp32_int8': [],
+               'psnr_fp32': [], 'psnr_int8': [], 'cer_fp32': [], 'cer_int8': []}
+
+    for idx, L_path in enumerate(L_paths):
+        img_L = load_capture(L_path)
+
+        img_E_fp32, t_fp32 = timed(model, img_L)
+        img_E_int8, t_int8 = timed(model_int8, img_L)
+        img_E_fp32 = util.tensor2uint(img_E_fp32)
+        img_E_int8 = util.tensor2uint(img_E_int8)
+
+        metrics['time_fp32'].append(t_fp32)
+        metrics['time_int8'].append(t_int8)
+        metrics['psnr_fp32_int8'].append(util.calculate_psnr(img_E_int8, img_E_fp32))
+
+        if H_paths:
+            img_H = util.imread_uint(H_paths[idx], n_channels=3)
+            img_H = np.mean(img_H, axis=2).astype('uint8')
+            metrics['psnr_fp32'].append(util.calculate_psnr(img_E_fp32, img_H))
+            metrics['psnr_int8'].append(util.calculate_psnr(img_E_int8, img_H))
+            metrics['cer_fp32'].append(calculate_cer_wer(img_E_fp32, img_H)[0])
+            metrics['cer_int8'].append(calculate_cer_wer(img_E_int8, img_H)[0])
+
+        logger.info('{:->4d}--> {:>10s} | fp32 {:.2f}s ; int8 {:.2f}s ; PSNR(int8, fp32) = {:<4.2f}dB'.format(
+            idx+1, os.path.basename(L_path), t_fp32, t_int8, metrics['psnr_fp32_int8'][-1]))
+
+    if not L_paths:
+        return
+
+    avg = {k: np.mean(v) for k, v in metrics.items() if v}
+    logger.info('[Average] fp32 {:.2f}s : int8 {:.2f}s : speedup x{:.2f} : PSNR(int8, fp32) = {:<4.2f}dB'.format(
+        avg['time_fp32'], avg['time_int8'], avg['time_fp32']/avg['time_int8'], avg['psnr_fp32_int8']))
+    if H_paths:
+        logger.info('[Average] PSNR fp32 = {:<4.2f}dB : int8 = {:<4.2f}dB (delta {:+.2f}dB) : CER fp32 = {:.3f}% : int8 = {:.3f}% (delta {:+.3f}%)'.format(
+            avg['psnr_fp32'], avg['psnr_int8'], avg['psnr_int8']-avg['psnr_fp32'],
+            avg['cer_fp32'], avg['cer_int8'], avg['cer_int8']-avg['cer_fp32']))
+
+
+if __name__ == '__main__':
+    main()
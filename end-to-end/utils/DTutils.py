@@ -1,6 +1,8 @@
+import functools
 import numpy as np
 from scipy import signal
 from numba import jit, uint8, int8, prange
+from utils.timings import get_timing
 
 def rgb_entropy(I):
     """ 
@@ -268,6 +270,19 @@ def TMDS_pixel (pix,cnt=0):
   return binarray_to_uint(qout), cnt
 
 @jit(parallel=True)
+def TMDS_encoding_original_kernel (I, I_c, v_offset, h_offset):
+  """Numba loop of TMDS_encoding_original, writes the coded pixels in I_c"""
+  v_in, h_in = I.shape[:2]
+
+  # Iterate over channels and pixels
+  for c in prange(I_c.shape[2]):
+    for i in range(v_in):
+      cnt=[0,0,0]
+      for j in range(h_in):
+        # Get pixel and code it TMDS between blanking
+        pix = I[i,j,c]
+        I_c[i + v_offset, j + h_offset, c], cnt[c] = TMDS_pixel_numba (pix,cnt[c])
+
 def TMDS_encoding_original (I, blanking = False):
   """TMDS image coding
 
@@ -290,18 +305,14 @@ def TMDS_encoding_original (I, blanking = False):
   # Get image resolution
   v_in, h_in = I.shape[:2]
 
-  # Verify VESA resolutions
-  v = (v_in==1080)*1125 + (v_in==900)*1000  + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-  h = (h_in==1920)*2200 + (h_in==1600)*1800 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
-  
-  if blanking and (h*v != 0):
-    # Get blanking resolution for input image
-    v_diff = v - v_in
-    h_diff = h - h_in
+  # Blanking frame of the resolution, None if it is not a known mode
+  template = blanking_template(h_in, v_in, control_symbols=False) if blanking else None
 
-    # Create image with blanking and change type to uint16
-    # Assuming the blanking corresponds to 10bit number [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first)
-    I_c = 852*np.ones((v,h,chs)).astype('uint16')
+  if template is not None:
+    # Get blanking resolution for input image
+    v_diff = template.shape[0] - v_in
+    h_diff = template.shape[1] - h_in
+    I_c = template[:,:,:chs].copy()
     
   else:
     # If no blanking or not VESA resolution, exclude blanking
@@ -309,14 +320,7 @@ def TMDS_encoding_original (I, blanking = False):
     h_diff = 0
     I_c = np.zeros((v_in,h_in,chs)).astype('uint16')
 
-  # Iterate over channels and pixels
-  for c in prange(chs):
-    for i in range(v_in):
-      cnt=[0,0,0]
-      for j in range(h_in):
-        # Get pixel and code it TMDS between blanking
-        pix = I[i,j,c]
-        I_c[i + v_diff//2 , j + h_diff//2, c], cnt[c] = TMDS_pixel_numba (pix,cnt[c])
+  TMDS_encoding_original_kernel(I, I_c, v_diff//2, h_diff//2)
 
   return I_c
 
@@ -455,6 +459,34 @@ def TMDS_blanking (h_total, v_total, h_active, v_active, h_front_porch, v_front_
 
   return(img_blank)
 
+@functools.lru_cache(maxsize=None)
+def blanking_template (h_active, v_active, control_symbols = True):
+  """Blanking frame of a resolution, shared by every image encoded with it
+
+  Inputs: 
+  - h_active, v_active: active resolution, looked up in the timings registry (modes.txt)
+  - control_symbols: Boolean, control symbols of TMDS_blanking on the third channel 
+    (TMDS_encoding) or 852 on every channel (TMDS_encoding_original)
+
+  Output:
+  - I_b: read-only 3D (v_total, h_total, 3) uint16 frame, encoders copy it and
+    write the active area. None if the resolution (or its porches) is not in the registry
+
+  """ 
+  timing = get_timing(h_active, v_active)
+  if timing is None or (control_symbols and timing.h_front_porch is None):
+    return None
+
+  # Assuming the blanking corresponds to 10bit number 
+  # [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first) for channels R and G
+  I_b = np.full((timing.v_total, timing.h_total, 3), 852, dtype='uint16')
+  if control_symbols:
+    I_b[:,:,2] = TMDS_blanking(h_total=timing.h_total, v_total=timing.v_total, h_active=h_active, v_active=v_active, 
+                  h_front_porch=timing.h_front_porch, v_front_porch=timing.v_front_porch, 
+                  h_back_porch=timing.h_back_porch, v_back_porch=timing.v_back_porch)
+  I_b.setflags(write=False)
+  return I_b
+
 def TMDS_encoding (I, blanking = False):
   """TMDS image coding
 
@@ -477,28 +509,14 @@ def TMDS_encoding (I, blanking = False):
   # Get image resolution
   v_in, h_in = I.shape[:2]
   
-  if blanking:
-    # Get blanking resolution for input image
-    
-    v = (v_in==1080)*1125 + (v_in==900)*1000  + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-    h = (h_in==1920)*2200 + (h_in==1600)*1800 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
+  # Blanking frame of the resolution, None if it is not a known mode
+  template = blanking_template(h_in, v_in, control_symbols=True) if blanking else None
 
-    v_diff = v - v_in
-    h_diff = h - h_in
-
-    v_front_porch = (v_in==1080)*4 + (v_in==900)*1  + (v_in==720)*5   + (v_in==600)*1  + (v_in==480)*2
-    v_back_porch = (v_in==1080)*36 + (v_in==900)*96  + (v_in==720)*20   + (v_in==600)*23  + (v_in==480)*25
-
-    h_front_porch = (h_in==1920)*88 + (h_in==1600)*24 + (h_in==1280)*110 + (h_in==800)*40 + (h_in==640)*8 
-    h_back_porch = (h_in==1920)*148 + (h_in==1600)*96 + (h_in==1280)*220 + (h_in==800)*88 + (h_in==640)*40 
-
-    # Create image with blanking and change type to uint16
-    # Assuming the blanking corresponds to 10bit number 
-    # [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first) for channels R and G
-    I_c = 852*np.ones((v,h,chs)).astype('uint16')
-    if chs==3:
-      I_c[:,:,2] = TMDS_blanking(h_total=h, v_total=v, h_active=h_in, v_active=v_in, 
-                    h_front_porch=h_front_porch, v_front_porch=v_front_porch, h_back_porch=h_back_porch, v_back_porch=v_back_porch)
+  if template is not None:
+    # Get blanking resolution for input image
+    v_diff = template.shape[0] - v_in
+    h_diff = template.shape[1] - h_in
+    I_c = template[:,:,:chs].copy()
     
   else:
     v_diff = 0
@@ -541,19 +559,14 @@ def TMDS_encoding_rare (I, blanking = False):
   # Get image resolution
   v_in, h_in = I.shape[:2]
   
-  if blanking:
-    # Get blanking resolution for input image
-    
-    v = (v_in==1080)*1125 + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-    h = (h_in==1920)*2200 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
-
-    vdiff = v - v_in
-    hdiff = h - h_in
+  # Blanking frame of the resolution, None if it is not a known mode
+  template = blanking_template(h_in, v_in, control_symbols=False) if blanking else None
 
-    # Create image with blanking and change type to uint16
-    # Assuming the blanking corresponds to 10bit number [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first)
-
-    I_c = 852*np.ones((v,h,chs)).astype('uint16')
+  if template is not None:
+    # Get blanking resolution for input image
+    v_diff = template.shape[0] - v_in
+    h_diff = template.shape[1] - h_in
+    I_c = template[:,:,:chs].copy()
     
   else:
     v_diff = 0
@@ -10,6 +10,9 @@
 
 import os
 import sys
+import argparse
+import tempfile
+import multiprocessing
 sys.path.append(os.environ.get('GRC_HIER_PATH', os.path.expanduser('~/.grc_gnuradio')))
 
 from binary_serializer import binary_serializer  # grc-generated hier_block
@@ -20,6 +23,7 @@ from gnuradio import gr
 import signal
 
 import tempest
+from tempest.utils_capture import save_capture, is_capture_file
 
 import numpy as np
 from PIL import Image
@@ -38,7 +42,12 @@ def get_subfolders_names_from_folder(folder):
     return subfolders_list
 
 def save_simulation_image(I,path_and_name):
-    
+
+    # Lossless complex capture (.npy/.npz), PNG otherwise
+    if is_capture_file(path_and_name):
+        save_capture(I,path_and_name)
+        return
+
     v_total,h_total = I.shape
     
     I_save = np.zeros((v_total,h_total,3))
@@ -58,7 +67,7 @@ def save_simulation_image(I,path_and_name):
     im = Image.fromarray(I_save.astype('uint8'))
     im.save(path_and_name)
 
-def signal_capture_downsampling(serial_data,h, v, samp_rate, usrp_rate, noise_std):
+def signal_capture_downsampling(serial_data,h, v, samp_rate, usrp_rate, noise_std, rng=None):
 
     # Resolucion y fps, con blanking de la imagen
     h_total, v_total = h, v
@@ -68,8 +77,10 @@ def signal_capture_downsampling(serial_data,h, v, samp_rate, usrp_rate, noise_st
     # phase_noise = np.exp(1j*np.random.uniform(0,2*np.pi, len(serial_data)))
 
     if noise_std > 0:
+        # Noise from the image's generator, so a seed reproduces the captures
+        rng = np.random.default_rng() if rng is None else rng
         noise_sigma = noise_std/15.968719423 # sqrt(255)~15.968719423 because of stretching with 255 at saving
-        serial_data = serial_data + np.random.normal(0, noise_sigma,N_samples) + 1j*np.random.normal(0, noise_sigma,N_samples)
+        serial_data = serial_data + rng.normal(0, noise_sigma,N_samples) + 1j*rng.normal(0, noise_sigma,N_samples)
 
     # Muestreo del SDR
     image_seq = sci_signal.resample_poly(serial_data,up=usrp_rate, down=samp_rate)
@@ -83,54 +94,6 @@ def signal_capture_downsampling(serial_data,h, v, samp_rate, usrp_rate, noise_st
 class NO_GUI_tempest_simulated_TMDS(gr.top_block):
 
 
-    def reset_all_blocks_but_image_source(self):
-
-        self.data_sink_0 = blocks.vector_sink_c(1)
-        
-        self.interp_fir_filter_xxx_0 = filter.interp_fir_filter_fcc(self.inter, self.rectangular_pulse)
-        self.interp_fir_filter_xxx_0.declare_sample_delay(0)
-    
-        self.blocks_multiply_xx_0 = blocks.multiply_vcc(1)
-        self.blocks_multiply_const_vxx_0 = blocks.multiply_const_ff(2)
-        self.blocks_add_xx_0 = blocks.add_vff(1)
-        self.blocks_add_const_vxx_0 = blocks.add_const_ff(3)
-        self.binary_serializer_0_0_0 = binary_serializer(
-            M=10,
-            N=16,
-            offset=0,
-        )
-        self.binary_serializer_0_0 = binary_serializer(
-            M=10,
-            N=16,
-            offset=0,
-        )
-        self.binary_serializer_0 = binary_serializer(
-            M=10,
-            N=16,
-            offset=0,
-        )
-        self.analog_sig_source_x_0 = analog.sig_source_c(self.samp_rate, analog.GR_COS_WAVE, self.px_rate*self.harmonic, 1, 0, 0)
-
-        ##################################################
-        # Connections
-        ##################################################
-        self.connect((self.analog_sig_source_x_0, 0), (self.blocks_multiply_xx_0, 1))
-        self.connect((self.binary_serializer_0, 0), (self.blocks_add_xx_0, 0))
-        self.connect((self.binary_serializer_0_0, 0), (self.blocks_add_xx_0, 1))
-        self.connect((self.binary_serializer_0_0_0, 0), (self.blocks_add_xx_0, 2))
-        self.connect((self.blocks_add_const_vxx_0, 0), (self.interp_fir_filter_xxx_0, 0))
-        self.connect((self.blocks_add_xx_0, 0), (self.blocks_multiply_const_vxx_0, 0))
-        self.connect((self.blocks_multiply_const_vxx_0, 0), (self.blocks_add_const_vxx_0, 0))
-
-        self.connect((self.blocks_multiply_xx_0, 0), (self.data_sink_0, 0))
-
-        self.connect((self.interp_fir_filter_xxx_0, 0), (self.blocks_multiply_xx_0, 0))
-        self.connect((self.tempest_TMDS_image_source_0, 0), (self.binary_serializer_0, 0))
-        self.connect((self.tempest_TMDS_image_source_0, 1), (self.binary_serializer_0_0, 0))
-        self.connect((self.tempest_TMDS_image_source_0, 2), (self.binary_serializer_0_0_0, 0))
-
-
-
     def __init__(self, Vsize=None, Hsize=None, Vvisible=None, Hvisible=None, FILEPATH=None, blanking=False):
         gr.top_block.__init__(self, "Manual  Simulated Tempest TMDS Example")
 
@@ -146,6 +109,7 @@ class NO_GUI_tempest_simulated_TMDS(gr.top_block):
 
         # Init as 1
         self.harmonic = harmonic = 1 # To set at main
+        self.noise_std = 0 # To set at main
 
         self.refresh_rate = refresh_rate = 60
         self.px_rate = px_rate = Hsize*Vsize*refresh_rate/1000
@@ -159,14 +123,24 @@ class NO_GUI_tempest_simulated_TMDS(gr.top_block):
         # Blocks
         ##################################################
 
-        self.data_sink_0 = blocks.vector_sink_c(1)
+        # Samples are streamed to a file opened per simulation run
+        self.data_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1, os.devnull, False)
+        self.data_sink_0.set_unbuffered(False)
         self.tempest_TMDS_image_source_0 = tempest.TMDS_image_source(FILEPATH, 3, blanking)
         # self.rational_resampler_xxx_0 = filter.rational_resampler_ccc(
         #         interpolation=inter,
         #         decimation=10*inter,
         #         taps=None,
         #         fractional_bw=0.4)
-        self.interp_fir_filter_xxx_0 = filter.interp_fir_filter_fcc(inter, rectangular_pulse)
+        self.build_stream_blocks()
+
+
+    def build_stream_blocks(self):
+        """
+        Blocks after the image source, connected to it and the sink. They keep
+        state between runs (serializers, filter history, oscillator phase)
+        """
+        self.interp_fir_filter_xxx_0 = filter.interp_fir_filter_fcc(self.inter, self.rectangular_pulse)
         self.interp_fir_filter_xxx_0.declare_sample_delay(0)
     
         self.blocks_multiply_xx_0 = blocks.multiply_vcc(1)
@@ -188,7 +162,7 @@ class NO_GUI_tempest_simulated_TMDS(gr.top_block):
             N=16,
             offset=0,
         )
-        self.analog_sig_source_x_0 = analog.sig_source_c(samp_rate, analog.GR_COS_WAVE, px_rate*harmonic, 1, 0, 0)
+        self.analog_sig_source_x_0 = analog.sig_source_c(self.samp_rate, analog.GR_COS_WAVE, self.px_rate*self.harmonic, 1, 0, 0)
 
 
         ##################################################
@@ -209,6 +183,14 @@ class NO_GUI_tempest_simulated_TMDS(gr.top_block):
         self.connect((self.tempest_TMDS_image_source_0, 1), (self.binary_serializer_0_0, 0))
         self.connect((self.tempest_TMDS_image_source_0, 2), (self.binary_serializer_0_0_0, 0))
 
+    def reset_stream_blocks(self):
+        """New stream blocks for the next run, the image source (encoded frame) and the sink are kept"""
+        self.lock()
+        self.disconnect_all()
+        self.build_stream_blocks()
+        self.unlock()
+        self.tempest_TMDS_image_source_0.line_num = 0
+
 
     def get_refresh_rate(self):
         return self.refresh_rate
@@ -274,6 +256,21 @@ class NO_GUI_tempest_simulated_TMDS(gr.top_block):
         self.harmonic = harmonic
         self.analog_sig_source_x_0.set_frequency(self.px_rate*self.harmonic)
 
+    def get_noise_std(self):
+        return self.noise_std
+
+    def set_noise_std(self, noise_std):
+        self.noise_std = noise_std
+
+    def set_FILEPATH(self, FILEPATH):
+        self.FILEPATH = FILEPATH
+        self.tempest_TMDS_image_source_0.set_image_file(self.FILEPATH)
+        (Vsize, Hsize) = self.tempest_TMDS_image_source_0.get_image_shape()
+        if (Vsize, Hsize) != (self.Vsize, self.Hsize):
+            self.Vvisible, self.Hvisible = Vsize, Hsize
+            self.Vsize = Vsize
+            self.set_Hsize(Hsize)
+
     def get_Vvisible(self):
         return self.Vvisible
 
@@ -295,9 +292,15 @@ def set_top_block(top_block_cls=NO_GUI_tempest_simulated_TMDS, options_dict=dict
 
     return tb
 
-def run_simulation_flowgraph(top_block, harmonic, noise_std):
+def run_simulation_flowgraph(top_block, harmonic, noise_std, sink_path=None, rng=None):
 
     top_block.set_harmonic(harmonic)
+    top_block.set_noise_std(noise_std)
+
+    # Stream the capture to a raw complex64 file
+    if sink_path is None:
+        sink_path = os.path.join(tempfile.gettempdir(), 'tempest_sim_{}.cfile'.format(os.getpid()))
+    top_block.data_sink_0.open(sink_path)
 
     def sig_handler(sig=None, frame=None):
         top_block.stop()
@@ -312,6 +315,7 @@ def run_simulation_flowgraph(top_block, harmonic, noise_std):
     top_block.start()
     top_block.wait()
     top_block.stop()
+    top_block.data_sink_0.close()
 
     # Get top block's parameters
     samp_rate = top_block.get_samp_rate()
@@ -319,15 +323,20 @@ def run_simulation_flowgraph(top_block, harmonic, noise_std):
     h = top_block.get_Hsize()
     v = top_block.get_Vsize()
 
-    # Get output data from fg's last block
-    serial_data = np.array(top_block.data_sink_0.data())
+    # Get output data from fg's last block, the file is not needed after
+    try:
+        serial_data = np.fromfile(sink_path, dtype=np.complex64)
+    finally:
+        if os.path.exists(sink_path):
+            os.remove(sink_path)
 
     # Resample and reshape to image size
-    I_capture = signal_capture_downsampling(serial_data,h=h, v=v, samp_rate=samp_rate, usrp_rate=usrp_rate, noise_std=noise_std)
+    I_capture = signal_capture_downsampling(serial_data,h=h, v=v, samp_rate=samp_rate, usrp_rate=usrp_rate,
+                                            noise_std=top_block.get_noise_std(), rng=rng)
 
-    # Start over flowgraph and the coded image transmition
-    top_block.reset_all_blocks_but_image_source()
-    top_block.tempest_TMDS_image_source_0.line_num = 0
+    # Start over the coded image transmition, keeping the encoded image. Every
+    # run then starts from the same state and gives the same samples
+    top_block.reset_stream_blocks()
 
     return I_capture
 
@@ -367,39 +376,25 @@ def image_simulation(image_path, N_harmonic, noise_std, blanking=False):
     return I_capture_2channels
 
 
-def main():
+# One top block per worker process, kept alive between images
+_top_block = None
+
+def simulate_image(job):
+    """Run all simulations of an image on the worker's top block"""
+    global _top_block
+
+    image_path, subfolder_path, simulations, seed, capture_ext = job
+
+    # timestamp for simulation starting
+    t1_image = time.time()
+
+    imagename = os.path.basename(subfolder_path)
+    rng = np.random.default_rng(seed)
 
-    # Get foldername argument
-    foldername = sys.argv[-1]
-    
-    # Get images and subfolders names
-    images_tmp = get_images_names_from_folder(foldername)
-    old_subfolders = get_subfolders_names_from_folder(foldername)
-    
-    # Keep images without dedicated folders only
-    images = []
-    new_subfolders = []
-    for image in images_tmp:
-        image_name = image.split('.')[0]
-        if image_name not in old_subfolders:
-            images.append(image)
-            new_subfolders.append(image_name)
-    
     # Possible std dev noise simulation values
     noise_stds = np.array([ 0, 5,  10,  15,  20,  25,  40, 50])
-    
-    for image, subfolder in zip(images,new_subfolders):
-        
-        # Create new directory for simulations
-        subfolder_path = foldername+'/'+subfolder
-        os.mkdir(subfolder_path)
 
-        # timestamp for simulation starting
-        t1_image = time.time()
-        
-        # Read image
-        image_path = foldername+'/'+image
-        imagename = image.split('.')[0]
+    if _top_block is None:
         I = np.array(Image.open(image_path))
 
         # Set initial options
@@ -412,30 +407,77 @@ def main():
                         }
 
         # Initialize the top block with encoded image
-        top_block = set_top_block(top_block_cls=NO_GUI_tempest_simulated_TMDS, options_dict=options_dict)
+        _top_block = set_top_block(top_block_cls=NO_GUI_tempest_simulated_TMDS, options_dict=options_dict)
+    else:
+        # Swap the encoded image on the running flowgraph
+        _top_block.set_FILEPATH(image_path)
 
-        for i in range(4):
+    for i in range(simulations):
 
-            # Choose random pixelrate harmonic number
-            N_harmonic = np.random.randint(1,10)
-            
-            # Choose random SNR value (SNR=0 for no noise)
-            noise_std = np.random.choice(noise_stds)
+        # Choose random pixelrate harmonic number
+        N_harmonic = rng.integers(1,10)
 
-            path = subfolder_path+'/'+imagename+'_'+str(N_harmonic)+'harm_'+str(noise_std)+"std.png"
+        # Choose random SNR value (SNR=0 for no noise)
+        noise_std = rng.choice(noise_stds)
 
-            I_capture = run_simulation_flowgraph(top_block, N_harmonic, noise_std)
+        path = subfolder_path+'/'+imagename+'_'+str(N_harmonic)+'harm_'+str(noise_std)+"std"+capture_ext
+
+        I_capture = run_simulation_flowgraph(_top_block, N_harmonic, noise_std, rng=rng)
+
+        save_simulation_image(I_capture,path)
+
+    return image_path, time.time()-t1_image
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Simulate tempest captures of every image in a folder')
+    parser.add_argument('folder', type=str, help='folder with the images to simulate')
+    parser.add_argument('--workers', type=int, default=1, help='number of parallel flowgraphs')
+    parser.add_argument('--simulations', type=int, default=4, help='simulations per image')
+    parser.add_argument('--format', type=str, default='png', choices=['png', 'npy', 'npz'],
+                        help='capture format: stretched uint8 png, or lossless complex64 npy / float16 npz')
+    args = parser.parse_args()
+
+    # Get foldername argument
+    foldername = args.folder
+    
+    # Get images and subfolders names
+    images_tmp = get_images_names_from_folder(foldername)
+    old_subfolders = get_subfolders_names_from_folder(foldername)
+    
+    # Keep images without dedicated folders only
+    images = []
+    new_subfolders = []
+    for image in images_tmp:
+        image_name = image.split('.')[0]
+        if image_name not in old_subfolders:
+            images.append(image)
+            new_subfolders.append(image_name)
+
+    jobs = []
+    seeds = np.random.SeedSequence().generate_state(max(len(images),1))
+    for image, subfolder, seed in zip(images,new_subfolders,seeds):
+
+        # Create new directory for simulations
+        subfolder_path = foldername+'/'+subfolder
+        os.mkdir(subfolder_path)
 
-            save_simulation_image(I_capture,path)
+        jobs.append((foldername+'/'+image, subfolder_path, args.simulations, int(seed), '.'+args.format))
 
-            if i==0:
-                # timestamp for simulation ending
-                t2_image = time.time()    
+    t_all_images = time.time()
 
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            results = pool.imap_unordered(simulate_image, jobs)
+            for image_path, t_image in results:
+                print('Simulation time of '+os.path.basename(image_path)+':','{:.2f}'.format(t_image)+'s')
+    else:
+        for job in jobs:
+            image_path, t_image = simulate_image(job)
+            print('Simulation time of '+os.path.basename(image_path)+':','{:.2f}'.format(t_image)+'s')
 
-        t_image = t2_image-t1_image
-        
-        print('Tiempo de la primer simulación de '+image+':','{:.2f}'.format(t_image)+'s\n')
+    print('Total simulation time for {} images: {:.2f}s'.format(len(jobs), time.time()-t_all_images))
 
 if __name__ == '__main__':
     main()
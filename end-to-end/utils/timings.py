@@ -0,0 +1,79 @@
+"""
+Registry of display timings, read once from gr-tempest/modes.txt.
+
+Every line of modes.txt is a mode:
+
+    "name", H_total, V_total, refresh_rate [, H_front_porch, H_back_porch, V_front_porch, V_back_porch] ,
+
+The active resolution is taken from the name ("1920x1080 @ 60Hz"). Porches
+are only listed for the modes the TMDS encoders generate blanking for, a
+new mode is a new line of the table. Same file in
+gr-tempest/python/timings.py, keep both in sync.
+
+Environment variables:
+    TEMPEST_MODES_PATH       modes table (default modes.txt found next to
+                             this file or at the root of gr-tempest)
+"""
+
+import os
+import functools
+import collections
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+_CANDIDATES = [os.path.join(_MODULE_DIR, 'modes.txt'),                        # installed tempest package
+               os.path.join(_MODULE_DIR, '..', 'modes.txt'),                  # gr-tempest/python
+               os.path.join(_MODULE_DIR, '..', '..', 'gr-tempest', 'modes.txt')]  # end-to-end/utils
+MODES_PATH = os.environ.get('TEMPEST_MODES_PATH',
+                            next((path for path in _CANDIDATES if os.path.exists(path)), _CANDIDATES[0]))
+
+Timing = collections.namedtuple('Timing', [
+    'name', 'h_active', 'v_active', 'h_total', 'v_total', 'refresh_rate',
+    'h_front_porch', 'h_back_porch', 'v_front_porch', 'v_back_porch'])
+
+
+def active_size(name):
+    """(H_active, V_active) of a mode name like '1920x1080 @ 60Hz', (None, None) if it has none"""
+    sizes = name.split('@')[0].split('x')
+    if len(sizes) == 2:
+        sizes = [''.join(c for c in size if c.isdigit()) for size in sizes]
+        if all(sizes):
+            return int(sizes[0]), int(sizes[1])
+    return None, None
+
+def parse_mode(line):
+    """Timing of a modes.txt line, None for blank and comment lines"""
+    line = line.strip()
+    if not line.startswith('"'):
+        return None
+    name, values = line[1:].split('"', 1)
+    values = [value.strip() for value in values.split(',') if value.strip()]
+    if len(values) not in (3, 7):
+        raise ValueError('modes table line [{}] must have 3 or 7 values'.format(line))
+    h_total, v_total = int(values[0]), int(values[1])
+    porches = [int(value) for value in values[3:]] or [None]*4
+    name = name.strip()
+    return Timing(name, *active_size(name), h_total, v_total, float(values[2]), *porches)
+
+@functools.lru_cache(maxsize=None)
+def load_timings(path=None):
+    """All the modes of the table, as a tuple of Timing"""
+    with open(path or MODES_PATH, 'r') as f:
+        return tuple(timing for timing in map(parse_mode, f) if timing is not None)
+
+def _preferred(timings, refresh_rate):
+    """Modes with porches first, then the closest refresh rate"""
+    if not timings:
+        return None
+    return min(timings, key=lambda t: (t.h_front_porch is None, abs(t.refresh_rate - refresh_rate)))
+
+@functools.lru_cache(maxsize=None)
+def get_timing(h_active, v_active, refresh_rate=60, path=None):
+    """Timing of an active resolution, None if it is not in the table"""
+    return _preferred([t for t in load_timings(path) if (t.h_active, t.v_active) == (h_active, v_active)],
+                      refresh_rate)
+
+@functools.lru_cache(maxsize=None)
+def get_timing_by_total(h_total, v_total, refresh_rate=60, path=None):
+    """Timing of a total (active plus blanking) resolution, None if it is not in the table"""
+    return _preferred([t for t in load_timings(path) if (t.h_total, t.v_total) == (h_total, v_total)],
+                      refresh_rate)
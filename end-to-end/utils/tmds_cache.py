@@ -0,0 +1,136 @@
+"""
+On-disk content-addressed store of encoded frames.
+
+Frames are saved as uint16 .npy files (TMDS symbols are 10 bits wide) and are
+read back memory-mapped. The key is the hash of the decoded image pixels plus
+what the frame holds: the encoding ('tmds', 'raw') and, with blanking, the
+layout of the blanking (symbols it is filled with and where the image is
+placed). The GNU Radio source (TMDS_encoding) and the end-to-end simulator
+(TMDS_encoding_original) give the same frames without blanking, so they
+share those entries; their blanked frames differ and are stored apart. Same
+file in gr-tempest/python/tmds_cache.py, keep both in sync.
+
+Environment variables:
+    TEMPEST_CACHE_DIR        cache directory (default ~/.cache/deep-tempest)
+    TEMPEST_CACHE_MAX_BYTES  size limit, least recently used frames are
+                             evicted above it (default 4 GiB)
+
+The cache directory is scanned for eviction only when the size this process
+keeps track of crosses the limit, and every EVICT_EVERY stores to account for
+the frames written by other processes.
+"""
+
+import os
+import hashlib
+import numpy as np
+
+CACHE_DIR = os.environ.get('TEMPEST_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'deep-tempest'))
+CACHE_MAX_BYTES = int(os.environ.get('TEMPEST_CACHE_MAX_BYTES', 4*1024**3))
+EVICT_EVERY = 64
+
+# Cache size after the last scan plus the frames stored since, None before the first scan
+_cache_bytes = None
+_stores_since_scan = 0
+
+
+def frame_key(I, encoding, blanking_layout=None):
+    """Content address of the frame of image I, encoded as encoding with blanking_layout (None: no blanking)"""
+    I = np.ascontiguousarray(I)
+    image_hash = hashlib.sha1()
+    image_hash.update(str((I.shape, I.dtype.str)).encode())
+    image_hash.update(I.data)
+    return '{}_{}_{}'.format(image_hash.hexdigest(), encoding, blanking_layout or 'noblank')
+
+def frame_path(key):
+    return os.path.join(CACHE_DIR, key + '.npy')
+
+def load_frame(key):
+    """Memory-mapped cached frame, or None if not in cache"""
+    path = frame_path(key)
+    try:
+        frame = np.load(path, mmap_mode='r')
+        # Refresh access time for least recently used eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return frame
+
+def store_frame(key, frame):
+    """Save frame as uint16 in the cache and return it"""
+    frame = np.asarray(frame).astype('uint16')
+    path = frame_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file and rename, so readers never see partial frames
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, frame)
+                nbytes = f.tell()
+            os.replace(tmp_path, path)
+        finally:
+            # Left behind only when the write failed
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except OSError:
+        # Read-only or full disk: work without cache
+        return frame
+    track_size(nbytes)
+    return frame
+
+def track_size(nbytes):
+    """Count a stored frame, evicting when the cache may have outgrown its limit"""
+    global _cache_bytes, _stores_since_scan
+    _stores_since_scan += 1
+    if _cache_bytes is not None:
+        _cache_bytes += nbytes
+    if _cache_bytes is None or _cache_bytes > CACHE_MAX_BYTES or _stores_since_scan >= EVICT_EVERY:
+        _cache_bytes = evict_frames()
+        _stores_since_scan = 0
+
+def evict_frames(max_bytes=None):
+    """Remove least recently used frames until the cache fits in max_bytes, returns its size"""
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+    try:
+        entries = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith('.npy')]
+    except OSError:
+        return None
+    stats = []
+    for entry in entries:
+        try:
+            stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+def cached_encoding(I, encoder, blanking=False, encoding='tmds', blanking_layout=None):
+    """
+    Encode image I with encoder(I, blanking=blanking), reusing the cached
+    frame when the same image was already encoded to the same frame
+
+    Args:
+        encoding: what encoder outputs, 'tmds' for every TMDS encoder
+        blanking_layout: blanking symbols and image placement of encoder,
+                         e.g. 'control-corner'. Encoders with the same
+                         encoding and layout share entries. None keeps the
+                         blanked frames of encoder apart from the others
+    """
+    if blanking and blanking_layout is None:
+        # numba dispatchers keep the python function at py_func
+        blanking_layout = getattr(encoder, 'py_func', encoder).__name__
+    key = frame_key(I, encoding, blanking_layout if blanking else None)
+    frame = load_frame(key)
+    if frame is None:
+        frame = store_frame(key, encoder(I, blanking=blanking))
+    return frame
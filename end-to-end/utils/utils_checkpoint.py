@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import torch
+
+
+'''
+# --------------------------------------------
+# Asynchronous checkpoint writer
+# --------------------------------------------
+# The training thread only takes a CPU snapshot of the state_dicts, files
+# are serialized by a background thread, written to a temporary file and
+# renamed, so an interrupted save never leaves a truncated checkpoint.
+# Saved steps (and their metrics) are listed in save_dir/manifest.json,
+# used for retention (keep last N / best K) and to resume training.
+# --------------------------------------------
+'''
+
+MANIFEST = 'manifest.json'
+
+
+def snapshot(state):
+    """Detached CPU copy of a (nested) state_dict"""
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        copy = type(state)((k, snapshot(v)) for k, v in state.items())
+        # Module state_dicts carry their versions, used by load_state_dict
+        if hasattr(state, '_metadata'):
+            copy._metadata = state._metadata
+        return copy
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(v) for v in state)
+    return state
+
+
+def load_manifest(save_dir):
+    try:
+        with open(os.path.join(save_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'checkpoints': []}
+
+
+def atomic_write(path, write_fn):
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter():
+    def __init__(self, save_dir, keep_last=None, keep_best=None, best_metric=None, best_mode='max'):
+        """
+        Args:
+            save_dir: model folder
+            keep_last: keep the N >= 1 most recent checkpoints (None keeps all)
+            keep_best: also keep the K best checkpoints according to best_metric
+            best_metric: metric name given at update_metrics, e.g. 'psnr'
+            best_mode: 'max' or 'min', whether larger metric is better
+        """
+        if keep_last is not None and keep_last < 1:
+            raise ValueError('keep_last must be None or >= 1, got {}'.format(keep_last))
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.best_metric = best_metric
+        self.best_mode = best_mode
+        self.manifest = load_manifest(save_dir)
+
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._worker, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    # ----------------------------------------
+    # training thread side
+    # ----------------------------------------
+    def save(self, step, states):
+        """
+        Args:
+            step: iteration/epoch label of the checkpoint
+            states: {'G': state_dict, 'optimizerG': state_dict, ...}, saved as {step}_{label}.pth
+        """
+        self.jobs.put(('save', step, {label: snapshot(state) for label, state in states.items()}))
+
+    def update_metrics(self, step, metrics):
+        """Attach metrics (e.g. validation PSNR) to the checkpoint of step"""
+        self.jobs.put(('metrics', step, {k: float(v) for k, v in metrics.items()}))
+
+    def flush(self):
+        """Wait until every pending checkpoint is on disk"""
+        self.jobs.join()
+
+    def close(self):
+        """Write pending checkpoints and stop the writer thread"""
+        if not self.thread.is_alive():
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        atexit.unregister(self.flush)
+
+    # ----------------------------------------
+    # writer thread side
+    # ----------------------------------------
+    def _worker(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                self.jobs.task_done()
+                return
+            job, step, data = item
+            try:
+                if job == 'save':
+                    self._write(step, data)
+                else:
+                    self._set_metrics(step, data)
+                self._apply_retention()
+                self._write_manifest()
+            except Exception as e:
+                print('Checkpoint writer error at step {}: {}'.format(step, e))
+            finally:
+                self.jobs.task_done()
+
+    def _entry(self, step):
+        for entry in self.manifest['checkpoints']:
+            if entry['step'] == step:
+                return entry
+        return None
+
+    def _write(self, step, states):
+        files = {}
+        for label, state in states.items():
+            filename = '{}_{}.pth'.format(step, label)
+            atomic_write(os.path.join(self.save_dir, filename), lambda f: torch.save(state, f))
+            files[label] = filename
+
+        entry = self._entry(step)
+        if entry is None:
+            entry = {'step': step, 'files': {}, 'metrics': {}}
+            self.manifest['checkpoints'].append(entry)
+            self.manifest['checkpoints'].sort(key=lambda e: e['step'])
+        entry['files'].update(files)
+        entry['time'] = time.time()
+
+    def _set_metrics(self, step, metrics):
+        entry = self._entry(step)
+        if entry is not None:
+            entry['metrics'].update(metrics)
+
+    def _apply_retention(self):
+        checkpoints = self.manifest['checkpoints']
+        if self.keep_last is None:
+            return
+
+        keep = set(e['step'] for e in checkpoints[-self.keep_last:])
+        if self.keep_best and self.best_metric:
+            scored = [e for e in checkpoints if self.best_metric in e['metrics']]
+            scored.sort(key=lambda e: e['metrics'][self.best_metric], reverse=(self.best_mode == 'max'))
+            keep.update(e['step'] for e in scored[:self.keep_best])
+
+        for entry in [e for e in checkpoints if e['step'] not in keep]:
+            for filename in entry['files'].values():
+                try:
+                    os.remove(os.path.join(self.save_dir, filename))
+                except OSError:
+                    pass
+            checkpoints.remove(entry)
+
+    def _write_manifest(self):
+        manifest = json.dumps(self.manifest, indent=2).encode()
+        atomic_write(os.path.join(self.save_dir, MANIFEST), lambda f: f.write(manifest))
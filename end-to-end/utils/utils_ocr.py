@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# First, must install Tesseract: https://tesseract-ocr.github.io/tessdoc/Installation.html
+# pip install fastwer pytesseract
+import pytesseract
+import fastwer
+
+
+'''
+# --------------------------------------------
+# Character/word error rate with an OCR worker pool
+# --------------------------------------------
+# scorer = OCRScorer(cache_path='logs/ocr_ground_truth.json')
+# future = scorer.submit(img_E, img_H)   # OCR runs while the caller continues
+# cer, wer = future.result()
+#
+# Every pytesseract call runs a tesseract process, so a thread pool runs
+# them in parallel without pickling the images. Ground-truth transcriptions
+# do not change between epochs/trials: they are cached by image content
+# (and saved to cache_path when given).
+# --------------------------------------------
+'''
+
+
+def image_to_text(img):
+    return pytesseract.image_to_string(img).strip().replace('\n',' ')
+
+
+def image_key(img):
+    img = np.ascontiguousarray(img)
+    image_hash = hashlib.sha1()
+    image_hash.update(str((img.shape, img.dtype.str)).encode())
+    image_hash.update(img.data)
+    return image_hash.hexdigest()
+
+
+class OCRScorer():
+    def __init__(self, num_workers=None, cache_path=None):
+        """
+        Args:
+            num_workers: parallel tesseract processes (default number of CPUs)
+            cache_path: json file of ground-truth transcriptions, None keeps them in memory only
+        """
+        self.pool = ThreadPoolExecutor(max_workers=num_workers or os.cpu_count())
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.gt_text = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                self.gt_text = json.load(f)
+        self.gt_text_saved = len(self.gt_text)
+
+    def ground_truth_text(self, img_H):
+        key = image_key(img_H)
+        with self.lock:
+            text = self.gt_text.get(key)
+        if text is None:
+            text = image_to_text(img_H)
+            with self.lock:
+                self.gt_text[key] = text
+        return text
+
+    def cer_wer(self, img_E, img_H, text_H=None):
+        """
+        CER and WER [%] of img_E transcription, same as tempest_evaluation.calculate_cer_wer
+
+        Args:
+            text_H: ground-truth text when known (rendered text), else transcription of img_H
+        """
+        if text_H is None:
+            text_H = self.ground_truth_text(img_H)
+        text_E = image_to_text(img_E)
+        cer = fastwer.score_sent(text_E, text_H, char_level=True)
+        wer = fastwer.score_sent(text_E, text_H)
+        return cer, wer
+
+    def cer(self, img_H, img_E):
+        """CER with the (img_H, img_E) argument order of the utils_image metrics"""
+        return self.cer_wer(img_E, img_H)[0]
+
+    def submit(self, img_E, img_H, text_H=None):
+        """Future of cer_wer(img_E, img_H, text_H)"""
+        return self.pool.submit(self.cer_wer, img_E, img_H, text_H)
+
+    def mean_cer(self, pairs):
+        """Average CER of a list of (img_H, img_E), transcribed in parallel"""
+        futures = [self.submit(img_E, img_H) for img_H, img_E in pairs]
+        cers = [future.result()[0] for future in futures]
+        self.save_cache()
+        return np.mean(cers)
+
+    def save_cache(self):
+        with self.lock:
+            if self.cache_path is None or len(self.gt_text) == self.gt_text_saved:
+                return
+            tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(self.gt_text, f)
+            os.replace(tmp_path, self.cache_path)
+            self.gt_text_saved = len(self.gt_text)
+
+    def close(self):
+        self.save_cache()
+        self.pool.shutdown()
@@ -144,11 +144,39 @@ def parse(opt_path, is_train=True):
     if 'E_param_strict' not in opt['path']:
         opt['train']['E_param_strict'] = True
 
+    # ----------------------------------------
+    # Gradient accumulation (micro-batches per optimizer step)
+    # ----------------------------------------
+    if 'G_accumulation_steps' not in opt['train']:
+        opt['train']['G_accumulation_steps'] = 1
+
+    # ----------------------------------------
+    # Checkpoint retention (None keeps every checkpoint)
+    # ----------------------------------------
+    if 'checkpoint_keep_last' not in opt['train']:
+        opt['train']['checkpoint_keep_last'] = None
+    if 'checkpoint_keep_best' not in opt['train']:
+        opt['train']['checkpoint_keep_best'] = 0
+    if 'checkpoint_best_metric' not in opt['train']:
+        opt['train']['checkpoint_best_metric'] = 'psnr'
+    if 'checkpoint_best_mode' not in opt['train']:
+        opt['train']['checkpoint_best_mode'] = 'max'
+
+    # ----------------------------------------
+    # CER validation (every checkpoint_test_cer epochs, 0 disables it)
+    # ----------------------------------------
+    if 'checkpoint_test_cer' not in opt['train']:
+        opt['train']['checkpoint_test_cer'] = 0
+    if 'cer_num_images' not in opt['train']:
+        opt['train']['cer_num_images'] = 10
+
     # ----------------------------------------
     # Exponential Moving Average
     # ----------------------------------------
     if 'E_decay' not in opt['train']:
         opt['train']['E_decay'] = 0
+    if 'E_update_every' not in opt['train']:
+        opt['train']['E_update_every'] = 1
 
     # ----------------------------------------
     # default setting for discriminator
@@ -180,6 +208,18 @@ def find_last_checkpoint(save_dir, net_type='G', pretrained_path=None):
         init_iter: iteration number
         init_path: model path
     """
+    # Checkpoints listed in the manifest written by utils_checkpoint.CheckpointWriter
+    try:
+        with open(os.path.join(save_dir, 'manifest.json'), 'r') as f:
+            checkpoints = json.load(f)['checkpoints']
+    except (OSError, ValueError, KeyError):
+        checkpoints = None
+    if checkpoints is not None:
+        saved = [c for c in checkpoints if net_type in c['files']]
+        if saved:
+            last = max(saved, key=lambda c: c['step'])
+            return last['step'], os.path.join(save_dir, last['files'][net_type])
+
     file_list = glob.glob(os.path.join(save_dir, '*_{}.pth'.format(net_type)))
     if file_list:
         iter_exist = []
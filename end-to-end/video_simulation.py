@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script that simulates the HDMI tempest capture of a video (a folder of
+frames, in name order), re-simulating only the lines that change
+
+python video_simulation.py path/to/frames path/to/captures --opt options/tempest_simulation.json
+
+Screen recordings change a few lines per frame (typing, scrolling text).
+TMDS disparity is reset on every line, and the capture processing is a
+chain of local FIR resamplers (SDR decimation, then SDR rate to pixel
+grid), so a changed line only affects the capture around it:
+
+1. changed lines are found comparing with the previous frame,
+2. only they are TMDS encoded and serialized, into the stored bit stream,
+3. the SDR samples depending on them are recomputed from a window of the
+   stream (with the filter length as margin) and spliced into the stored
+   SDR signal, the same is done from the SDR signal to the pixel grid.
+
+Spliced captures are equal to the simulation of the whole frame with the
+same resamplers, the cost follows the changed content. Harmonic and
+channel errors are drawn once per video; noise is drawn for every frame.
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+import os
+import json
+import math
+import functools
+import argparse
+import logging
+import time as time
+from fractions import Fraction
+from datetime import datetime
+import numpy as np
+from skimage.io import imread
+from scipy import signal
+from utils.DTutils import TMDS_encoding_original, TMDS_serial
+from utils.tmds_cache import cached_encoding
+from utils import utils_logger
+from folder_simulation import get_images_names_from_folder, save_simulation_image
+
+
+def rational(rate_out, rate_in):
+    """(up, down) integers of the exact resampling ratio rate_out/rate_in of two integer rates"""
+    ratio = Fraction(int(round(rate_out)), int(round(rate_in)))
+    return ratio.numerator, ratio.denominator
+
+@functools.lru_cache(maxsize=8)
+def resample_filter(up, down):
+    """FIR filter of signal.resample_poly(x, up, down), designed once per ratio"""
+    max_rate = max(up, down)
+    return signal.firwin(2*10*max_rate + 1, 1./max_rate, window=('kaiser', 5.0))
+
+def changed_row_spans(I, I_prev, merge_gap=2):
+    """[(r0, r1), ...] spans of rows of I different from I_prev, closer than merge_gap merged"""
+    axes = tuple(range(1, I.ndim))
+    rows = np.flatnonzero(np.any(I != I_prev, axis=axes))
+    spans = []
+    for row in rows:
+        if spans and row - spans[-1][1] < merge_gap:
+            spans[-1][1] = row + 1
+        else:
+            spans.append([row, row + 1])
+    return [tuple(span) for span in spans]
+
+def resample_span(read, n_in, n_out, start, stop, up, down):
+    """
+    Samples of signal.resample_poly(x, up, down) depending on x[start:stop],
+    computed from a window of x only
+
+    Args:
+        read: read(a, b) returns x[a:b]
+        n_in, n_out: lengths of x and of the (truncated) output
+    Returns:
+        o0, o1, y[o0:o1]
+    """
+    g = math.gcd(up, down)
+    up, down = up//g, down//g
+
+    # Half length of the resample_poly filter, in input samples
+    half = -(-10*max(up, down)//up) + 1
+
+    # Outputs whose filter support intersects x[start:stop]
+    o0 = max(0, (start - half)*up//down)
+    o1 = min(n_out, -(-(stop + half)*up//down))
+    if o1 <= o0:
+        return o0, o0, np.zeros(0, dtype='complex128')
+
+    # Input window of those outputs, starting on a sample mapped to an output sample
+    a = max(0, (o0*down//up - half)//down*down)
+    b = min(n_in, -(-o1*down//up) + half)
+    y = signal.resample_poly(read(a, b), up, down, window=resample_filter(up, down))
+    j0 = a*up//down
+    return o0, o1, y[o0 - j0:o1 - j0]
+
+
+class IncrementalCapture():
+    def __init__(self, N_harmonic, sdr_rate=50e6, noise_std=0, fps=60, freq_error=0, phase_error=0,
+                 interpolator=None, diff_signaling=False, blanking=False, chunk_rows=64):
+        """
+        Capture simulation of a sequence of frames, as image_capture_simulation
+        of folder_simulation.py but with FIR resampling to the pixel grid
+
+        Args:
+            chunk_rows: lines simulated at once on full frames (bounds memory)
+        """
+        self.N_harmonic = N_harmonic
+        self.sdr_rate = sdr_rate
+        self.noise_std = noise_std
+        self.fps = fps
+        self.freq_error = freq_error
+        self.phase_error = phase_error
+        # Condition for sampling rate
+        self.interpolator = interpolator or int(np.ceil(N_harmonic/5))
+        self.diff_signaling = diff_signaling and self.interpolator != 1
+        self.blanking = blanking
+        self.chunk_rows = chunk_rows
+        self.I = None
+
+    # ----------------------------------------
+    # full frame
+    # ----------------------------------------
+    def reset(self, I):
+        """Encode and simulate the whole frame I"""
+        self.I = I.copy()
+        self.I_TMDS = np.array(cached_encoding(I, TMDS_encoding_original, blanking=self.blanking,
+                                                   blanking_layout='fill-centred'))
+        self.v_total, self.h_total = self.I_TMDS.shape[:2]
+        self.v_offset = (self.v_total - I.shape[0])//2
+        self.h_offset = (self.h_total - I.shape[1])//2
+
+        # Compute pixelrate, bitrate and sampling rate
+        px_rate = self.h_total*self.v_total*self.fps
+        self.sample_rate = self.interpolator*10*px_rate
+        self.harm = self.N_harmonic*px_rate + self.freq_error
+        self.up_sdr, self.down_sdr = rational(self.sdr_rate, self.sample_rate)
+        self.up_px, self.down_px = rational(px_rate, self.sdr_rate)
+
+        # Serialized frame (values in [-3,3]) and signal lengths at every stage
+        self.I_Tx = np.zeros(10*self.h_total*self.v_total, dtype='int8')
+        self.n_continuous = len(self.I_Tx)*self.interpolator - int(self.diff_signaling)
+        self.n_sdr = -(-self.n_continuous*self.up_sdr//self.down_sdr)
+        self.n_px = self.h_total*self.v_total
+        self.I_Rx = np.zeros(self.n_sdr, dtype='complex128')
+        self.I_capture = np.zeros(self.n_px, dtype='complex128')
+
+        for r0 in range(0, self.v_total, self.chunk_rows):
+            r1 = min(r0 + self.chunk_rows, self.v_total)
+            self.I_Tx[self.row_samples(r0, r1)] = TMDS_serial(self.I_TMDS[r0:r1])
+            self.update_rows(r0, r1)
+
+    # ----------------------------------------
+    # changed lines only
+    # ----------------------------------------
+    def update(self, I):
+        """
+        Re-encode and re-simulate the lines of I that changed since the last
+        frame, returns the number of simulated lines of I
+        """
+        if self.I is None or I.shape != self.I.shape:
+            self.reset(I)
+            return I.shape[0]
+
+        spans = changed_row_spans(I, self.I)
+        for r0, r1 in spans:
+            # TMDS disparity is reset on every line: rows are encoded on their own
+            rows_TMDS = TMDS_encoding_original(I[r0:r1], blanking=False)
+            R0, R1 = r0 + self.v_offset, r1 + self.v_offset
+            self.I_TMDS[R0:R1, self.h_offset:self.h_offset + I.shape[1]] = rows_TMDS
+            self.I_Tx[self.row_samples(R0, R1)] = TMDS_serial(self.I_TMDS[R0:R1])
+            self.update_rows(R0, R1)
+        self.I = I.copy()
+        return sum(r1 - r0 for r0, r1 in spans)
+
+    def row_samples(self, R0, R1):
+        """Serialized samples of lines [R0, R1) of the encoded frame"""
+        return slice(10*self.h_total*R0, 10*self.h_total*R1)
+
+    def continuous(self, a, b):
+        """Samples [a, b) of the interpolated, modulated signal"""
+        interpolator = self.interpolator
+        stop = b + int(self.diff_signaling)
+        first_bit = a//interpolator
+        bits = self.I_Tx[first_bit:-(-stop//interpolator)].astype('float64')
+        x = np.repeat(bits, interpolator)[a - first_bit*interpolator:stop - first_bit*interpolator]
+
+        # Differential signaling
+        if self.diff_signaling:
+            x = np.diff(x)
+
+        # AM modulation according to pixel harmonic (including frequency and phase error)
+        t_continuous = np.arange(a, a + len(x))/self.sample_rate
+        return x*np.exp(2j*np.pi*self.harm*t_continuous + 1j*self.phase_error)
+
+    def update_rows(self, R0, R1):
+        """Splice the SDR and pixel samples depending on lines [R0, R1) of the encoded frame"""
+        samples = self.row_samples(R0, R1)
+        start = samples.start*self.interpolator
+        stop = min(samples.stop*self.interpolator, self.n_continuous)
+
+        # SDR sampling
+        o0, o1, I_Rx = resample_span(self.continuous, self.n_continuous, self.n_sdr, start, stop,
+                                     self.up_sdr, self.down_sdr)
+        self.I_Rx[o0:o1] = I_Rx
+
+        # Resampling to the image size
+        p0, p1, I_capture = resample_span(lambda a, b: self.I_Rx[a:b], self.n_sdr, self.n_px, o0, o1,
+                                          self.up_px, self.down_px)
+        self.I_capture[p0:p1] = I_capture
+
+    def capture(self):
+        """Current capture (v_total, h_total), with a new noise realization"""
+        I_capture = self.I_capture
+        if self.noise_std > 0:
+            # Same in-band power as noise added before SDR sampling
+            noise_sigma = self.noise_std/15.968719423*math.sqrt(self.up_sdr/self.down_sdr) # sqrt(255)~15.968719423
+            noise = np.random.normal(0, noise_sigma, self.n_sdr) + 1j*np.random.normal(0, noise_sigma, self.n_sdr)
+            noise = signal.resample_poly(noise, self.up_px, self.down_px,
+                                         window=resample_filter(self.up_px, self.down_px))[:self.n_px]
+            I_capture = I_capture.copy()
+            I_capture[:len(noise)] += noise
+        return I_capture.reshape(self.v_total, self.h_total)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Simulate the tempest capture of a folder of video frames')
+    parser.add_argument('frames', type=str, help='folder with the frames, in name order')
+    parser.add_argument('output', type=str, help='folder for the simulated captures')
+    parser.add_argument('--opt', type=str, default='options/tempest_simulation.json', help='Path to option JSON file.')
+    parser.add_argument('--format', type=str, default=None, choices=['png', 'npy', 'npz'],
+                        help='Capture format (default capture_format of the options, or the frames extension)')
+    args = parser.parse_args()
+
+    # Load JSON options file
+    options = json.load(open(args.opt))
+
+    logs_dir = 'logfiles/'
+    os.makedirs(logs_dir, exist_ok=True)
+    logger_name = 'video_simulations_'+datetime.now().strftime("%d-%m-%Y_%H:%M:%S")
+    utils_logger.logger_info(logger_name, os.path.join(logs_dir,logger_name+'.log'))
+    logger = logging.getLogger(logger_name)
+
+    os.makedirs(args.output, exist_ok=True)
+    frames = sorted(get_images_names_from_folder(args.frames))
+    logger.info(f'Tempest capture simulation for {len(frames)} frames of {args.frames}\n')
+
+    # Get tempest options, channel effects are fixed along the video
+    tempest_options = options['options']
+    capture_format = args.format or tempest_options.get('capture_format')
+    freq_error_range = tempest_options['random']['freq_error']
+    phase_error_range = tempest_options['random']['phase_error']
+    sigma = tempest_options['random']['sigma']
+    if type(sigma) == list:
+        sigma = np.random.randint(sigma[0],sigma[1])
+    elif sigma is None:
+        sigma = 0
+
+    simulator = IncrementalCapture(N_harmonic=np.random.choice(tempest_options['random']['harmonics']),
+                                   sdr_rate=tempest_options['sdr_rate'], noise_std=sigma,
+                                   fps=tempest_options['frames_per_second'],
+                                   freq_error=np.random.randint(freq_error_range[0], freq_error_range[1]),
+                                   phase_error=np.random.uniform(phase_error_range[0], phase_error_range[1])*np.pi,
+                                   interpolator=tempest_options['interpolator'],
+                                   diff_signaling=tempest_options['differential_signaling'],
+                                   blanking=tempest_options['blanking'])
+    logger.info(f'{simulator.N_harmonic} pixel harmonic frequency, {simulator.freq_error} Hz and {simulator.phase_error} rads error.')
+
+    t_all_frames = 0
+    for frame in frames:
+        t1_frame = time.time()
+        I = imread(os.path.join(args.frames, frame))
+
+        changed_rows = simulator.update(I)
+        frame_name, frame_ext = os.path.splitext(frame)
+        capture_ext = '.'+capture_format if capture_format else frame_ext
+        save_simulation_image(simulator.capture(), os.path.join(args.output, frame_name+capture_ext))
+
+        t_frame = time.time()-t1_frame
+        t_all_frames += t_frame
+        message = 'Frame {}: {} lines simulated, processing time: {:.2f}s'.format(frame, changed_rows, t_frame)
+        logger.info(message)
+
+    logger.info('Total processing time for {} frames: {:.2f}s \n'.format(len(frames),t_all_frames))
+
+
+if __name__ == "__main__":
+    main()
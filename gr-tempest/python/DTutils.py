@@ -1,8 +1,12 @@
+import functools
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy import signal
-import cv2 as cv
-from scipy.spatial import distance_matrix
+# scipy, cv2 and matplotlib are imported by the functions using them, so
+# the image sources importing the TMDS functions do not load them
+try:
+  from .timings import get_timing
+except ImportError:
+  # Loaded outside of the tempest package (offline_iq script, benchmarks)
+  from timings import get_timing
 
 def autocorr(x):
 	"""Compute autocorrelation function of 1-D array
@@ -14,6 +18,8 @@ def autocorr(x):
 	autocorr:	autocorrelation function of x
 	"""
 
+	from scipy import signal
+
 	# Use FFT method, which has more computing efectiveness for 1-D numpy arrays
 	autocorr = signal.correlate(x,x,mode='full', method= 'fft')
 
@@ -140,18 +146,14 @@ def TMDS_encoding_original (I, blanking = False):
   # Get image resolution
   v_in, h_in = I.shape[:2]
   
-  if blanking:
-    # Get blanking resolution for input image
-    
-    v = (v_in==1080)*1125 + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-    h = (h_in==1920)*2200 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
+  # Blanking frame of the resolution, None if it is not a known mode
+  template = blanking_template(h_in, v_in, control_symbols=False) if blanking else None
 
-    vdiff = v - v_in
-    hdiff = h - h_in
-
-    # Create image with blanking and change type to uint16
-    # Assuming the blanking corresponds to 10bit number [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first)
-    I_c = 852*np.ones((v,h,chs)).astype('uint16')
+  if template is not None:
+    # Get blanking resolution for input image
+    v_diff = template.shape[0] - v_in
+    h_diff = template.shape[1] - h_in
+    I_c = template.copy()
     
   else:
     v_diff = 0
@@ -301,6 +303,34 @@ def TMDS_blanking (h_total, v_total, h_active, v_active, h_front_porch, v_front_
 
   return(img_blank)
 
+@functools.lru_cache(maxsize=None)
+def blanking_template (h_active, v_active, control_symbols = True):
+  """Blanking frame of a resolution, shared by every image encoded with it
+
+  Inputs: 
+  - h_active, v_active: active resolution, looked up in the timings registry (modes.txt)
+  - control_symbols: Boolean, control symbols of TMDS_blanking on the third channel 
+    (TMDS_encoding) or 852 on every channel (TMDS_encoding_original)
+
+  Output:
+  - I_b: read-only 3D (v_total, h_total, 3) uint16 frame, encoders copy it and
+    write the active area. None if the resolution (or its porches) is not in the registry
+
+  """ 
+  timing = get_timing(h_active, v_active)
+  if timing is None or (control_symbols and timing.h_front_porch is None):
+    return None
+
+  # Assuming the blanking corresponds to 10bit number 
+  # [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first) for channels R and G
+  I_b = np.full((timing.v_total, timing.h_total, 3), 852, dtype='uint16')
+  if control_symbols:
+    I_b[:,:,2] = TMDS_blanking(h_total=timing.h_total, v_total=timing.v_total, h_active=h_active, v_active=v_active, 
+                  h_front_porch=timing.h_front_porch, v_front_porch=timing.v_front_porch, 
+                  h_back_porch=timing.h_back_porch, v_back_porch=timing.v_back_porch)
+  I_b.setflags(write=False)
+  return I_b
+
 def TMDS_encoding (I, blanking = False):
   """TMDS image coding
 
@@ -325,27 +355,14 @@ def TMDS_encoding (I, blanking = False):
   # Get image resolution
   v_in, h_in = I.shape[:2]
   
-  if blanking:
-    # Get blanking resolution for input image
-    
-    v = (v_in==1080)*1125 + (v_in==900)*1000  + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-    h = (h_in==1920)*2200 + (h_in==1600)*1800 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
-
-    v_diff = v - v_in
-    h_diff = h - h_in
+  # Blanking frame of the resolution, None if it is not a known mode
+  template = blanking_template(h_in, v_in, control_symbols=True) if blanking else None
 
-    v_front_porch = (v_in==1080)*4 + (v_in==900)*1  + (v_in==720)*5   + (v_in==600)*1  + (v_in==480)*2
-    v_back_porch = (v_in==1080)*36 + (v_in==900)*96  + (v_in==720)*20   + (v_in==600)*23  + (v_in==480)*25
-
-    h_front_porch = (h_in==1920)*88 + (h_in==1600)*24 + (h_in==1280)*110 + (h_in==800)*40 + (h_in==640)*8 
-    h_back_porch = (h_in==1920)*148 + (h_in==1600)*96 + (h_in==1280)*220 + (h_in==800)*88 + (h_in==640)*40 
-
-    # Create image with blanking and change type to uint16
-    # Assuming the blanking corresponds to 10bit number 
-    # [0, 0, 1, 0, 1, 0, 1, 0, 1, 1] (LSB first) for channels R and G
-    I_c = 852*np.ones((v,h,chs)).astype('uint16')
-    I_c[:,:,2] = TMDS_blanking(h_total=h, v_total=v, h_active=h_in, v_active=v_in, 
-                    h_front_porch=h_front_porch, v_front_porch=v_front_porch, h_back_porch=h_back_porch, v_back_porch=v_back_porch)
+  if template is not None:
+    # Get blanking resolution for input image
+    v_diff = template.shape[0] - v_in
+    h_diff = template.shape[1] - h_in
+    I_c = template[:,:,:chs].copy()
     
   else:
     v_diff = 0
@@ -469,6 +486,8 @@ def remove_outliers(I, radius=3, threshold=20):
     Replaces a pixel by the median of the pixels in the surrounding if it deviates from the median by more than a certain value (the threshold).
     """
 
+    import cv2 as cv
+
     # Copy input
     I_output = I.copy()
 
@@ -513,6 +532,10 @@ def apply_blanking_shift(I, h_active=1600, v_active=900,
     Correct capture shift to center image using VESA blanking information.
     The image must not have geometric distortion (generaly caused by sampling error)
     """
+    import cv2 as cv
+    from scipy.spatial import distance_matrix
+    if debug:
+        from matplotlib import pyplot as plt
     
     if debug:
         # Show original image
@@ -715,6 +738,7 @@ def preprocess_raw_capture(I, h_active, v_active,
     I_out = adjust_dynamic_range(I_no_outliers)
 
     if debug:
+        from matplotlib import pyplot as plt
         is_centered = (I == I_shift_fix)
 
         plt.figure(figsize=(12,10))
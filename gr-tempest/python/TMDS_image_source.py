@@ -28,9 +28,42 @@
 import numpy as np
 from PIL import Image
 from tempest.DTutils import TMDS_pix_table, TMDS_cntdiff_table, pixel_fastencoding, TMDS_encoding
+from tempest.tmds_cache import cached_encoding
+from tempest.timings import get_timing
 from gnuradio import gr
 
 
+def raw_encoding(I, blanking=False):
+    """Frame without TMDS encoding, blanking filled with 255 if required"""
+
+    # Create "ghost dimension" if I is gray-scale image (not RGB)
+    if len(I.shape)!= 3:
+      # Gray-scale image
+      I = np.repeat(I[:, :, np.newaxis], 3, axis=2).astype('uint8')
+      chs = 1
+    else:
+      # RGB image
+      chs = 3
+
+    # Total resolution from the timings registry, None if it is not a known mode
+    v_in, h_in = I.shape[:2]
+    timing = get_timing(h_in, v_in) if blanking else None
+
+    if timing is not None:
+      # Use blanking
+      v, h = timing.v_total, timing.h_total
+      image_blank = 255*np.ones((v,h,3), dtype='uint8')
+
+
+      hdiff = (h-h_in)//2
+      vdiff = (v-v_in)//2
+      image_blank[vdiff:vdiff+v_in,hdiff:hdiff+h_in] = I[:,:,:3]
+
+      I = image_blank
+
+    return I[:,:,:3]
+
+
 class TMDS_image_source(gr.sync_block):
     """
     TMDS encoding for the input image. Produces blanking. 
@@ -38,7 +71,9 @@ class TMDS_image_source(gr.sync_block):
     * 640x480
     * 800x600
     * 1280x720
+    * 1600x900
     * 1920x1080
+    or any mode of modes.txt listed with its porches.
     """
 
     def __init__(self, image_file, mode, blanking):
@@ -55,52 +90,33 @@ class TMDS_image_source(gr.sync_block):
     def load_image(self):
 
         """Decode the image into a buffer and encode it (or not) TMDS"""
-        self.image_data = np.array(Image.open(self.image_file))
+        image_data = np.array(Image.open(self.image_file))
 
-        # Check if mode uses TMDS encoding
+        # Check if mode uses TMDS encoding. Encoded frames are shared
+        # on disk, so the same image is never encoded twice
         if (self.mode==1 or self.mode==3):
-            #Encode the image with TMDS
-            self.image_data = TMDS_encoding(self.image_data,blanking = self.blanking)
+            frame = cached_encoding(image_data, TMDS_encoding, blanking=self.blanking,
+                                    blanking_layout='control-corner')
             print('TMDS encoding ready!!!')
-
         else:
-
             # Do not encode TMDS
-            # Create "ghost dimension" if I is gray-scale image (not RGB)
-            if len(self.image_data.shape)!= 3:
-              # Gray-scale image
-              self.image_data = np.repeat(self.image_data[:, :, np.newaxis], 3, axis=2).astype('uint8')
-              chs = 1
-            else:
-              # RGB image
-              chs = 3
-
-            if self.blanking:
-              # Use blanking
-              v_in, h_in = self.image_data.shape[:2]
-              v = (v_in==1080)*1125 + (v_in==900)*1000  + (v_in==720)*750   + (v_in==600)*628  + (v_in==480)*525
-              h = (h_in==1920)*2200 + (h_in==1600)*1800 + (h_in==1280)*1650 + (h_in==800)*1056 + (h_in==640)*800 
-              image_blank = 255*np.ones((v,h,chs))
-
-
-              hdiff = (h-h_in)//2
-              vdiff = (v-v_in)//2
-              image_blank[vdiff:vdiff+v_in,hdiff:hdiff+h_in] = self.image_data[:,:,:3]
-
-              self.image_data = image_blank[:,:,:3]
+            frame = cached_encoding(image_data, raw_encoding, blanking=self.blanking,
+                                    encoding='raw', blanking_layout='255-centred')
 
-        
-        (self.image_height, self.image_width) = self.image_data.shape[:2]
+        (self.image_height, self.image_width) = frame.shape[:2]
         
         self.set_output_multiple(self.image_width)
-        
 
-        self.image_data_red   = list(self.image_data[:,:,0].flatten())
-        self.image_data_green = list(self.image_data[:,:,1].flatten())
-        self.image_data_blue  = list(self.image_data[:,:,2].flatten())
-        self.image_len = len(self.image_data)
+        # One contiguous float32 row per channel
+        self.image_data = np.ascontiguousarray(np.moveaxis(frame, 2, 0).reshape(3, -1), dtype=np.float32)
+        self.image_len = self.image_data.shape[1]
         self.line_num = 0
 
+    def set_image_file(self, image_file):
+        """Swap the transmitted image, restarting from the first line"""
+        self.image_file = image_file
+        self.load_image()
+
     def get_image_shape(self):
       return (self.image_height,self.image_width)
 
@@ -111,17 +127,23 @@ class TMDS_image_source(gr.sync_block):
             print('[TMDS image source] Last image line transmitted')
             return(-1)
 
-        out_red = output_items[0]
-        out_red[:self.image_width] = self.image_data_red[self.image_width*self.line_num: self.image_width*(1+self.line_num)]
-
-        out_green = output_items[1]
-        out_green[:self.image_width] = self.image_data_green[self.image_width*self.line_num: self.image_width*(1+self.line_num)]
-
-        out_blue = output_items[2]
-        out_blue[:self.image_width] = self.image_data_blue[self.image_width*self.line_num: self.image_width*(1+self.line_num)]
-
-        self.line_num += 1
-        if (self.mode==1 or self.mode==2) and (self.line_num >= self.image_height):
-            self.line_num = 0
-
-        return self.image_width
+        # Fill as many whole lines as the scheduler allows
+        nlines = len(output_items[0])//self.image_width
+        if (self.mode==3 or self.mode==4):
+            nlines = min(nlines, self.image_height - self.line_num)
+
+        noutput = nlines*self.image_width
+        produced = 0
+        while produced < noutput:
+            start = self.image_width*self.line_num
+            count = min(noutput - produced, self.image_len - start)
+            for channel in range(3):
+                output_items[channel][produced:produced+count] = self.image_data[channel, start:start+count]
+            produced += count
+            self.line_num += count//self.image_width
+
+            # Wrap around the frame on repeat modes
+            if (self.mode==1 or self.mode==2) and (self.line_num >= self.image_height):
+                self.line_num = 0
+
+        return noutput
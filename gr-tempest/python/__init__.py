@@ -38,16 +38,37 @@ from .tempest_msgbtn import tempest_msgbtn
 from .TMDS_image_source import TMDS_image_source
 
 from .TMDS_decoder import TMDS_decoder
+from .resolution import infer_resolution, scan_resolution
 
-from .buttonToFileSink import buttonToFileSink
+# The enhancement stack (torch, cv2, scipy, matplotlib) is only imported
+# when one of these names is first used (PEP 562), so flowgraphs that
+# never enhance do not pay for it on `import tempest`
+_LAZY_ATTRIBUTES = {
+    'buttonToFileSink': ('.buttonToFileSink', 'buttonToFileSink'),
+    'apply_blanking_shift': ('.DTutils', 'apply_blanking_shift'),
+    'remove_outliers': ('.DTutils', 'remove_outliers'),
+    'adjust_dynamic_range': ('.DTutils', 'adjust_dynamic_range'),
+    'option': ('.utils_option', None),
+    'util': ('.utils_image', None),
+    'get_dist_info': ('.utils_dist', 'get_dist_info'),
+    'init_dist': ('.utils_dist', 'init_dist'),
+    'define_Model': ('.select_model', 'define_Model'),
+    'B': ('.basicblock', None),
+    'net': ('.network_unet', 'UNetRes'),
+}
 
-from .DTutils import apply_blanking_shift, remove_outliers, adjust_dynamic_range
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    import importlib
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    module = importlib.import_module(module_name, __name__)
+    value = module if attribute is None else getattr(module, attribute)
+    # Cache it, later lookups do not go through __getattr__
+    globals()[name] = value
+    return value
 
-from . import utils_option as option
-from . import utils_image as util
-from .utils_dist import get_dist_info, init_dist
-from .select_model import define_Model
-from . import basicblock as B
-from .network_unet import UNetRes as net
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
 
 #
@@ -21,13 +21,15 @@ import torch
 import sys
 
 from .DTutils import apply_blanking_shift, remove_outliers, adjust_dynamic_range
+from .timings import get_timing_by_total
+from .utils_capture import save_capture
 
 from . import utils_option as option
 from . import utils_image as util
 from .utils_dist import get_dist_info, init_dist
 from .select_model import define_Model
 from . import basicblock as B
-from .network_unet import UNetRes as net
+from .network_unet import UNetRes as net, UNetResInference, load_quantized_model
 
 def load_enhancement_model(json_path=None):
     '''
@@ -74,6 +76,10 @@ def load_enhancement_model(json_path=None):
     act_mode = opt_netG['act_mode']
     bias = opt_netG['bias']
 
+    if model_path.endswith('.pt'):
+        # Static int8 model from quantize_drunet.py, runs on CPU only
+        return load_quantized_model(model_path)
+
     model = net(in_nc=in_nc, out_nc=out_nc, nc=nc, nb=nb, act_mode=act_mode, bias=bias)
     model.load_state_dict(torch.load(model_path), strict=True)
     model.eval()
@@ -81,6 +87,9 @@ def load_enhancement_model(json_path=None):
         v.requires_grad = False
     model = model.to(device)
 
+    # bf16 / channels_last / compile / script, see UNetResInference
+    model = UNetResInference(model, mode=opt_netG['inference_mode'])
+
     return model
 
 
@@ -89,7 +98,7 @@ class buttonToFileSink(gr.sync_block):
     Block that saves num_samples of complex samples after recieving a TRUE boolean message in the 'en' port
     """
     def __init__(self, Filename = "output.png", input_width=740, H_size=2200, V_size=1125, 
-                 remove_blanking=False, enhance_image=False, option_path=None):
+                 remove_blanking=False, enhance_image=False, option_path=None, capture_format='png'):
         gr.sync_block.__init__(self,
             name="buttonToFileSink",
             in_sig=[(np.complex64)],
@@ -102,6 +111,7 @@ class buttonToFileSink(gr.sync_block):
         self.enhance_image = enhance_image
         self.option_path = option_path
         self.remove_blanking = remove_blanking
+        self.capture_format = capture_format
         self.num_samples = int(input_width*V_size)
         self.en = False #default
         self.remaining2Save = 0
@@ -110,9 +120,9 @@ class buttonToFileSink(gr.sync_block):
         self.set_msg_handler(pmt.intern("en"), self.handle_msg) #declare handler for messages
         self.stream_image = [] # initialize list to apppend samples
 
-        # TODO: fancy active-blanking resolution identification 
-        self.V_active = (self.V_size==1125)*1080 + (self.V_size==1000)*900  + (self.V_size==750) *720  + (self.V_size==628) *600 + (self.V_size==525)*480
-        self.H_active = (self.H_size==2200)*1920 + (self.H_size==1800)*1600 + (self.H_size==1650)*1280 + (self.H_size==1056)*800 + (self.H_size==800)*640
+        # Active resolution of the mode with this total resolution (timings registry)
+        timing = get_timing_by_total(self.H_size, self.V_size)
+        self.H_active, self.V_active = (timing.h_active, timing.v_active) if timing is not None else (0, 0)
 
         self.V_blanking = self.V_size - self.V_active
         self.H_blanking = self.H_size - self.H_active
@@ -207,9 +217,13 @@ class buttonToFileSink(gr.sync_block):
             im = Image.fromarray(imgshow)
             im.show()
 
-        # Save complex capture image as png
         im_complex = Image.fromarray(captured_image)
-        im_complex.save(self.Filename+'-gr-tempest_screenshot_'+date_time+'.png')
+        if self.capture_format == 'png':
+            # Save complex capture image as png
+            im_complex.save(self.Filename+'-gr-tempest_screenshot_'+date_time+'.png')
+        else:
+            # Lossless complex capture (npy/npz), as sampled: no stretching nor blanking alignment
+            save_capture(captured_image_complex, self.Filename+'-gr-tempest_screenshot_'+date_time+'.'+self.capture_format)
         if not(self.enhance_image):
             # Show image at runtime
             im_complex.show()
@@ -26,6 +26,7 @@
 # 
 # 
 
+import os
 import numpy
 from gnuradio import gr
 from PIL import Image
@@ -56,42 +57,58 @@ class image_source(gr.sync_block):
         self.Vtotal = Vtotal
         self.Hblanking = (Htotal - Hvisible)//2
         self.Vblanking = (Vtotal - Vvisible)//2
+        self.image_mtime = None
+        self.line_num = 0
         self.load_image()
 
     def load_image(self):
         """decode the image into a buffer"""
-        self.image_data = Image.open(self.image_file)
-        self.image_data = ImageOps.grayscale(self.image_data)
+        image = Image.open(self.image_file)
+        image = ImageOps.grayscale(image)
         
         
         newsize = (self.Hvisible, self.Vvisible)
-        self.image_data = self.image_data.resize(newsize)
+        image = image.resize(newsize)
      
         # I create the blanking
-        background = Image.new('F', (self.Htotal, self.Vtotal), (0))
+        background = numpy.zeros((self.Vtotal, self.Htotal), dtype=numpy.float32)
         # I paste the image with the blankins
-        offset = (self.Hblanking, self.Vblanking)
-        background.paste(self.image_data, offset)
-        self.image_data = background
+        background[self.Vblanking:self.Vblanking+self.Vvisible,
+                   self.Hblanking:self.Hblanking+self.Hvisible] = numpy.asarray(image, dtype=numpy.float32)
         
-        (self.image_width, self.image_height) = self.image_data.size
+        (self.image_height, self.image_width) = background.shape
         
         self.set_output_multiple(self.image_width)
         
-        self.image_data = list(self.image_data.getdata())
+        # Flat contiguous frame, sliced directly into the output buffer at work()
+        self.image_data = numpy.ascontiguousarray(background.ravel())
         self.image_len = len(self.image_data)
-        self.line_num = 0
+        self.image_mtime = os.path.getmtime(self.image_file)
 
+    def reload_if_modified(self):
+        """Re-read the image only when the file on disk has changed"""
+        try:
+            mtime = os.path.getmtime(self.image_file)
+        except OSError:
+            # File is being rewritten, keep the last frame
+            return
+        if mtime != self.image_mtime:
+            self.load_image()
 
     def work(self, input_items, output_items):
         out = output_items[0]
-        out[:self.image_width] = self.image_data[self.image_width*self.line_num: self.image_width*(1+self.line_num)]
 
-        self.line_num += 1
-        if self.line_num >= self.image_height:
-            self.line_num = 0
-        
-        if self.repeatmode == 2:
-            self.load_image()
-        return self.image_width
+        # Fill as many whole lines as the scheduler allows, wrapping around the frame
+        noutput = (len(out)//self.image_width)*self.image_width
+        produced = 0
+        while produced < noutput:
+            start = self.image_width*self.line_num
+            count = min(noutput - produced, self.image_len - start)
+            out[produced:produced+count] = self.image_data[start:start+count]
+            produced += count
+            self.line_num = (self.line_num + count//self.image_width) % self.image_height
+
+            if self.repeatmode == 2 and self.line_num == 0:
+                self.reload_if_modified()
 
+        return noutput
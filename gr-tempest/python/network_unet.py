@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from . import basicblock as B
 import numpy as np
 
@@ -60,11 +61,20 @@ class UNetRes(nn.Module):
 
         # Resolve upsampling size issues with padding
         h, w = x0.size()[-2:]
-        paddingBottom = int(np.ceil(h/8)*8-h)
-        paddingRight = int(np.ceil(w/8)*8-w)
-        x0 = nn.ReplicationPad2d((0, paddingRight, 0, paddingBottom))(x0)
+        paddingBottom = -h % 8
+        paddingRight = -w % 8
+        if paddingBottom or paddingRight:
+            x0 = F.pad(x0, (0, paddingRight, 0, paddingBottom), mode='replicate')
 
-        # Forward UNet
+        x = self.forward_padded(x0)
+
+        # Crop result to original size
+        x = x[..., :h, :w]
+
+        return x
+
+    def forward_padded(self, x0):
+        # Forward UNet, input size must be a multiple of 8
 
         x1 = self.m_head(x0)
         x2 = self.m_down1(x1)
@@ -76,12 +86,145 @@ class UNetRes(nn.Module):
         x = self.m_up1(x+x2)
         x = self.m_tail(x+x1)
 
-        # Crop result to original size
-        x = x[..., :h, :w]
-
         return x
 
 
+# ====================
+# Inference modes
+# ====================
+
+INFERENCE_MODES = ['fp32', 'bf16', 'channels_last', 'compile', 'script']
+
+
+def parse_inference_mode(mode):
+    """'bf16+channels_last' -> {'bf16', 'channels_last'}"""
+    modes = set((mode or 'fp32').split('+'))
+    for m in modes:
+        if m not in INFERENCE_MODES:
+            raise NotImplementedError('inference mode [{:s}] is not found'.format(m))
+    return modes
+
+
+class UNetResInference(nn.Module):
+    """
+    Inference-only runner of a trained UNetRes.
+
+    mode is a '+' separated combination of:
+    * fp32:          plain float32 (default)
+    * bf16:          bfloat16 autocast (CPU or GPU)
+    * channels_last: NHWC memory format
+    * compile:       torch.compile the network (torch>=2.0)
+    * script:        TorchScript trace of the network, see export()
+
+    Input is padded to a multiple of 8 into a buffer reused between calls of
+    the same size, instead of creating a new padded tensor each time.
+    """
+    def __init__(self, model, mode='fp32'):
+        super(UNetResInference, self).__init__()
+        self.modes = parse_inference_mode(mode)
+
+        model.eval()
+        for k, v in model.named_parameters():
+            v.requires_grad = False
+
+        self.memory_format = torch.channels_last if 'channels_last' in self.modes else torch.contiguous_format
+        model = model.to(memory_format=self.memory_format)
+
+        self.bf16 = 'bf16' in self.modes
+        if self.bf16 and 'script' in self.modes:
+            # Autocast is not recorded by tracing, so trace bfloat16 weights
+            model = model.to(torch.bfloat16)
+        self.model = model
+        self.body = model.forward_padded
+
+        if 'compile' in self.modes:
+            if hasattr(torch, 'compile'):
+                self.body = torch.compile(model.forward_padded)
+            else:
+                print('torch.compile not available, running eager')
+
+        self.traced = None
+        self.pad_buffer = None
+
+    def pad(self, x):
+        n, c, h, w = x.size()
+        H, W = h + (-h % 8), w + (-w % 8)
+        if (H, W) == (h, w):
+            return x.contiguous(memory_format=self.memory_format)
+
+        buffer = self.pad_buffer
+        if buffer is None or buffer.size() != (n, c, H, W) or buffer.dtype != x.dtype or buffer.device != x.device:
+            buffer = torch.empty((n, c, H, W), dtype=x.dtype, device=x.device).contiguous(memory_format=self.memory_format)
+            self.pad_buffer = buffer
+
+        # Replication padding on bottom and right borders
+        buffer[..., :h, :w].copy_(x)
+        if H > h:
+            buffer[..., h:, :w].copy_(x[..., h-1:h, :].expand(-1, -1, H-h, -1))
+        if W > w:
+            buffer[..., w:].copy_(buffer[..., w-1:w].expand(-1, -1, -1, W-w))
+        return buffer
+
+    def run_body(self, x):
+        if 'script' in self.modes:
+            if self.traced is None:
+                self.traced = torch.jit.trace_module(self.model, {'forward_padded': x})
+            return self.traced.forward_padded(x)
+        return self.body(x)
+
+    def forward(self, x0):
+        h, w = x0.size()[-2:]
+        x = self.pad(x0)
+
+        with torch.no_grad():
+            if self.bf16 and 'script' in self.modes:
+                x = self.run_body(x.to(torch.bfloat16))
+            else:
+                with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                    x = self.run_body(x)
+
+        return x[..., :h, :w].float().contiguous()
+
+    def export(self, path, example_input):
+        """Save the TorchScript trace of the network (padded input size)"""
+        if self.traced is None:
+            with torch.no_grad():
+                example_input = self.pad(example_input)
+                if self.bf16:
+                    example_input = example_input.to(torch.bfloat16)
+                self.traced = torch.jit.trace_module(self.model, {'forward_padded': example_input})
+        torch.jit.save(self.traced, path)
+
+
+class QuantizedUNetRes(nn.Module):
+    """
+    Static int8 UNetRes saved by quantize_drunet.py as TorchScript (CPU only).
+    The quantized network expects sizes multiple of 8, padding and cropping
+    are kept in float here.
+    """
+    def __init__(self, body):
+        super(QuantizedUNetRes, self).__init__()
+        self.body = body
+
+    def forward(self, x0):
+        h, w = x0.size()[-2:]
+        paddingBottom = -h % 8
+        paddingRight = -w % 8
+        if paddingBottom or paddingRight:
+            x0 = F.pad(x0, (0, paddingRight, 0, paddingBottom), mode='replicate')
+
+        with torch.no_grad():
+            x = self.body(x0)
+
+        return x[..., :h, :w]
+
+
+def load_quantized_model(model_path):
+    """Load a *_int8.pt model from quantize_drunet.py"""
+    body = torch.jit.load(model_path, map_location='cpu')
+    return QuantizedUNetRes(body).eval()
+
+
 if __name__ == '__main__':
     x = torch.rand(1,3,256,256)
     net = UNetRes()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2023
+#   Emilio Martinez <emilio.martinez@fing.edu.uy>
+#
+#   Instituto de Ingenieria Electrica, Facultad de Ingenieria,
+#   Universidad de la Republica, Uruguay.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+#
+"""
+Offline processing of IQ recordings, without GNU Radio.
+
+Turns a complex64 recording (.cfile, as written by a GNU Radio file sink)
+into frames, the same way buttonToFileSink does for a live flowgraph:
+
+    python offline_iq.py recording.cfile --sample_rate 50e6 --output frames/
+
+1. The recording is memory-mapped, only the samples of the processed
+   frames are read.
+2. Refresh rate and resolution are estimated with resolution.infer_resolution
+   (closest mode of modes.txt), unless given.
+3. Every frame is resampled to the pixel grid (H_size x V_size), real and
+   imaginary parts are stretched to [0,255] and, optionally, the blanking
+   is aligned with DTutils.apply_blanking_shift.
+4. Frames are written as PNG (as buttonToFileSink) or losslessly as
+   complex64 .npy / float16 .npz (utils_capture.save_capture), processed
+   in parallel by a pool of workers.
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+try:
+    from . import DTutils
+    from .resolution import load_iq, infer_resolution
+    from .timings import get_timing_by_total
+    from .utils_capture import save_capture
+except ImportError:
+    # Run as a script, outside of the tempest package (and GNU Radio)
+    import DTutils
+    from resolution import load_iq, infer_resolution
+    from timings import get_timing_by_total
+    from utils_capture import save_capture
+
+
+def frame_to_image(frame_complex):
+    """Capture as uint8 image, real/imag parts stretched as buttonToFileSink"""
+    captured_image = np.zeros(frame_complex.shape + (3,), dtype='float32')
+    captured_image[:,:,0] = np.real(frame_complex)
+    captured_image[:,:,1] = np.imag(frame_complex)
+    min_value, max_value = np.min(captured_image[:,:,:2]), np.max(captured_image[:,:,:2])
+    captured_image[:,:,:2] = 255*(captured_image[:,:,:2] - min_value) / max(max_value - min_value, 1e-12)
+    return captured_image.astype('uint8')
+
+def resample_frame(samples, n_pixels, method='fft'):
+    """Samples of one frame resampled to n_pixels points"""
+    if method == 'fft':
+        from scipy import signal
+        return signal.resample(samples, n_pixels).astype('complex64')
+    positions = np.linspace(0, len(samples) - 1, n_pixels)
+    grid = np.arange(len(samples))
+    return (np.interp(positions, grid, samples.real) + 1j*np.interp(positions, grid, samples.imag)).astype('complex64')
+
+
+# Recording and settings of the pool workers, set by _init_worker
+_worker = {}
+
+def _init_worker(path, settings):
+    _worker['iq'] = load_iq(path)
+    _worker['settings'] = settings
+
+def _process_frame(frame_index):
+    iq, settings = _worker['iq'], _worker['settings']
+    h_size, v_size = settings['h_size'], settings['v_size']
+
+    # Frame boundaries from the (fractional) frame length, no drift over long recordings
+    start = settings['offset'] + int(round(frame_index*settings['frame_samples']))
+    stop = settings['offset'] + int(round((frame_index + 1)*settings['frame_samples']))
+    frame = resample_frame(np.asarray(iq[start:stop]), h_size*v_size, settings['method']).reshape(v_size, h_size)
+
+    path = os.path.join(settings['output'], '{}_{:06d}'.format(settings['name'], frame_index))
+    if settings['format'] in ['npy', 'npz']:
+        save_capture(frame, path + '.' + settings['format'])
+        return path + '.' + settings['format']
+
+    image = frame_to_image(frame)
+    if settings['remove_blanking']:
+        image = DTutils.apply_blanking_shift(image, h_active=settings['h_active'], v_active=settings['v_active'],
+                                             h_blanking=h_size - settings['h_active'], v_blanking=v_size - settings['v_active'])
+        image = DTutils.adjust_dynamic_range(DTutils.remove_outliers(image))
+
+    from PIL import Image
+    Image.fromarray(image).save(path + '.png')
+    return path + '.png'
+
+def process_recording(path, sample_rate, output, h_size=None, v_size=None, refresh_rate=None,
+                      h_active=None, v_active=None, start=0.0, max_frames=None, step=1,
+                      file_format='png', remove_blanking=False, method='fft', workers=None):
+    """
+    Write the frames of an IQ recording to the output folder
+
+    Args:
+        sample_rate: sample rate of the recording [Hz]
+        h_size, v_size, refresh_rate: resolution, estimated if not given
+        h_active, v_active: active area for remove_blanking (default from the mode name)
+        start: first second of the recording to process
+        max_frames: number of frames to write (default all of the recording)
+        step: write one every step frames
+    """
+    iq = load_iq(path)
+    offset = int(start*sample_rate)
+
+    estimate = infer_resolution(iq, sample_rate, n_windows=4, start=offset)
+    frame_samples = estimate.frame_samples
+    if h_size is None or v_size is None:
+        h_size, v_size = estimate.h_size, estimate.v_size
+        if h_active is None:
+            # Same totals can be several modes of the table, the one with porches is used
+            timing = get_timing_by_total(h_size, v_size, estimate.refresh_rate)
+            h_active, v_active = (timing.h_active, timing.v_active) if timing is not None else (None, None)
+    if refresh_rate is not None:
+        frame_samples = sample_rate/refresh_rate
+    if remove_blanking and (h_active is None or v_active is None):
+        raise ValueError('h_active and v_active are needed to remove the blanking')
+
+    n_frames = int((len(iq) - offset) // frame_samples)
+    frame_indexes = list(range(0, n_frames, step))[:max_frames]
+    os.makedirs(output, exist_ok=True)
+
+    settings = {'h_size': h_size, 'v_size': v_size, 'h_active': h_active, 'v_active': v_active,
+                'offset': offset, 'frame_samples': frame_samples, 'method': method,
+                'format': file_format, 'remove_blanking': remove_blanking, 'output': output,
+                'name': os.path.splitext(os.path.basename(path))[0]}
+    print('[TEMPEST] {}: {:.3f} Hz, {:.1f} samples per frame, V_size estimate {:.1f} -> {}x{} '
+          '(closest mode {}, confidence {:.2f}, {} frames)'.format(
+          path, sample_rate/frame_samples, frame_samples, estimate.measured_v_size, h_size, v_size,
+          estimate.name, estimate.confidence, len(frame_indexes)))
+
+    with Pool(processes=workers, initializer=_init_worker, initargs=(path, settings)) as pool:
+        return list(pool.imap(_process_frame, frame_indexes))
+
+def main():
+    parser = argparse.ArgumentParser(description='Frames of an IQ recording, without GNU Radio')
+    parser.add_argument('recording', type=str, help='complex64 IQ file (.cfile)')
+    parser.add_argument('--sample_rate', type=float, required=True, help='Sample rate of the recording [Hz]')
+    parser.add_argument('--output', type=str, default='frames', help='Output folder')
+    parser.add_argument('--resolution', type=int, nargs=2, default=None, metavar=('H_SIZE', 'V_SIZE'),
+                        help='Total resolution, with blanking (estimated if not given)')
+    parser.add_argument('--active', type=int, nargs=2, default=None, metavar=('H_ACTIVE', 'V_ACTIVE'),
+                        help='Active resolution, needed by --remove_blanking with --resolution')
+    parser.add_argument('--refresh_rate', type=float, default=None, help='Refresh rate [Hz] (estimated if not given)')
+    parser.add_argument('--start', type=float, default=0.0, help='Start time [s]')
+    parser.add_argument('--frames', type=int, default=None, help='Number of frames to write')
+    parser.add_argument('--step', type=int, default=1, help='Write one every STEP frames')
+    parser.add_argument('--format', type=str, default='png', choices=['png', 'npy', 'npz'],
+                        help='Stretched uint8 png, or lossless complex64 npy / float16 npz (utils_capture)')
+    parser.add_argument('--remove_blanking', action='store_true', help='Align the blanking as buttonToFileSink')
+    parser.add_argument('--method', type=str, default='fft', choices=['fft', 'linear'], help='Resampling to the pixel grid')
+    parser.add_argument('--workers', type=int, default=None, help='Parallel processes (default number of CPUs)')
+    args = parser.parse_args()
+
+    h_size, v_size = args.resolution if args.resolution else (None, None)
+    h_active, v_active = args.active if args.active else (None, None)
+
+    t0 = time.time()
+    paths = process_recording(args.recording, args.sample_rate, args.output, h_size=h_size, v_size=v_size,
+                              refresh_rate=args.refresh_rate, h_active=h_active, v_active=v_active,
+                              start=args.start, max_frames=args.frames, step=args.step,
+                              file_format=args.format, remove_blanking=args.remove_blanking,
+                              method=args.method, workers=args.workers)
+    elapsed = time.time() - t0
+    duration = len(load_iq(args.recording))/args.sample_rate
+    print('[TEMPEST] {} frames written to {} in {:.1f}s ({:.1f}s of recording, x{:.1f} real time)'.format(
+          len(paths), args.output, elapsed, duration, duration/elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2023
+#   Emilio Martinez <emilio.martinez@fing.edu.uy>
+#
+#   Instituto de Ingenieria Electrica, Facultad de Ingenieria,
+#   Universidad de la Republica, Uruguay.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+#
+"""
+Screen resolution of an IQ recording, from Python.
+
+Same measurement as the infer screen resolution block (frame and line
+periods are the autocorrelation peaks of the signal magnitude, the
+resolution is looked up in modes.txt), but over many windows at once:
+
+    estimate = infer_resolution('recording.cfile', sample_rate=50e6)
+    print(estimate.name, estimate.h_size, estimate.v_size, estimate.confidence)
+
+    for start_time, estimate in scan_resolution('recording.cfile', 50e6, chunk_seconds=10):
+        ...
+
+Windows are taken along the whole recording (memory-mapped), their
+magnitude is block-averaged and all their autocorrelations are computed
+with one batched FFT. Peaks are searched for every window at once, and
+the per-window measurements are combined with their median.
+
+From the command line, one estimate per chunk of the recording:
+
+    python resolution.py recording.cfile --sample_rate 50e6 --chunk 10
+"""
+
+import time
+import argparse
+import collections
+import numpy as np
+
+try:
+    from .timings import load_timings
+except ImportError:
+    # Run as a script, outside of the tempest package
+    from timings import load_timings
+
+# Search ranges, as the infer screen resolution block
+REFRESH_RANGE = (24, 120)
+V_SIZE_RANGE = (350, 1225)
+
+# Relative measurement errors used to score the modes of the table
+REFRESH_TOLERANCE = 0.01
+V_SIZE_TOLERANCE = 0.02
+
+ResolutionEstimate = collections.namedtuple('ResolutionEstimate', [
+    'name', 'h_size', 'v_size', 'refresh_rate',           # closest mode of modes.txt
+    'measured_refresh_rate', 'frame_samples', 'measured_v_size',
+    'confidence', 'n_windows'])
+
+
+def load_iq(path, dtype=np.complex64):
+    """Memory-mapped IQ recording"""
+    return np.memmap(path, dtype=dtype, mode='r')
+
+def merge_modes(modes):
+    """
+    Modes with distinct (H_size, V_size, refresh_rate), the first of each.
+    Modes with the same totals and refresh rate can not be told apart by
+    the measurements, scoring them all would split their posterior.
+    """
+    merged = {}
+    for mode in modes:
+        merged.setdefault(tuple(mode[1:4]), mode)
+    return list(merged.values())
+
+def read_modes(path=None):
+    """
+    List of (name, H_size, V_size, refresh_rate) of the modes table (see timings),
+    merged: modes with porches first, as timings.get_timing_by_total
+    """
+    timings = sorted(load_timings(path), key=lambda t: t.h_front_porch is None)
+    return merge_modes([(t.name, t.h_total, t.v_total, t.refresh_rate) for t in timings])
+
+def score(refresh_rate, v_size, mode_refresh_rate, mode_v_size):
+    """Likelihood of a mode for a measured refresh rate and V_size (broadcasts)"""
+    distance = ((mode_refresh_rate - refresh_rate)/(REFRESH_TOLERANCE*refresh_rate))**2 \
+               + ((mode_v_size - v_size)/(V_SIZE_TOLERANCE*v_size))**2
+    return np.exp(-0.5*distance)
+
+def mode_scores(refresh_rate, v_size, modes=None):
+    """Likelihood of every mode of the table"""
+    if modes is None:
+        modes = read_modes()
+    table = np.array([[mode[3], mode[2]] for mode in modes])
+    return score(refresh_rate, v_size, table[:, 0], table[:, 1])
+
+def nearest_mode(refresh_rate, v_size, modes=None):
+    """Mode of the table closest to the estimated refresh rate and V_size"""
+    if modes is None:
+        modes = read_modes()
+    errors = [abs(mode[3] - refresh_rate)/refresh_rate + abs(mode[2] - v_size)/v_size for mode in modes]
+    return modes[int(np.argmin(errors))]
+
+
+# ----------------------------------------
+# Batched autocorrelation and peak search
+# ----------------------------------------
+def batched_autocorr(segments):
+    """
+    FFT autocorrelation of every row of segments (n_segments, n), positive
+    lags only, normalized to 1 at lag 0
+    """
+    segments = segments - segments.mean(axis=1, keepdims=True)
+    n = segments.shape[1]
+    spectrum = np.fft.rfft(segments, n=2*n, axis=1)
+    autocorr = np.fft.irfft(spectrum.real**2 + spectrum.imag**2, axis=1)[:, :n]
+    return autocorr / np.maximum(autocorr[:, :1], np.finfo(autocorr.dtype).tiny)
+
+def refine_peaks(autocorr, indexes):
+    """Sub-sample peak positions (one per row) by parabolic interpolation"""
+    rows = np.arange(autocorr.shape[0])
+    indexes = np.clip(indexes, 1, autocorr.shape[1] - 2)
+    y0, y1, y2 = autocorr[rows, indexes-1], autocorr[rows, indexes], autocorr[rows, indexes+1]
+    denominator = y0 - 2*y1 + y2
+    offset = np.where(denominator != 0, 0.5*(y0 - y2)/np.where(denominator != 0, denominator, 1), 0.0)
+    return indexes + np.clip(offset, -0.5, 0.5)
+
+def lowest_lag_peaks(autocorr, lag_min, lag_max, ratio=0.8):
+    """
+    Highest peak of every row between lag_min and lag_max (scalars or one per
+    row), replaced by the peak of its smallest submultiple if it is almost as
+    high (avoids a multiple of the period)
+    """
+    n_rows, n_lags = autocorr.shape
+    rows = np.arange(n_rows)
+    lag_min = np.clip(np.broadcast_to(np.asarray(lag_min, dtype=int), (n_rows,)), 1, n_lags - 1)
+    lag_max = np.clip(np.broadcast_to(np.asarray(lag_max, dtype=int), (n_rows,)), lag_min + 1, n_lags)
+
+    lags = np.arange(n_lags)
+    in_range = (lags >= lag_min[:, None]) & (lags < lag_max[:, None])
+    peaks = np.argmax(np.where(in_range, autocorr, -np.inf), axis=1)
+    heights = autocorr[rows, peaks]
+
+    # Largest divisor first, so the smallest submultiple wins
+    result = peaks.copy()
+    resolved = np.zeros(n_rows, dtype=bool)
+    offsets = np.arange(-2, 3)
+    for divisor in (4, 3, 2):
+        candidates = np.round(peaks / divisor).astype(int)
+        windows = np.clip(candidates[:, None] + offsets, 0, n_lags - 1)
+        window_values = autocorr[rows[:, None], windows]
+        found = ~resolved & (candidates >= lag_min) & (window_values.max(axis=1) >= ratio*heights)
+        result[found] = windows[found, np.argmax(window_values[found], axis=1)]
+        resolved |= found
+    return result
+
+def window_magnitudes(iq, starts, window_len, decimation):
+    """Block-averaged magnitude of the windows (n_windows, window_len // decimation)"""
+    n = window_len // decimation
+    magnitudes = np.empty((len(starts), n), dtype='float32')
+    for i, start in enumerate(starts):
+        segment = np.abs(np.asarray(iq[start:start + n*decimation]))
+        magnitudes[i] = segment.reshape(n, decimation).mean(axis=1)
+    return magnitudes
+
+def measure_windows(iq, sample_rate, starts, window_len, decimation, refresh_range=REFRESH_RANGE, batch_size=8):
+    """
+    Frame period and V_size of every window
+
+    Returns:
+        frame_samples (n_windows,) [samples], v_size (n_windows,), peak heights (n_windows,)
+    """
+    frame_samples, v_size, heights = [], [], []
+    rate = sample_rate / decimation
+    for i in range(0, len(starts), batch_size):
+        autocorr = batched_autocorr(window_magnitudes(iq, starts[i:i+batch_size], window_len, decimation))
+        rows = np.arange(autocorr.shape[0])
+
+        # Frame period: peak among the lags of the possible refresh rates
+        frame_peaks = lowest_lag_peaks(autocorr, rate/refresh_range[1], rate/refresh_range[0])
+        frames = refine_peaks(autocorr, frame_peaks)
+
+        # Line period: peak among the lags of the possible V_size, for each frame period
+        line_peaks = lowest_lag_peaks(autocorr, frames/V_SIZE_RANGE[1], frames/V_SIZE_RANGE[0])
+        lines = refine_peaks(autocorr, line_peaks)
+
+        frame_samples.append(frames*decimation)
+        v_size.append(frames/lines)
+        heights.append(autocorr[rows, frame_peaks])
+    return np.concatenate(frame_samples), np.concatenate(v_size), np.concatenate(heights)
+
+def auto_decimation(sample_rate, refresh_range=REFRESH_RANGE, min_line_lag=64):
+    """Largest decimation keeping at least min_line_lag samples per line"""
+    shortest_line = sample_rate / (refresh_range[1]*V_SIZE_RANGE[1])
+    return max(1, int(shortest_line // min_line_lag))
+
+
+# ----------------------------------------
+# API
+# ----------------------------------------
+def estimate_from_measurements(frame_samples, v_size, heights, sample_rate, modes=None):
+    """Combine the per-window measurements and look the resolution up in modes.txt"""
+    modes = read_modes() if modes is None else merge_modes(modes)
+
+    # Windows without a clear periodicity (no frame peak) do not vote
+    valid = heights > 0
+    if not np.any(valid):
+        valid = np.ones_like(heights, dtype=bool)
+    frame = float(np.median(frame_samples[valid]))
+    lines = float(np.median(v_size[valid]))
+    refresh_rate = sample_rate / frame
+
+    scores = mode_scores(refresh_rate, lines, modes)
+    if scores.sum() > 0:
+        best = int(np.argmax(scores))
+        posterior = scores[best] / scores.sum()
+    else:
+        best = modes.index(nearest_mode(refresh_rate, lines, modes))
+        posterior = 0.0
+
+    # Fraction of the windows within 3 tolerances of the chosen mode
+    window_scores = score(sample_rate/frame_samples[valid], v_size[valid], modes[best][3], modes[best][2])
+    agreement = float(np.mean(window_scores > np.exp(-0.5*9)))
+
+    name, h_size, v_total, mode_rate = modes[best]
+    return ResolutionEstimate(name=name, h_size=h_size, v_size=v_total, refresh_rate=mode_rate,
+                              measured_refresh_rate=refresh_rate, frame_samples=frame, measured_v_size=lines,
+                              confidence=float(posterior*agreement), n_windows=int(valid.sum()))
+
+def infer_resolution(iq, sample_rate, n_windows=64, frames_per_window=2.5, start=0, stop=None,
+                     refresh_range=REFRESH_RANGE, decimation=None, batch_size=8, modes=None):
+    """
+    Resolution of an IQ recording
+
+    Args:
+        iq: complex IQ array or path of a complex64 recording (.cfile)
+        sample_rate: sample rate [Hz]
+        n_windows: windows spread over [start, stop) (the block averages 64 measurements)
+        frames_per_window: window length, in frames of the lowest refresh rate
+        start, stop: samples of the recording to use
+        decimation: magnitude block-averaging factor, automatic if None
+        batch_size: autocorrelations computed per FFT call
+
+    Returns:
+        ResolutionEstimate, confidence in [0,1] is the table posterior of the
+        mode times the fraction of windows agreeing with it
+    """
+    if isinstance(iq, str):
+        iq = load_iq(iq)
+    if decimation is None:
+        decimation = auto_decimation(sample_rate, refresh_range)
+    stop = len(iq) if stop is None else min(stop, len(iq))
+
+    window_len = int(frames_per_window*sample_rate/refresh_range[0])
+    if stop - start < window_len:
+        raise ValueError('Recording too short, at least {} samples are needed'.format(window_len))
+    n_windows = max(1, min(n_windows, (stop - start)//window_len))
+    starts = np.linspace(start, stop - window_len, n_windows).astype(int)
+
+    measurements = measure_windows(iq, sample_rate, starts, window_len, decimation, refresh_range, batch_size)
+    return estimate_from_measurements(*measurements, sample_rate=sample_rate, modes=modes)
+
+def scan_resolution(iq, sample_rate, chunk_seconds=10.0, windows_per_chunk=4, **kwargs):
+    """
+    Resolution of every chunk of a long recording
+
+    Yields:
+        (start_time [s], ResolutionEstimate) for every chunk_seconds of the recording
+    """
+    if isinstance(iq, str):
+        iq = load_iq(iq)
+    chunk_len = int(chunk_seconds*sample_rate)
+    for start in range(0, len(iq), chunk_len):
+        try:
+            estimate = infer_resolution(iq, sample_rate, n_windows=windows_per_chunk, start=start,
+                                        stop=start + chunk_len, **kwargs)
+        except ValueError:
+            # Last chunk shorter than a window
+            break
+        yield start/sample_rate, estimate
+
+def main():
+    parser = argparse.ArgumentParser(description='Screen resolution of an IQ recording')
+    parser.add_argument('recording', type=str, help='complex64 IQ file (.cfile)')
+    parser.add_argument('--sample_rate', type=float, required=True, help='Sample rate of the recording [Hz]')
+    parser.add_argument('--chunk', type=float, default=None, help='One estimate every CHUNK seconds (default whole recording)')
+    parser.add_argument('--windows', type=int, default=64, help='Autocorrelation windows per estimate')
+    parser.add_argument('--decimation', type=int, default=None, help='Magnitude decimation (default automatic)')
+    args = parser.parse_args()
+
+    iq = load_iq(args.recording)
+    t0 = time.time()
+    if args.chunk is None:
+        estimates = [(0.0, infer_resolution(iq, args.sample_rate, n_windows=args.windows, decimation=args.decimation))]
+    else:
+        estimates = scan_resolution(iq, args.sample_rate, chunk_seconds=args.chunk, windows_per_chunk=args.windows,
+                                    decimation=args.decimation)
+    for start_time, estimate in estimates:
+        print('[TEMPEST] {:8.1f}s  {}  Hsize {}  Vsize {}  | measured {:.3f} Hz, Vsize {:.1f}  | confidence {:.2f}'.format(
+              start_time, estimate.name, estimate.h_size, estimate.v_size, estimate.measured_refresh_rate,
+              estimate.measured_v_size, estimate.confidence))
+    duration = len(iq)/args.sample_rate
+    print('[TEMPEST] {:.1f}s of recording scanned in {:.1f}s'.format(duration, time.time() - t0))
+
+
+if __name__ == '__main__':
+    main()
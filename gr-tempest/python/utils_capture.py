@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2023
+#   Emilio Martinez <emilio.martinez@fing.edu.uy>
+#
+#   Instituto de Ingenieria Electrica, Facultad de Ingenieria,
+#   Universidad de la Republica, Uruguay.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+#
+"""
+Lossless storage of complex captures.
+
+The PNG captures stretch real and imaginary parts to uint8 channels (8 bits,
+amplitudes lost) and every read decodes the PNG. Captures can be saved
+instead as:
+
+    capture.npy     complex64 (H, W), the samples as captured
+    capture.npz     float16 (H, W, 2) real/imag pairs stretched to [0,1] as
+                    the PNG captures (11 bits), with the 'scale' and 'offset'
+                    giving back the amplitudes: capture*scale + offset
+
+Both are memory-mapped on read (the .npz is written uncompressed), there is
+no decoding. The format is chosen by the file extension. Same file in
+end-to-end/utils/utils_capture.py, keep both in sync.
+
+    save_capture(I, 'capture.npz')
+    I = read_capture('capture.npz')            # complex (H, W)
+    img_L = imread_capture('capture.npz')      # float32 (H, W, 2), as the PNG channels
+"""
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+CAPTURE_EXTENSIONS = ['.npy', '.npz']
+IMG_EXTENSIONS = ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP', '.tif']
+
+
+def is_capture_file(filename):
+    return any(filename.endswith(extension) for extension in CAPTURE_EXTENSIONS)
+
+
+def stretch_parameters(I):
+    """(scale, offset) of the min-max stretch of real and imaginary parts of I to [0,1]"""
+    offset = min(np.min(I.real), np.min(I.imag))
+    scale = max(np.max(I.real), np.max(I.imag)) - offset
+    return float(scale) if scale > 0 else 1.0, float(offset)
+
+
+# --------------------------------------------
+# write
+# --------------------------------------------
+def save_capture(I, path):
+    """Save the complex capture I (H, W) as .npy (complex64) or .npz (float16 pairs)"""
+    ext = os.path.splitext(path)[1]
+    if ext == '.npy':
+        np.save(path, np.asarray(I, dtype='complex64'))
+    elif ext == '.npz':
+        scale, offset = stretch_parameters(I)
+        pairs = np.stack([I.real, I.imag], axis=2)
+        pairs = ((pairs - offset)/scale).astype('float16')
+        # Uncompressed (np.savez), so 'capture' can be memory-mapped
+        np.savez(path, capture=pairs, scale=np.float64(scale), offset=np.float64(offset))
+    else:
+        raise ValueError('Capture format [{:s}] is not supported, use {}'.format(ext, CAPTURE_EXTENSIONS))
+
+
+# --------------------------------------------
+# read
+# --------------------------------------------
+def _npz_memmap(path, name):
+    """Read-only np.memmap of the uncompressed array name of an .npz file, None if compressed"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(path, 'rb') as f:
+        # Skip the zip local file header, then read the .npy header
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def read_capture_pairs(path, mmap=True):
+    """
+    Stored array and (scale, offset) of a capture file
+
+    Returns:
+        capture: complex64 (H, W) for .npy, float16 (H, W, 2) for .npz
+        scale, offset: capture*scale + offset are the amplitudes (1, 0 for .npy)
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r' if mmap else None), 1.0, 0.0
+    if ext == '.npz':
+        with np.load(path) as data:
+            scale, offset = float(data['scale']), float(data['offset'])
+            capture = _npz_memmap(path, 'capture') if mmap else None
+            if capture is None:
+                capture = data['capture']
+        return capture, scale, offset
+    raise ValueError('Capture format [{:s}] is not supported, use {}'.format(ext, CAPTURE_EXTENSIONS))
+
+
+def read_capture(path, mmap=True):
+    """Complex capture (H, W) of a .npy/.npz file"""
+    capture, scale, offset = read_capture_pairs(path, mmap)
+    if np.iscomplexobj(capture):
+        return capture
+    capture = capture.astype('float32')*scale + offset
+    return capture[:,:,0] + 1j*capture[:,:,1]
+
+
+def capture_channels(capture, normalization='stretch'):
+    """Real and imaginary channels (H, W, 2) float32 of a complex capture, see imread_capture"""
+    pairs = np.stack([capture.real, capture.imag], axis=2).astype('float32')
+    if normalization == 'stretch':
+        scale, offset = stretch_parameters(capture)
+        return 255*(pairs - offset)/scale
+    return pairs
+
+
+def imread_capture(path, normalization='stretch'):
+    """
+    Real and imaginary channels (H, W, 2) float32 of a capture, any format
+
+    Args:
+        normalization: 'stretch', min-max stretched to [0,255] as the uint8 PNG
+                       captures (the range the models are trained on), or 'raw',
+                       the captured amplitudes (the uint8 values for PNG captures)
+    """
+    if not is_capture_file(path):
+        from PIL import Image
+        return np.array(Image.open(path))[:,:,:2].astype('float32')
+
+    capture, scale, offset = read_capture_pairs(path)
+    if np.iscomplexobj(capture):
+        return capture_channels(capture, normalization)
+
+    # float16 pairs are already stretched to [0,1]
+    if normalization == 'stretch':
+        return 255*capture.astype('float32')
+    return capture.astype('float32')*scale + offset
+
+
+# --------------------------------------------
+# dataset paths
+# --------------------------------------------
+def get_capture_paths(dataroot):
+    """Sorted paths of the captures of a folder (or list of folders), images or .npy/.npz, recursively"""
+    roots = [dataroot] if isinstance(dataroot, str) else dataroot
+    paths = []
+    for root in roots:
+        assert os.path.isdir(root), '{:s} is not a valid directory'.format(root)
+        root_paths = [os.path.join(dirpath, fname) for dirpath, _, fnames in sorted(os.walk(root))
+                      for fname in sorted(fnames) if is_capture_file(fname) or
+                      any(fname.endswith(extension) for extension in IMG_EXTENSIONS)]
+        assert root_paths, '{:s} has no valid capture file'.format(root)
+        paths += sorted(root_paths)
+    return paths
@@ -10,7 +10,10 @@ import torch.multiprocessing as mp
 # ----------------------------------
 # init
 # ----------------------------------
-def init_dist(launcher, backend='nccl', **kwargs):
+def init_dist(launcher, backend=None, **kwargs):
+    # nccl needs GPUs, use gloo on CPU-only machines
+    if backend is None:
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
     if mp.get_start_method(allow_none=True) is None:
         mp.set_start_method('spawn')
     if launcher == 'pytorch':
@@ -22,10 +25,13 @@ def init_dist(launcher, backend='nccl', **kwargs):
 
 
 def _init_dist_pytorch(backend, **kwargs):
+    # RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT set by torchrun
     rank = int(os.environ['RANK'])
-    num_gpus = torch.cuda.device_count()
-    torch.cuda.set_device(rank % num_gpus)
-    dist.init_process_group(backend=backend, **kwargs)
+    if backend == 'nccl':
+        num_gpus = torch.cuda.device_count()
+        local_rank = int(os.environ.get('LOCAL_RANK', rank % num_gpus))
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend=backend, init_method='env://', **kwargs)
 
 
 def _init_dist_slurm(backend, port=None):
@@ -40,8 +46,9 @@ def _init_dist_slurm(backend, port=None):
     proc_id = int(os.environ['SLURM_PROCID'])
     ntasks = int(os.environ['SLURM_NTASKS'])
     node_list = os.environ['SLURM_NODELIST']
-    num_gpus = torch.cuda.device_count()
-    torch.cuda.set_device(proc_id % num_gpus)
+    num_gpus = max(torch.cuda.device_count(), 1)
+    if backend == 'nccl':
+        torch.cuda.set_device(proc_id % num_gpus)
     addr = subprocess.getoutput(
         f'scontrol show hostname {node_list} | head -n1')
     # specify master port
@@ -1,42 +1,82 @@
 import os
-from datetime import date
+import time
 import random
-import string
-from text_utils import generate_random_txt_img
+import argparse
+from datetime import date
+from multiprocessing import Pool
+from text_utils import generate_random_txt_img, random_text, font_catalog
 
 NUM_IMAGES = 10
 NUM_CHARACTERS = 29000
 IMG_SHAPE = (1600,900)
 TEXT_SIZE = 22
 
-today = date.today()
+images_name = "generated_text"
 
-# Month abbreviation, day and year	
-save_path = today.strftime("%b-%d-%Y")
+def generate_image(job):
+    """Image i of the set, the same for the same seed whatever the worker"""
+    i, seed, save_path, num_characters, img_shape, text_size = job
+    rng = random.Random('{}-{}'.format(seed, i))
 
-if not os.path.exists(save_path):
-    os.mkdir(save_path)
-else:
-    i = 2
-    save_path_tmp = save_path + str(i)
-    while os.path.exists(save_path_tmp):
-        i+=1
-        save_path_tmp = save_path + str(i)
+    text = random_text(num_characters, rng)
 
-images_name = "generated_text"
+    text_color = rng.choices(["black","white"], weights=(70, 30), k=1)[0]
+    background_color = "black"*(text_color=="white") + "white"*(text_color=="black")
 
-for i in range(NUM_IMAGES):
+    image_path = os.path.join(save_path,images_name+str(i)+".png")
+    generate_random_txt_img(text,
+                            img_shape,
+                            text_size,
+                            text_color,
+                            background_color,
+                            image_path,
+                            rng)
+    return image_path
 
-    text = ''.join(random.choices(string.ascii_letters +
-                                string.digits, k=NUM_CHARACTERS))
-    
-    text_color = random.choices(["black","white"], weights=(70, 30), k=1)[0]
-    background_color = "black"*(text_color=="white") + "white"*(text_color=="black")
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate random text images (ground-truth of the simulations)')
+    parser.add_argument('--num_images', type=int, default=NUM_IMAGES, help='number of images')
+    parser.add_argument('--num_characters', type=int, default=NUM_CHARACTERS, help='characters per image')
+    parser.add_argument('--img_shape', type=int, nargs=2, default=IMG_SHAPE, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--text_size', type=int, default=TEXT_SIZE, help='font size')
+    parser.add_argument('--output', type=str, default=None, help='output folder (default a new folder named by date)')
+    parser.add_argument('--start', type=int, default=0, help='index of the first image (resume a set)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the set, same images for the same seed')
+    parser.add_argument('--workers', type=int, default=None, help='parallel processes (default number of CPUs)')
+    parser.add_argument('--refresh_fonts', action='store_true', help='scan the system fonts again')
+    args = parser.parse_args()
+
+    save_path = args.output
+    if save_path is None:
+        # Month abbreviation, day and year
+        save_path = date.today().strftime("%b-%d-%Y")
+        i = 2
+        save_path_tmp = save_path
+        while os.path.exists(save_path_tmp):
+            save_path_tmp = save_path + str(i)
+            i+=1
+        save_path = save_path_tmp
+    os.makedirs(save_path, exist_ok=True)
+
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print('Generating {} images in {} (seed {})'.format(args.num_images, save_path, seed))
+
+    # Scan the system fonts once, workers read the saved catalog
+    font_catalog(refresh=args.refresh_fonts)
+
+    jobs = [(i, seed, save_path, args.num_characters, tuple(args.img_shape), args.text_size)
+            for i in range(args.start, args.start + args.num_images)]
 
-    generate_random_txt_img(text, 
-                            IMG_SHAPE, 
-                            TEXT_SIZE, 
-                            text_color, 
-                            background_color, 
-                            os.path.join(save_path,images_name+str(i)+".png"))
+    t0 = time.time()
+    if args.workers == 1:
+        for job in jobs:
+            generate_image(job)
+    else:
+        with Pool(processes=args.workers) as pool:
+            for _ in pool.imap_unordered(generate_image, jobs, chunksize=4):
+                pass
+    print('{} images generated in {:.1f}s'.format(len(jobs), time.time()-t0))
 
+if __name__ == "__main__":
+    main()
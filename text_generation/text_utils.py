@@ -1,9 +1,63 @@
 from PIL import Image, ImageDraw, ImageFont
+import os
+import json
 import random
 import string
+import functools
 from matplotlib import font_manager
 
-def generate_random_txt_img(text, img_shape, text_size, text_color, background_color, save_path):
+# Fixed font when a font can not be loaded
+FALLBACK_FONT = "/usr/share/fonts/truetype/liberation2/LiberationSans-BoldItalic.ttf"
+
+# Non-readable fonts, filtered out of the system fonts
+EXCLUDED_FONTS = ["lohit", "kacst", "Navilu", "telu", "lyx", "malayalam", "tlwg", "samyak", "droid",
+                  "kalapi", "openoffice", "orya"]
+
+# System fonts list, scanned once and saved here
+FONT_CATALOG_PATH = os.environ.get('TEXT_FONT_CATALOG',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'deep-tempest', 'fonts.json'))
+
+def scan_fonts():
+    """Readable .ttf system fonts (full filesystem scan)"""
+    system_fonts = font_manager.findSystemFonts()
+    ttf_fonts = [font for font in system_fonts if (".ttf" in font) and not any(name in font for name in EXCLUDED_FONTS)]
+    return sorted(ttf_fonts)
+
+@functools.lru_cache(maxsize=None)
+def font_catalog(catalog_path=FONT_CATALOG_PATH, refresh=False):
+    """
+    Readable system fonts, read from catalog_path (the system is scanned only
+    when the catalog does not exist, or refresh)
+    """
+    if not refresh and os.path.exists(catalog_path):
+        with open(catalog_path, 'r') as f:
+            ttf_fonts = json.load(f)
+        # Rescan when fonts were removed since the catalog was saved
+        if all(os.path.exists(font) for font in ttf_fonts):
+            return tuple(ttf_fonts)
+
+    ttf_fonts = scan_fonts()
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(catalog_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(ttf_fonts, f, indent=1)
+    os.replace(tmp_path, catalog_path)
+    return tuple(ttf_fonts)
+
+@functools.lru_cache(maxsize=256)
+def load_font(font, size):
+    """FreeTypeFont of font with size, loaded once per (font, size)"""
+    try:
+        return ImageFont.truetype(font=font, size=size)
+    except:
+        # Load a fixed font when crashes
+        return ImageFont.truetype(FALLBACK_FONT, size=size)
+
+def random_text(num_characters, rng=random):
+    return ''.join(rng.choices(string.ascii_letters + string.digits, k=num_characters))
+
+def render_random_txt_img(text, img_shape, text_size, text_color, background_color, rng=random):
+    """PIL image of text, one random font per line, and the text of the rendered lines"""
     # Create white plain image
     imagen = Image.new("RGB", img_shape, background_color)
     dibujo = ImageDraw.Draw(imagen)
@@ -13,35 +67,35 @@ def generate_random_txt_img(text, img_shape, text_size, text_color, background_c
     N_lines = N_total//img_shape[1]
     N_horizontal = int(1.6 * img_shape[0] // (text_size))
 
-    # Get system font types
-    system_fonts = font_manager.findSystemFonts()
-    # Filter out some non-readable fonts
-    ttf_fonts = [font for font in system_fonts if ((".ttf" in font) and ("lohit" not in font) and ("kacst" not in font)) and  ("Navilu" not in font) and ("telu" not in font) and ("lyx" not in font) and ("malayalam" not in font) and ("tlwg" not in font) and ("samyak" not in font) and ("droid" not in font) and ("kalapi" not in font) and ("openoffice" not in font) and ("orya" not in font)]
+    # Get system font types (filtered, cached catalog)
+    ttf_fonts = font_catalog()
 
     # Write over image one font per line
+    lines = []
     for iter in range(N_lines):
-        rnd_font_index = random.randint(0,len(ttf_fonts)-1)
+        rnd_font_index = rng.randint(0,len(ttf_fonts)-1)
         random_font = ttf_fonts[rnd_font_index]
         # print(f"Font N {iter}: {random_font}")
 
         # Load text font and set size
-        try:
-            fuente = ImageFont.truetype(font=random_font, size=text_size)
-        except:
-            # Load a fixed font when crashes
-            fuente = ImageFont.truetype("/usr/share/fonts/truetype/liberation2/LiberationSans-BoldItalic.ttf", size=text_size)
+        fuente = load_font(random_font, text_size)
 
         # Get line text
         texto_linea = text[iter * N_horizontal : (iter+1) * N_horizontal]
 
         # Adjust text position
-        posicion_texto = ((imagen.width - fuente.getsize(texto_linea)[0]) // 2, 
+        posicion_texto = ((imagen.width - fuente.getsize(texto_linea)[0]) // 2,
                           int(1.25* iter * text_size)
                           )
 
         # Write text
         dibujo.text(posicion_texto, texto_linea, font=fuente, fill=text_color)
+        lines.append(texto_linea)
+
+    return imagen, ' '.join(lines)
+
+def generate_random_txt_img(text, img_shape, text_size, text_color, background_color, save_path, rng=random):
+    imagen, _ = render_random_txt_img(text, img_shape, text_size, text_color, background_color, rng)
 
     # Save image
     imagen.save(save_path)
-